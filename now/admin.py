@@ -1,9 +1,64 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.http import HttpResponseRedirect
+from django.urls import reverse
+from django.utils import timezone
 
-from .models import *
+from .models import Category, City, CustomUser, Event, Job, UserJoinEvent, WaitlistEntry
+from .forms import UserJoinEventAdminForm
+from .pagination import EstimatedCountPaginator
+from .search import filter_events
+from .services import join_event, leave_event
 
 
-class CustomUserAdmin(admin.ModelAdmin):
+class _NotJoined(Exception):
+    """Raised in save_model to roll back the admin transaction of membership which was not added"""
+
+
+class LargeTableAdminMixin:
+    """class LargeTableAdminMixin using for changelists of tables with many rows."""
+
+    # Planner estimate on PostgreSQL or cached COUNT(*) elsewhere instead of COUNT(*) on every page
+    paginator = EstimatedCountPaginator
+    # Do not count the unfiltered table next to the filtered result
+    show_full_result_count = False
+
+
+class InputFilter(admin.SimpleListFilter):
+    """class InputFilter using for filter by value typed in text input instead of list of every object."""
+
+    template = 'admin/now/input_filter.html'
+    # Indexed lookup the typed value is applied to
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        # Filter is shown only when there is at least one choice
+        return (('', ''),)
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = [(key, value) for key, value in changelist.get_filters_params().items()
+                                     if key != self.parameter_name]
+        yield all_choice
+
+
+class EventSlugFilter(InputFilter):
+    title = 'событию (URL)'
+    parameter_name = 'event_slug'
+    lookup = 'event__slug'
+
+
+class UsernameFilter(InputFilter):
+    title = 'пользователю (логин)'
+    parameter_name = 'username'
+    lookup = 'user__username'
+
+
+class CustomUserAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'id',
         'username',
@@ -17,51 +72,71 @@ class CustomUserAdmin(admin.ModelAdmin):
         'id',
         'username'
     )
+    # Prefix lookups on unique columns, LIKE 'text%' is served by their indexes
     search_fields = (
-        'username',
-        'bio',
-        'location'
+        'username__startswith',
+        'slug__startswith'
     )
+    search_help_text = 'Поиск по началу логина или URL'
     list_editable = (
         'location',
     )
     list_filter = (
-        'location',
-        'date_joined'
+        'date_joined',
     )
     prepopulated_fields = {
         'slug': ('username',)
     }
 
 
-class EventAdmin(admin.ModelAdmin):
+class EventAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'id',
         'title',
         'time_create',
         'time_update',
         'photo',
-        'is_published'
+        'is_published',
+        'attendee_count',
+        'capacity',
+        'starts_at',
+        'is_archived'
     )
     list_display_links = (
         'id',
         'title'
     )
+    readonly_fields = (
+        'attendee_count',
+    )
+    autocomplete_fields = (
+        'user',
+        'city'
+    )
+    # Prefix of the unique slug index, used as is by the event autocomplete of memberships and waitlists
     search_fields = (
-        'title',
-        'content'
+        'slug__startswith',
     )
+    search_help_text = 'Поиск по словам названия и описания или по началу URL события'
     list_editable = (
         'is_published',
     )
     list_filter = (
         'is_published',
+        'is_archived',
         'time_update'
     )
     prepopulated_fields = {
         'slug': ('title',)
     }
 
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term and request.path != reverse('admin:autocomplete'):
+            # Changelist also finds events by words of title and content through the full-text index
+            results |= filter_events(queryset, search_term)
+        return results, may_have_duplicates
+
 
 class CategoryAdmin(admin.ModelAdmin):
     list_display = (
@@ -80,7 +155,26 @@ class CategoryAdmin(admin.ModelAdmin):
     }
 
 
-class UserJoinEventAdmin(admin.ModelAdmin):
+class CityAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'name',
+        'latitude',
+        'longitude'
+    )
+    list_display_links = (
+        'id',
+        'name'
+    )
+    search_fields = (
+        'name',
+    )
+    prepopulated_fields = {
+        'slug': ('name',)
+    }
+
+
+class UserJoinEventAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = (
         'event',
         'user'
@@ -89,19 +183,129 @@ class UserJoinEventAdmin(admin.ModelAdmin):
         'event',
         'user'
     )
+    list_select_related = (
+        'event',
+        'user'
+    )
     search_fields = (
+        'event__slug__startswith',
+        'user__username__startswith'
+    )
+    search_help_text = 'Поиск по началу URL события или логина'
+    list_filter = (
+        EventSlugFilter,
+        UsernameFilter
+    )
+    autocomplete_fields = (
+        'event',
+        'user'
+    )
+
+    form = UserJoinEventAdminForm
+
+    def save_model(self, request, obj, form, change):
+        """Add and move memberships like the join and leave of the site
+
+        Capacity, attendee_count, waitlist, membership versions and recommendations are handled by now.services,
+        the admin view transaction rolls back a move whose join fails.
+        """
+        if change:
+            if not form.changed_data:
+                return
+            leave_event(*UserJoinEvent.objects.filter(pk=obj.pk).values_list('event_id', 'user_id').get())
+        if not join_event(obj.event_id, obj.user_id):
+            # Filled up or joined after the form was validated
+            raise _NotJoined('Пользователь не добавлен в событие: нет свободных мест или он уже участвует')
+        # Joined user no longer waits for a spot
+        WaitlistEntry.objects.filter(event_id=obj.event_id, user_id=obj.user_id).delete()
+        obj.pk = (UserJoinEvent.objects.filter(event_id=obj.event_id, user_id=obj.user_id)
+                  .values_list('pk', flat=True).get())
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except _NotJoined as error:
+            # The transaction of the view is rolled back, the form is opened again with the reason
+            self.message_user(request, str(error), messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
+
+    def delete_model(self, request, obj):
+        leave_event(obj.event_id, obj.user_id)
+
+    def delete_queryset(self, request, queryset):
+        """Remove memberships one by one, freed spots go to the heads of waitlists"""
+        for event_id, user_id in queryset.order_by('pk').values_list('event_id', 'user_id'):
+            leave_event(event_id, user_id)
+
+
+class WaitlistEntryAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = (
+        'event',
+        'user',
+        'time_create'
+    )
+    list_display_links = (
         'event',
         'user'
     )
+    list_select_related = (
+        'event',
+        'user'
+    )
+    search_fields = (
+        'event__slug__startswith',
+        'user__username__startswith'
+    )
+    search_help_text = 'Поиск по началу URL события или логина'
     list_filter = (
+        EventSlugFilter,
+        UsernameFilter
+    )
+    autocomplete_fields = (
         'event',
         'user'
     )
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id',
+        'name',
+        'status',
+        'attempts',
+        'run_at',
+        'locked_until'
+    )
+    list_display_links = (
+        'id',
+        'name'
+    )
+    list_filter = (
+        'status',
+    )
+    readonly_fields = (
+        'locked_by',
+        'last_error',
+        'time_create'
+    )
+    actions = (
+        'retry',
+    )
+
+    @admin.action(description='Запустить выбранные задачи снова')
+    def retry(self, request, queryset):
+        """Queue failed jobs again with a fresh set of attempts, unless the same unique job is pending"""
+        pending = Job.objects.filter(status__in=(Job.QUEUED, Job.RUNNING), unique_key__isnull=False)
+        queryset = queryset.filter(status=Job.FAILED).exclude(unique_key__in=pending.values('unique_key'))
+        queryset.update(status=Job.QUEUED, attempts=0, run_at=timezone.now(), locked_by='', locked_until=None)
+
+
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(Event, EventAdmin)
 admin.site.register(Category, CategoryAdmin)
+admin.site.register(City, CityAdmin)
 admin.site.register(UserJoinEvent, UserJoinEventAdmin)
+admin.site.register(WaitlistEntry, WaitlistEntryAdmin)
+admin.site.register(Job, JobAdmin)
 admin.site.site_title = 'Админ-панель NOW'
 admin.site.site_header = 'Админ-панель NOW'
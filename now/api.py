@@ -0,0 +1,351 @@
+import json
+
+from django.db.models.fields.files import FieldFile
+from django.http import HttpResponse
+from django.views import View
+
+from now.forms import EventApiForm
+from now.models import Category, City, CustomUser, Event, UserJoinEvent
+from now.pagination import CursorPaginator, InvalidCursor
+from now.services import delete_event, leave_event, request_spot
+from now.utils import ReplicaReadMixin
+
+try:
+    import orjson
+except ImportError:
+    # Same output from the standard library, several times slower on large pages
+    orjson = None
+
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+# Slugs of one batched lookup ?slug=a,b,c
+API_MAX_SLUGS = 100
+
+
+def _default(value):
+    # orjson writes datetimes as isoformat() does
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(data):
+    """Return data as UTF-8 JSON bytes, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(body):
+    """Return object parsed from JSON bytes, ValueError for invalid JSON"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def api_response(data, status=200):
+    return HttpResponse(dumps(data), content_type='application/json', status=status)
+
+
+class ApiError(Exception):
+    """class ApiError raised by API views, answered as {"error": message} with HTTP status."""
+
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.details = details
+
+
+class Resource:
+    """class Resource describe model exposed by the API: public fields, to-one relations and listing order.
+
+    Relations are written as slug of the related object, or as the object with its plain fields
+    when named in ?include=. Every response reads one page of rows with select_related() and
+    .only() of requested fields, so the number of queries does not depend on fields, includes or page size.
+    """
+
+    model = None
+    # Public fields in response order, other model fields are never exposed
+    fields = ()
+    # Relation field: Resource of related object
+    relations = {}
+    # Cursor ordering of listings, the last field must be unique
+    ordering = ('id',)
+    lookup_field = 'slug'
+
+    def get_queryset(self, request):
+        return self.model.objects.all()
+
+    @property
+    def plain_fields(self):
+        return [name for name in self.fields if name not in self.relations]
+
+    def parse(self, request):
+        """Return (fields, include) from ?fields= and ?include=, an included relation is a field too"""
+        fields = _split(request.GET.get('fields')) or list(self.fields)
+        include = _split(request.GET.get('include'))
+        unknown = [name for name in fields if name not in self.fields]
+        if unknown:
+            raise ApiError(400, f'Неизвестные поля: {", ".join(unknown)}')
+        unknown = [name for name in include if name not in self.relations]
+        if unknown:
+            raise ApiError(400, f'Неизвестные связи: {", ".join(unknown)}')
+        return fields + [name for name in include if name not in fields], set(include)
+
+    def select(self, queryset, fields, include):
+        """Read only columns of fields, lookup and ordering, join relations into the same query"""
+        only = {name.lstrip('-') for name in self.ordering}
+        only.add(self.lookup_field)
+        relation = self.lookup_field.rpartition('__')[0]
+        related = [relation] if relation else []
+        if relation:
+            only.add(relation)
+        for name in fields:
+            only.add(name)
+            resource = self.relations.get(name)
+            if resource is not None:
+                related.append(name)
+                columns = resource.plain_fields if name in include else [resource.lookup_field]
+                only.update(f'{name}__{column}' for column in columns)
+        return queryset.select_related(*related).only(*only)
+
+    def serialize(self, obj, fields, include=()):
+        data = {}
+        for name in fields:
+            value = getattr(obj, name)
+            resource = self.relations.get(name)
+            if resource is not None and value is not None:
+                value = (resource.serialize(value, resource.plain_fields) if name in include
+                         else getattr(value, resource.lookup_field))
+            elif isinstance(value, FieldFile):
+                value = value.url if value else None
+            data[name] = value
+        return data
+
+
+class CategoryResource(Resource):
+    model = Category
+    fields = ('slug', 'category_name')
+
+
+class CityResource(Resource):
+    model = City
+    fields = ('slug', 'name', 'latitude', 'longitude')
+
+
+class UserResource(Resource):
+    model = CustomUser
+    # Public profile, e-mail and password fields are not exposed
+    fields = ('slug', 'username', 'first_name', 'last_name', 'photo', 'bio', 'location', 'city', 'date_joined')
+    relations = {'city': CityResource()}
+
+    def get_queryset(self, request):
+        return CustomUser.objects.filter(is_active=True)
+
+
+class EventResource(Resource):
+    model = Event
+    fields = ('slug', 'title', 'content', 'photo', 'category', 'user', 'city', 'latitude', 'longitude', 'starts_at',
+              'ends_at', 'attendee_count', 'capacity', 'is_published', 'time_create', 'time_update')
+    relations = {'category': CategoryResource(), 'user': UserResource(), 'city': CityResource()}
+    # Read from now_event_feed_idx like the Events page
+    ordering = ('-time_update', '-id')
+
+    def get_queryset(self, request):
+        return Event.objects.filter(is_published=True, is_archived=False)
+
+
+class MembershipResource(Resource):
+    model = UserJoinEvent
+    fields = ('event', 'user')
+    relations = {'event': EventResource(), 'user': UserResource()}
+    # Newest memberships first, read from the user_id index
+    ordering = ('-id',)
+    lookup_field = 'event__slug'
+
+    def get_queryset(self, request):
+        return UserJoinEvent.objects.filter(user_id=request.user.pk)
+
+
+def _split(value):
+    return list(dict.fromkeys(item.strip() for item in (value or '').split(',') if item.strip()))
+
+
+class ApiView(ReplicaReadMixin, View):
+    """class ApiView using for JSON endpoints of one Resource, errors are answered as {"error": message}."""
+
+    resource = None
+    # Writes and personal data require a logged in user
+    login_required = False
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            if self.login_required or request.method not in ('GET', 'HEAD'):
+                self.require_user()
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            data = {'error': error.message}
+            if error.details:
+                data['details'] = error.details
+            return api_response(data, error.status)
+
+    def require_user(self):
+        if not self.request.user.is_authenticated:
+            raise ApiError(401, 'Требуется вход')
+
+    def read_body(self):
+        """Return JSON object of request body"""
+        try:
+            data = loads(self.request.body or b'{}')
+        except ValueError:
+            raise ApiError(400, 'Неверный JSON')
+        if not isinstance(data, dict):
+            raise ApiError(400, 'Ожидается JSON-объект')
+        return data
+
+    def get_queryset(self):
+        return self.resource.get_queryset(self.request)
+
+
+class ApiListView(ApiView):
+    """class ApiListView using for cursor-paginated listing of resource and batched lookup by ?slug=a,b,c."""
+
+    def get(self, request, *args, **kwargs):
+        fields, include = self.resource.parse(request)
+        queryset = self.resource.select(self.get_queryset(), fields, include)
+        if 'slug' in request.GET:
+            return self.get_batch(queryset, _split(request.GET['slug']), fields, include)
+        try:
+            limit = int(request.GET.get('limit', API_PAGE_SIZE))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= API_MAX_PAGE_SIZE:
+            raise ApiError(400, f'Параметр limit должен быть от 1 до {API_MAX_PAGE_SIZE}')
+        try:
+            page = CursorPaginator(queryset, limit, self.resource.ordering).page(request.GET.get('cursor'))
+        except InvalidCursor:
+            raise ApiError(400, 'Неверный курсор страницы')
+        return api_response({'data': [self.resource.serialize(obj, fields, include) for obj in page],
+                             'next': page.next_cursor, 'previous': page.previous_cursor})
+
+    def get_batch(self, queryset, slugs, fields, include):
+        """Objects of slugs in requested order with one IN query, unknown slugs are listed as missing"""
+        if len(slugs) > API_MAX_SLUGS:
+            raise ApiError(400, f'Не больше {API_MAX_SLUGS} значений slug')
+        lookup = self.resource.lookup_field
+        found = {_lookup_value(obj, lookup): obj for obj in queryset.filter(**{f'{lookup}__in': slugs})}
+        return api_response({'data': [self.resource.serialize(found[slug], fields, include)
+                                      for slug in slugs if slug in found],
+                             'missing': [slug for slug in slugs if slug not in found]})
+
+
+def _lookup_value(obj, lookup):
+    for name in lookup.split('__'):
+        obj = getattr(obj, name)
+    return obj
+
+
+class ApiDetailView(ApiView):
+    """class ApiDetailView using for one object of resource found by its slug."""
+
+    def get_object(self, queryset):
+        obj = queryset.filter(**{self.resource.lookup_field: self.kwargs['slug']}).first()
+        if obj is None:
+            raise ApiError(404, 'Не найдено')
+        return obj
+
+    def get(self, request, *args, **kwargs):
+        fields, include = self.resource.parse(request)
+        obj = self.get_object(self.resource.select(self.get_queryset(), fields, include))
+        return api_response({'data': self.resource.serialize(obj, fields, include)})
+
+
+class CategoriesApi(ApiListView):
+    resource = CategoryResource()
+
+
+class CategoryApi(ApiDetailView):
+    resource = CategoryResource()
+
+
+class UsersApi(ApiListView):
+    resource = UserResource()
+
+
+class UserApi(ApiDetailView):
+    resource = UserResource()
+
+
+class EventWriteMixin:
+    """class EventWriteMixin validate JSON of event with EventApiForm, fields missing in it keep their values."""
+
+    def save_event(self, instance, status):
+        payload = self.read_body()
+        # PATCH semantics: form gets current values of fields the client did not send
+        current = ({name: getattr(instance, name) for name in EventApiForm._meta.fields} if instance
+                   else {'is_published': True})
+        form = EventApiForm({**current, **payload}, instance=instance)
+        if not form.is_valid():
+            raise ApiError(400, 'Ошибка проверки данных', {name: list(errors) for name, errors in form.errors.items()})
+        event = form.save(commit=False)
+        if instance is None:
+            event.user = self.request.user
+        event.save()
+        resource = EventResource()
+        return api_response({'data': resource.serialize(event, resource.fields)}, status)
+
+
+class EventsApi(EventWriteMixin, ApiListView):
+    resource = EventResource()
+
+    def post(self, request, *args, **kwargs):
+        """Create event of current user"""
+        return self.save_event(None, 201)
+
+
+class EventApi(EventWriteMixin, ApiDetailView):
+    resource = EventResource()
+
+    def get_own_event(self):
+        """Event of current user by slug, other users get 404 as for a missing event"""
+        event = (Event.objects.select_related('category', 'user', 'city')
+                 .filter(slug=self.kwargs['slug'], user_id=self.request.user.pk).first())
+        if event is None:
+            raise ApiError(404, 'Событие не найдено')
+        return event
+
+    def patch(self, request, *args, **kwargs):
+        return self.save_event(self.get_own_event(), 200)
+
+    def delete(self, request, *args, **kwargs):
+        delete_event(self.get_own_event())
+        return HttpResponse(status=204)
+
+
+class MembershipsApi(ApiListView):
+    """class MembershipsApi using for events joined by current user, POST {"event": slug} joins or queues for one."""
+
+    resource = MembershipResource()
+    login_required = True
+
+    def post(self, request, *args, **kwargs):
+        slug = self.read_body().get('event')
+        event_id = Event.objects.filter(slug=slug, is_published=True).values_list('pk', flat=True).first()
+        if event_id is None:
+            raise ApiError(404, 'Событие не найдено')
+        status = request_spot(event_id, request.user.pk)
+        return api_response({'data': {'event': slug, 'status': status or 'already'}}, 201 if status else 200)
+
+
+class MembershipApi(ApiDetailView):
+    """class MembershipApi using for membership of current user in event, DELETE leaves event or its waitlist."""
+
+    resource = MembershipResource()
+    login_required = True
+
+    def delete(self, request, *args, **kwargs):
+        event_id = Event.objects.filter(slug=self.kwargs['slug']).values_list('pk', flat=True).first()
+        if event_id is None or not leave_event(event_id, request.user.pk):
+            raise ApiError(404, 'Не найдено')
+        return HttpResponse(status=204)
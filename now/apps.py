@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NowConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'now'
+
+    def ready(self):
+        # Connect cache invalidation receivers
+        from now import signals  # noqa: F401
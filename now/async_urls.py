@@ -0,0 +1,13 @@
+from django.urls import path
+
+from now import urls
+from now.async_views import ASYNC_PAGE_VIEWS, async_page_view
+
+# Patterns of now/urls.py, read-heavy views wrap their sync view (with its decorators) in async_page_view
+urlpatterns = [
+    path(str(pattern.pattern),
+         async_page_view(pattern.callback, ASYNC_PAGE_VIEWS[pattern.name].page_cache_namespace),
+         name=pattern.name)
+    if pattern.name in ASYNC_PAGE_VIEWS else pattern
+    for pattern in urls.urlpatterns
+]
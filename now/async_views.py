@@ -0,0 +1,51 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from now.caching import aget_cached_page
+from now.views import Categories, CategoryEvents, Events, ShowEvent
+
+
+def _run_view(view, request, kwargs):
+    """Run sync view and render its response in one thread, so lazy querysets run there too"""
+    response = view(request, **kwargs)
+    if hasattr(response, 'render') and not response.is_rendered:
+        start = time.perf_counter()
+        response.render()
+        request._template_seconds = getattr(request, '_template_seconds', 0.0) + time.perf_counter() - start
+    return response
+
+
+def async_page_view(view, namespace):
+    """Return async view serving anonymous cached pages with async cache calls, otherwise running view in a thread
+
+    view is the sync view of the url, the page cache of PageCacheMixin is shared with it.
+    """
+
+    async def async_view(request, **kwargs):
+        # Without session cookie the user is anonymous, no session or user query is needed to know it
+        if request.method == 'GET' and settings.SESSION_COOKIE_NAME not in request.COOKIES:
+            # BaseCache.aget() of Django 4.0 is sync_to_async(get), a hit costs two short thread hops
+            # but no session, user or view work
+            response = await aget_cached_page(namespace, request)
+            if response is not None:
+                # Validators are cached with the page, conditional requests get 304 as from the sync view
+                last_modified = parse_http_date_safe(response.get('Last-Modified', ''))
+                return get_conditional_response(request, etag=response.get('ETag'), last_modified=last_modified,
+                                                response=response)
+        return await sync_to_async(_run_view)(view, request, kwargs)
+
+    async_view.__name__ = async_view.__qualname__ = getattr(view, '__name__', 'async_view')
+    return async_view
+
+
+# Url name: sync view class, its page cache namespace is shared with the async variant
+ASYNC_PAGE_VIEWS = {
+    'events': Events,
+    'category': CategoryEvents,
+    'event': ShowEvent,
+    'categories': Categories,
+}
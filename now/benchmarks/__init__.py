@@ -0,0 +1,67 @@
+"""Benchmarks for `manage.py bench <name>`, every run uses a throwaway test database."""
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_databases, teardown_databases
+
+
+@contextmanager
+def benchmark_database(on_disk=False):
+    """Create test databases for the benchmark and destroy them afterwards
+
+    With on_disk the SQLite test database is a temporary file instead of shared-cache memory,
+    whose table locks fail concurrent writers at once instead of letting them wait.
+    """
+    test_settings = connection.settings_dict['TEST']
+    old_name = test_settings.get('NAME')
+    directory = None
+    if on_disk and connection.vendor == 'sqlite' and not old_name:
+        directory = tempfile.mkdtemp()
+        test_settings['NAME'] = os.path.join(directory, 'bench.sqlite3')
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        test_settings['NAME'] = old_name
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def analyze():
+    """Refresh planner statistics after seeding"""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(func, repeat=5):
+    """Run func repeat times and return timings in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'min_ms': round(min(timings), 3), 'median_ms': round(statistics.median(timings), 3)}
+
+
+def throughput(func, iterations):
+    """Run func iterations times and return mean latency in microseconds and operations per second"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    return {'mean_us': round(elapsed / iterations * 1e6, 2), 'ops_per_sec': round(iterations / elapsed)}
+
+
+def percentiles(timings):
+    """Return p50/p95/p99 and max of timings in milliseconds"""
+    if len(timings) < 2:
+        timings = list(timings) * 2
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return {'p50_ms': round(cuts[49], 3), 'p95_ms': round(cuts[94], 3), 'p99_ms': round(cuts[98], 3),
+            'max_ms': round(max(timings), 3)}
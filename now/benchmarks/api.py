@@ -0,0 +1,48 @@
+"""JSON API pages: orjson against the standard library fallback, queries per page with sparse fields and includes."""
+from unittest import mock
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from now import api
+from now.benchmarks import benchmark_database, measure
+from now.benchmarks.data import seed
+
+REQUESTS = {
+    'full_page': {},
+    'sparse_page': {'fields': 'slug,title,starts_at,attendee_count'},
+    'included_page': {'include': 'category,user,city'},
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=api.API_MAX_PAGE_SIZE)
+    parser.add_argument('--repeat', type=int, default=20)
+
+
+def _report(client, params, repeat):
+    url = reverse('api_events')
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, params)
+    return {'queries': len(queries), 'bytes': len(response.content),
+            'request': measure(lambda: client.get(url, params), repeat)}
+
+
+def run(options):
+    with benchmark_database():
+        dataset = seed(users=500, events=options['events'], joins=options['events'])
+        client = Client()
+        results = {}
+        for name, params in REQUESTS.items():
+            params = {**params, 'limit': options['limit']}
+            page = api.loads(client.get(reverse('api_events'), params).content)['data']
+            results[name] = {'orjson': _report(client, params, options['repeat']) if api.orjson else None,
+                             'dumps_orjson': measure(lambda: api.dumps(page), options['repeat'])
+                             if api.orjson else None}
+            with mock.patch.object(api, 'orjson', None):
+                results[name]['json'] = _report(client, params, options['repeat'])
+                results[name]['dumps_json'] = measure(lambda: api.dumps(page), options['repeat'])
+    return {'dataset': dataset, 'vendor': connection.vendor, 'limit': options['limit'], 'results': results}
@@ -0,0 +1,55 @@
+"""Hot event listing before and after finished events are archived by now.services.archive_events()."""
+import time
+
+from django.db import connection
+
+from now.benchmarks import analyze, benchmark_database, measure
+from now.benchmarks.data import seed
+from now.models import Event
+from now.pagination import CursorPaginator
+from now.services import ARCHIVE_BATCH_SIZE, EVENT_WINDOWS, archive_events, in_window
+
+FEED_ORDERING = ('-time_update', '-id')
+PAGE_SIZE = 3
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--joins', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+
+
+def _listing(repeat):
+    """Listing of Events view: count, first page, page at 80% of the listing and the upcoming window"""
+    hot = in_window(Event.objects.filter(is_published=True), '')
+    upcoming = in_window(Event.objects.filter(is_published=True), 'upcoming')
+    paginator = CursorPaginator(hot, PAGE_SIZE, FEED_ORDERING)
+    size = hot.count()
+    boundary = hot.order_by(*FEED_ORDERING)[size * 8 // 10] if size else None
+    cursor = paginator.encode_cursor(boundary) if boundary else None
+    return {
+        'listed_events': size,
+        'count': measure(hot.count, repeat),
+        'first_page': measure(lambda: paginator.page(), repeat),
+        'deep_page': measure(lambda: paginator.page(cursor), repeat) if cursor else None,
+        'upcoming_page': measure(
+            lambda: CursorPaginator(upcoming, PAGE_SIZE, EVENT_WINDOWS['upcoming'][1]).page(), repeat),
+    }
+
+
+def run(options):
+    with benchmark_database():
+        dataset = seed(users=options['users'], events=options['events'], joins=options['joins'])
+        analyze()
+        before = _listing(options['repeat'])
+        start = time.perf_counter()
+        archived = archive_events(batch_size=options['batch_size'])
+        archive = {'archived': archived, 'seconds': round(time.perf_counter() - start, 2)}
+        start = time.perf_counter()
+        archive['second_run'] = archive_events(batch_size=options['batch_size'])
+        archive['second_run_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        analyze()
+        after = _listing(options['repeat'])
+    return {'dataset': dataset, 'vendor': connection.vendor, 'before': before, 'archive': archive, 'after': after}
@@ -0,0 +1,110 @@
+"""Anonymous read-heavy pages under concurrent slow clients: WSGI worker threads against the ASGI application."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+
+from now.benchmarks import benchmark_database, percentiles
+from now.benchmarks.data import seed
+from now.models import Event
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=400, help='Requests per deployment')
+    parser.add_argument('--concurrency', type=int, default=50, help='Clients sending requests at the same time')
+    parser.add_argument('--threads', type=int, default=4, help='Worker threads of the WSGI deployment')
+    parser.add_argument('--client-delay', type=float, default=0.02,
+                        help='Seconds a slow client needs to receive a response')
+
+
+def _paths():
+    event = Event.objects.filter(is_published=True).select_related('category').order_by('pk').first()
+    return [reverse('events'), reverse('categories'), event.get_absolute_url(),
+            reverse('category', args=[event.category.slug])]
+
+
+def _report(latencies, elapsed, statuses):
+    return {**percentiles([latency * 1000 for latency in latencies]),
+            'requests_per_sec': round(len(latencies) / elapsed, 1), 'status': sorted(statuses)}
+
+
+def _run_wsgi(paths, options):
+    """Every request holds a worker thread until the slow client has read the response"""
+    handler = WSGIHandler()
+    factory = RequestFactory()
+    delay = options['client_delay']
+    statuses = set()
+
+    slots = threading.Semaphore(options['threads'])
+
+    def serve(path):
+        queued = time.perf_counter()
+        status = []
+        # Clients beyond the worker threads wait in the accept queue, as with gunicorn sync workers
+        with slots:
+            body = handler(factory.get(path).environ, lambda line, headers: status.append(line))
+            for _ in body:
+                time.sleep(delay)
+            body.close()
+        statuses.add(int(status[0].split()[0]))
+        return time.perf_counter() - queued
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+        latencies = list(clients.map(serve, (paths[number % len(paths)] for number in range(options['requests']))))
+    return _report(latencies, time.perf_counter() - start, statuses)
+
+
+def _run_asgi(paths, options):
+    """Sending to a slow client awaits, other requests are served in the meantime"""
+    application = ASGIHandler()
+    delay = options['client_delay']
+    statuses = set()
+
+    async def serve(path, clients):
+        async with clients:
+            queued = time.perf_counter()
+            scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                     'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                     'headers': [(b'host', b'testserver')], 'server': ('testserver', 80),
+                     'client': ('127.0.0.1', 0)}
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.add(message['status'])
+                elif not message.get('more_body'):
+                    await asyncio.sleep(delay)
+
+            await application(scope, receive, send)
+            return time.perf_counter() - queued
+
+    async def main():
+        clients = asyncio.Semaphore(options['concurrency'])
+        return await asyncio.gather(*(serve(paths[number % len(paths)], clients)
+                                      for number in range(options['requests'])))
+
+    start = time.perf_counter()
+    latencies = asyncio.run(main())
+    return _report(latencies, time.perf_counter() - start, statuses)
+
+
+def run(options):
+    with benchmark_database(), override_settings(ROOT_URLCONF='now_events_app.asgi_urls'):
+        dataset = seed(users=50, events=options['events'], joins=options['events'])
+        paths = _paths()
+        # Pages are cached for anonymous clients, both deployments read the same cache
+        client = Client()
+        for path in paths:
+            client.get(path)
+        results = {'wsgi': _run_wsgi(paths, options), 'asgi': _run_asgi(paths, options)}
+    return {'dataset': dataset, 'paths': paths, 'concurrency': options['concurrency'],
+            'wsgi_threads': options['threads'], 'client_delay': options['client_delay'], 'results': results}
@@ -0,0 +1,51 @@
+"""cache.get/set and the Categories view on every cache backend from settings.CACHE_BACKENDS."""
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from now.benchmarks import benchmark_database, throughput
+from now.benchmarks.data import seed
+from now.caching import get_category_rows
+from now.fake_redis import FakeRedisServer
+
+
+def add_arguments(parser):
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--redis-url', help='Real Redis server, the in-process FakeRedisServer by default')
+
+
+def _backends(directory, redis_url):
+    redis = {**settings.CACHE_BACKENDS['redis'], 'LOCATION': redis_url}
+    return {
+        'locmem': {'default': {**settings.CACHE_BACKENDS['locmem'], 'LOCATION': 'now-bench'}},
+        'file': {'default': {**settings.CACHE_BACKENDS['file'], 'LOCATION': directory}},
+        'redis': {'default': redis},
+        'tiered': {
+            'default': {'BACKEND': 'now.cache_backends.TieredCache', 'LOCATION': 'shared'},
+            'shared': redis,
+        },
+    }
+
+
+def run(options):
+    iterations = options['iterations']
+    results = {}
+    with benchmark_database(), tempfile.TemporaryDirectory() as directory, FakeRedisServer() as server:
+        seed(users=20, categories=options['categories'], events=2000, joins=0)
+        client = Client()
+        for name, caches in _backends(directory, options['redis_url'] or server.url).items():
+            with override_settings(CACHES=caches):
+                cache.clear()
+                rows = [tuple(row) for row in get_category_rows()]
+                results[name] = {
+                    'set': throughput(lambda: cache.set('bench:rows', rows), iterations),
+                    'get': throughput(lambda: cache.get('bench:rows'), iterations),
+                    'category_rows': throughput(get_category_rows, iterations),
+                    'categories_view': throughput(lambda: client.get(reverse('categories')), iterations // 10),
+                }
+                cache.clear()
+    return {'iterations': iterations, 'redis': options['redis_url'] or 'FakeRedisServer', 'backends': results}
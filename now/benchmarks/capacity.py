@@ -0,0 +1,88 @@
+"""Rush of joins on a capacity-limited event from many threads: no overbooking, joins per second, waitlist promotion."""
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from now.benchmarks import benchmark_database, percentiles
+from now.models import Category, CustomUser, Event, UserJoinEvent, WaitlistEntry
+from now.services import leave_event, request_spot
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=2000, help='Users joining the event at the same time')
+    parser.add_argument('--capacity', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--leaves', type=int, default=100, help='Attendees leaving after the rush')
+
+
+def run_concurrently(func, items, threads):
+    """Call func(item) for items from threads, return (results, latencies in milliseconds, seconds)"""
+    chunks = [items[number::threads] for number in range(threads)]
+
+    def work(chunk):
+        results = []
+        try:
+            for item in chunk:
+                start = time.perf_counter()
+                results.append((func(item), (time.perf_counter() - start) * 1000))
+        finally:
+            # Every thread has its own connection, closed so the test database can be destroyed
+            connection.close()
+        return results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        done = [row for rows in pool.map(work, chunks) for row in rows]
+    return [result for result, _ in done], [latency for _, latency in done], time.perf_counter() - start
+
+
+def check_event(event_id):
+    """Return state of event, consistent when counter matches memberships within capacity and nobody also waits"""
+    event = Event.objects.get(pk=event_id)
+    members = set(UserJoinEvent.objects.filter(event_id=event_id).values_list('user_id', flat=True))
+    waiting = set(WaitlistEntry.objects.filter(event_id=event_id).values_list('user_id', flat=True))
+    return {
+        'capacity': event.capacity,
+        'attendee_count': event.attendee_count,
+        'members': len(members),
+        'waiting': len(waiting),
+        'consistent': (event.attendee_count == len(members) and not members & waiting
+                       and (event.capacity is None or len(members) <= event.capacity)),
+    }
+
+
+def stress(event_id, user_ids, threads, leaves=0):
+    """Every user requests a spot at once, then leaves attendees leave and free spots go to waiting users"""
+    statuses, latencies, seconds = run_concurrently(lambda user_id: request_spot(event_id, user_id), user_ids, threads)
+    report = {'joins': {**Counter(status or 'already' for status in statuses),
+                        'joins_per_sec': round(len(user_ids) / seconds), **percentiles(latencies)},
+              'after_joins': check_event(event_id)}
+    if leaves:
+        leaving = list(UserJoinEvent.objects.filter(event_id=event_id).order_by('pk')
+                       .values_list('user_id', flat=True)[:leaves])
+        left, latencies, seconds = run_concurrently(lambda user_id: leave_event(event_id, user_id), leaving, threads)
+        report['leaves'] = {'left': sum(left), 'leaves_per_sec': round(len(leaving) / seconds),
+                            **percentiles(latencies)}
+        report['after_leaves'] = check_event(event_id)
+    return report
+
+
+def _seed(users, capacity):
+    category = Category.objects.create(category_name='Категория', slug='category')
+    organizer = CustomUser.objects.create(username='organizer', slug='organizer')
+    event = Event.objects.create(title='Событие', content='content', category=category, user=organizer,
+                                 capacity=capacity)
+    CustomUser.objects.bulk_create((CustomUser(username=f'user{number}', slug=f'user{number}')
+                                    for number in range(users)), batch_size=5000)
+    return event, list(CustomUser.objects.exclude(pk=organizer.pk).order_by('pk').values_list('pk', flat=True))
+
+
+def run(options):
+    # Concurrent writers wait for the file lock, in-memory shared cache would fail them
+    with benchmark_database(on_disk=True):
+        event, user_ids = _seed(options['users'], options['capacity'])
+        report = stress(event.pk, user_ids, options['threads'], options['leaves'])
+    return {'vendor': connection.vendor, 'users': options['users'], 'capacity': options['capacity'],
+            'threads': options['threads'], **report}
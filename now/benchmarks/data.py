@@ -0,0 +1,68 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+
+from now.models import Category, CustomUser, Event, UserJoinEvent
+from now.search import rebuild_index
+from now.services import rebuild_attendee_counts
+from now.transfer import explicit_timestamps
+
+# Words of generated titles and descriptions, search benchmarks need realistic Russian text
+TITLE_WORDS = ('концерт', 'выставка', 'турнир', 'встреча', 'лекция', 'мастер-класс', 'прогулка', 'фестиваль',
+               'футбол', 'шахматы', 'книжный', 'клуб', 'вечер', 'джаз', 'кино', 'пикник', 'забег', 'йога')
+CONTENT_WORDS = ('приходите', 'друзьями', 'будет', 'интересно', 'весело', 'музыка', 'парке', 'городе',
+                 'вход', 'свободный', 'начало', 'вечером', 'играем', 'обсуждаем', 'новые', 'книги',
+                 'футбольный', 'матч', 'команды', 'участники', 'получат', 'призы', 'регистрация', 'обязательна',
+                 'живая', 'программа', 'выступления', 'молодых', 'художников', 'гостей', 'ждем', 'всех')
+
+
+def seed(users=100, categories=10, events=10000, joins=20000, seed=0, batch_size=2000):
+    """Fill database with deterministic users, categories, events and joins"""
+    rng = random.Random(seed)
+    # Own generator for schedules, the other data stays the same as before events had them
+    schedule_rng = random.Random(seed + 1)
+    now = timezone.now()
+    password = make_password(None)
+
+    CustomUser.objects.bulk_create(
+        (CustomUser(username=f'user{number}', slug=f'user{number}', email=f'user{number}@example.com',
+                    password=password)
+         for number in range(users)),
+        batch_size=batch_size)
+    Category.objects.bulk_create(
+        (Category(category_name=f'Категория {number}', slug=f'category-{number}')
+         for number in range(categories)),
+        batch_size=batch_size)
+    user_ids = list(CustomUser.objects.order_by('id').values_list('id', flat=True))
+    category_ids = list(Category.objects.order_by('id').values_list('id', flat=True))
+
+    def generate_events():
+        for number in range(events):
+            created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            title = ' '.join(rng.choice(TITLE_WORDS) for _ in range(3)).capitalize()
+            content = ' '.join(rng.choice(CONTENT_WORDS) for _ in range(rng.randint(20, 60)))
+            # Events start within a month after they are announced, so most of them are over
+            starts_at = created + timedelta(minutes=schedule_rng.randint(60, 60 * 24 * 30))
+            yield Event(title=f'{title} {number}', slug=f'event-{number}', content=content,
+                        category_id=rng.choice(category_ids), user_id=rng.choice(user_ids),
+                        is_published=rng.random() < 0.9, time_create=created,
+                        time_update=created + timedelta(minutes=rng.randint(0, 60 * 24)), starts_at=starts_at,
+                        ends_at=starts_at + timedelta(minutes=schedule_rng.randint(60, 60 * 6)))
+
+    with explicit_timestamps(Event):
+        Event.objects.bulk_create(generate_events(), batch_size=batch_size)
+    event_ids = list(Event.objects.order_by('id').values_list('id', flat=True))
+
+    pairs = set()
+    joins = min(joins, len(event_ids) * len(user_ids))
+    while len(pairs) < joins:
+        pairs.add((rng.choice(event_ids), rng.choice(user_ids)))
+    UserJoinEvent.objects.bulk_create(
+        (UserJoinEvent(event_id=event_id, user_id=user_id) for event_id, user_id in sorted(pairs)),
+        batch_size=batch_size)
+    rebuild_attendee_counts(batch_size=batch_size)
+    # bulk_create does not send post_save, index the generated events at once
+    rebuild_index(batch_size=batch_size)
+    return {'users': len(user_ids), 'categories': len(category_ids), 'events': len(event_ids), 'joins': joins}
@@ -0,0 +1,80 @@
+"""Listing and membership queries before and after the feed indexes of migration 0002."""
+from django.db import connection
+
+from now.benchmarks import analyze, benchmark_database, measure
+from now.benchmarks.data import seed
+from now.models import Category, Event, UserJoinEvent
+from now.pagination import CursorPaginator
+
+OLD_ORDERING = ('id', 'time_update', 'title')
+FEED_ORDERING = ('-time_update', '-id')
+PAGE_SIZE = 3
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--joins', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+
+
+def _report(queryset, repeat):
+    return {'plan': queryset.explain(), **measure(lambda: list(queryset.all()), repeat)}
+
+
+def _before(category, event, user_id, depth, repeat):
+    """Offset pagination over the old ordering, membership check of the old UserGoEvent/DataMixin code"""
+    published = Event.objects.filter(is_published=True).order_by(*OLD_ORDERING)
+    by_category = Event.objects.filter(category__slug=category.slug, is_published=True).order_by(*OLD_ORDERING)
+    return {
+        'events_first_page': _report(published[:PAGE_SIZE], repeat),
+        'events_deep_page': _report(published[depth:depth + PAGE_SIZE], repeat),
+        'events_count': measure(published.count, repeat),
+        'category_deep_page': _report(by_category[depth // 10:depth // 10 + PAGE_SIZE], repeat),
+        'membership_lookup': measure(lambda: bool(UserJoinEvent.objects.all())
+                                     and UserJoinEvent.objects.filter(event=event).first(), repeat),
+    }
+
+
+def _after(category, event, user_id, depth, repeat):
+    """Keyset pagination over the feed ordering served by the partial indexes"""
+    published = Event.objects.filter(is_published=True, is_archived=False)
+    by_category = Event.objects.filter(category=category, is_published=True, is_archived=False)
+    paginator = CursorPaginator(published, PAGE_SIZE, FEED_ORDERING)
+    category_paginator = CursorPaginator(by_category, PAGE_SIZE, FEED_ORDERING)
+    boundary = published.order_by(*FEED_ORDERING)[depth]
+    category_boundary = by_category.order_by(*FEED_ORDERING)[depth // 10]
+    _, values = paginator.decode_cursor(paginator.encode_cursor(boundary))
+    _, category_values = category_paginator.decode_cursor(category_paginator.encode_cursor(category_boundary))
+    deep_page = published.order_by(*FEED_ORDERING).filter(paginator._keyset_filter(values, False))
+    category_deep_page = (by_category.order_by(*FEED_ORDERING)
+                          .filter(category_paginator._keyset_filter(category_values, False)))
+    return {
+        'events_first_page': _report(published.order_by(*FEED_ORDERING)[:PAGE_SIZE], repeat),
+        'events_deep_page': _report(deep_page[:PAGE_SIZE], repeat),
+        'category_deep_page': _report(category_deep_page[:PAGE_SIZE], repeat),
+        'membership_lookup': _report(UserJoinEvent.objects.filter(event=event, user_id=user_id)[:1], repeat),
+    }
+
+
+def run(options):
+    with benchmark_database():
+        dataset = seed(users=options['users'], events=options['events'], joins=options['joins'])
+        indexes = Event._meta.indexes
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(Event, index)
+        analyze()
+
+        category = Category.objects.order_by('id').first()
+        membership = UserJoinEvent.objects.order_by('-id').first()
+        depth = Event.objects.filter(is_published=True).count() * 8 // 10
+        arguments = (category, membership.event, membership.user_id, depth, options['repeat'])
+        before = _before(*arguments)
+
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Event, index)
+        analyze()
+        after = _after(*arguments)
+    return {'dataset': dataset, 'vendor': connection.vendor, 'depth': depth, 'before': before, 'after': after}
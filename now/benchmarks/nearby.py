@@ -0,0 +1,121 @@
+"""Nearby feed: precomputed city feeds and geohash index of migration 0006 against ranking over the whole table."""
+import math
+import random
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Case, ExpressionWrapper, F, FloatField, IntegerField, Value, When
+from django.utils import timezone
+
+from now import geo
+from now.benchmarks import analyze, benchmark_database, measure
+from now.models import Category, City, CustomUser, Event
+from now.pagination import CursorPaginator
+from now.services import NEARBY_RINGS_KM, city_feed, nearby_events, rebuild_city_events
+from now.transfer import explicit_timestamps
+
+PAGE_SIZE = 3
+ORDERING = ('ring', '-time_update', '-id')
+FEED_ORDERING = ('ring', '-feed_time', '-feed_event')
+# Share of events around each city, the rest is spread over the country
+CITY_SHARE = 0.9
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--depth', type=int, default=50, help='Number of pages read before the deep page')
+    parser.add_argument('--batch-size', type=int, default=5000)
+
+
+def _seed(events, seed, batch_size):
+    """Insert events around the cities of migration 0006, bigger cities get more of them"""
+    rng = random.Random(seed)
+    now = timezone.now()
+    category = Category.objects.create(category_name='Категория', slug='category')
+    user = CustomUser.objects.create(username='organizer', slug='organizer')
+    cities = list(City.objects.order_by('id'))
+    # Zipf-like weights: the first city of the list has the most events
+    weights = [1 / (rank + 1) for rank in range(len(cities))]
+
+    def generate():
+        for number in range(events):
+            if rng.random() < CITY_SHARE:
+                city = rng.choices(cities, weights)[0]
+                latitude = city.latitude + rng.gauss(0, 20) / geo.KM_PER_DEGREE
+                longitude = city.longitude + rng.gauss(0, 20) / (geo.KM_PER_DEGREE * math.cos(math.radians(latitude)))
+            else:
+                city = None
+                latitude, longitude = rng.uniform(43, 65), rng.uniform(28, 100)
+            created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+            yield Event(title=f'Событие {number}', slug=f'event-{number}', content='content', category=category,
+                        user=user, city=city, latitude=latitude, longitude=longitude,
+                        geohash=geo.encode(latitude, longitude), is_published=rng.random() < 0.9,
+                        time_create=created, time_update=created)
+
+    with explicit_timestamps(Event):
+        Event.objects.bulk_create(generate(), batch_size=batch_size)
+    return {'events': events, 'cities': len(cities)}
+
+
+def _full_scan(latitude, longitude):
+    """Same ranking computed for every published event, what a query without the geohash index does"""
+    lon_scale = geo.KM_PER_DEGREE * math.cos(math.radians(latitude))
+    north_km = (F('latitude') - Value(latitude)) * Value(geo.KM_PER_DEGREE)
+    east_km = (F('longitude') - Value(longitude)) * Value(lon_scale)
+    distance2 = ExpressionWrapper(north_km * north_km + east_km * east_km, output_field=FloatField())
+    ring = Case(*(When(distance2__lte=Value(float(radius * radius)), then=Value(number))
+                  for number, radius in enumerate(NEARBY_RINGS_KM)), output_field=IntegerField())
+    return (Event.objects.filter(is_published=True).annotate(distance2=distance2)
+            .filter(distance2__lte=NEARBY_RINGS_KM[-1] ** 2).annotate(ring=ring))
+
+
+def _deep_page(queryset, ordering, depth):
+    """Return cursor of the page after depth pages, every page read with the cursor of the previous one"""
+    paginator = CursorPaginator(queryset, PAGE_SIZE, ordering)
+    page = paginator.page()
+    for _ in range(depth):
+        if not page.has_next():
+            break
+        page = paginator.page(page.next_cursor)
+    return page.next_cursor
+
+
+def _report(queryset, depth, repeat, ordering=ORDERING):
+    paginator = CursorPaginator(queryset, PAGE_SIZE, ordering)
+    cursor = _deep_page(queryset, ordering, depth)
+    return {
+        'candidates': queryset.count(),
+        'first_page': measure(lambda: paginator.page(), repeat),
+        'deep_page': measure(lambda: paginator.page(cursor), repeat) if cursor else None,
+    }
+
+
+def run(options):
+    with benchmark_database():
+        dataset = _seed(options['events'], options['seed'], options['batch_size'])
+        analyze()
+        # bulk_create sends no post_save, feeds of all cities are built like rebuild_city_events does
+        start = time.perf_counter()
+        city_ids = City.objects.values_list('pk', flat=True)
+        dataset['feed_rows'] = sum(rebuild_city_events(city_id) for city_id in city_ids)
+        dataset['feed_build_seconds'] = round(time.perf_counter() - start, 2)
+        analyze()
+        results = {}
+        # Densest city and a sparse one
+        for city in City.objects.filter(slug__in=('moskva', 'omsk')):
+            results[city.slug] = {
+                'city_feed': _report(city_feed(city.pk), options['depth'], options['repeat'], FEED_ORDERING),
+                'geohash_index': _report(nearby_events(city.latitude, city.longitude), options['depth'],
+                                         options['repeat']),
+                'full_scan': _report(_full_scan(city.latitude, city.longitude), options['depth'], options['repeat']),
+            }
+        moscow = City.objects.get(slug='moskva')
+        plans = {
+            'city_feed': city_feed(moscow.pk).order_by(*FEED_ORDERING)[:PAGE_SIZE].explain(),
+            'geohash_index': nearby_events(moscow.latitude, moscow.longitude).order_by(*ORDERING)[:PAGE_SIZE].explain(),
+        }
+    return {'dataset': dataset, 'vendor': connection.vendor, 'depth': options['depth'], 'results': results,
+            'plans': plans}
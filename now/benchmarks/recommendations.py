@@ -0,0 +1,100 @@
+"""Recommended feed: page of precomputed UserEventScore rows against scoring on request, NumPy and Python rebuild."""
+import random
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from now.benchmarks import analyze, benchmark_database, measure
+from now.models import Category, CustomUser, Event, UserJoinEvent
+from now.pagination import CursorPaginator
+from now.recommendations import np, rebuild_recommendations, recommended_events, refresh_recommendations, score_user
+from now.transfer import explicit_timestamps
+
+PAGE_SIZE = 3
+ORDERING = ('-rec_score', '-rec_event')
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--categories', type=int, default=12)
+    parser.add_argument('--joins', type=int, default=20, help='Mean number of events joined by user')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sample', type=int, default=200, help='Users rebuilt one by one to estimate Python rate')
+    parser.add_argument('--batch-size', type=int, default=500)
+
+
+def _seed(options):
+    """Insert users who join popular events of two favourite categories more often than other events"""
+    rng = random.Random(options['seed'])
+    now = timezone.now()
+    categories = Category.objects.bulk_create(Category(category_name=f'Категория {number}', slug=f'category-{number}')
+                                              for number in range(options['categories']))
+    organizer = CustomUser.objects.create(username='organizer', slug='organizer')
+    with explicit_timestamps(Event):
+        Event.objects.bulk_create(
+            (Event(title=f'Событие {number}', slug=f'event-{number}', content='content', user=organizer,
+                   category=rng.choice(categories), is_published=rng.random() < 0.95,
+                   time_create=now - timedelta(minutes=number), time_update=now - timedelta(minutes=number))
+             for number in range(options['events'])), batch_size=5000)
+    by_category = {}
+    for event_id, category_id in Event.objects.values_list('pk', 'category_id'):
+        by_category.setdefault(category_id, []).append(event_id)
+    CustomUser.objects.bulk_create((CustomUser(username=f'user{number}', slug=f'user{number}')
+                                    for number in range(options['users'])), batch_size=5000)
+    user_ids = list(CustomUser.objects.exclude(pk=organizer.pk).values_list('pk', flat=True))
+
+    def generate():
+        for user_id in user_ids:
+            favourite = rng.sample(list(by_category), 2)
+            chosen = set()
+            for _ in range(max(1, int(rng.expovariate(1 / options['joins'])))):
+                events = by_category[rng.choice(favourite)] if rng.random() < 0.8 else by_category[rng.choice(
+                    list(by_category))]
+                # Popular events of a category are joined much more often
+                chosen.add(events[min(int(rng.paretovariate(1.2)) - 1, len(events) - 1)])
+            for event_id in chosen:
+                yield UserJoinEvent(user_id=user_id, event_id=event_id)
+
+    UserJoinEvent.objects.bulk_create(generate(), batch_size=5000)
+    return {'users': len(user_ids), 'events': options['events'], 'joins': UserJoinEvent.objects.count()}
+
+
+def run(options):
+    with benchmark_database():
+        dataset = _seed(options)
+        analyze()
+        users = list(UserJoinEvent.objects.order_by('user_id').values_list('user_id', flat=True).distinct())
+        sample = users[:options['sample']]
+        start = time.perf_counter()
+        for user_id in sample:
+            refresh_recommendations(user_id)
+        python_seconds = time.perf_counter() - start
+        rebuild = {'python_users_per_sec': round(len(sample) / python_seconds),
+                   'python_estimate_seconds': round(python_seconds / len(sample) * len(users), 2)}
+        if np is not None:
+            start = time.perf_counter()
+            dataset['feed_rows'] = rebuild_recommendations(batch_size=options['batch_size'])
+            rebuild['numpy_seconds'] = round(time.perf_counter() - start, 2)
+        else:
+            rebuild['numpy_seconds'] = None
+            for user_id in users[len(sample):]:
+                refresh_recommendations(user_id)
+        analyze()
+        # Users with the most joins have the largest co-attendance neighbourhoods
+        heavy = (UserJoinEvent.objects.order_by().values('user_id').annotate(joins=Count('id'))
+                 .order_by('-joins').values_list('user_id', flat=True).first())
+        results = {}
+        for name, user_id in (('typical', users[len(users) // 2]), ('heavy', heavy)):
+            paginator = CursorPaginator(recommended_events(user_id), PAGE_SIZE, ORDERING)
+            results[name] = {
+                'joins': UserJoinEvent.objects.filter(user_id=user_id).count(),
+                'feed_page': measure(lambda: paginator.page(), options['repeat']),
+                'score_on_request': measure(lambda: score_user(user_id), options['repeat']),
+            }
+        plan = recommended_events(users[0]).order_by(*ORDERING)[:PAGE_SIZE].explain()
+    return {'dataset': dataset, 'vendor': connection.vendor, 'rebuild': rebuild, 'results': results, 'plan': plan}
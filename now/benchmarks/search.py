@@ -0,0 +1,45 @@
+"""Event search with icontains scans against the ranked full-text index of migration 0004."""
+from django.db import connection
+from django.db.models import Q
+
+from now.benchmarks import analyze, benchmark_database, measure
+from now.benchmarks.data import seed
+from now.models import Event
+from now.search import search_events
+
+PAGE_SIZE = 10
+QUERIES = ('футбол', 'джаз вечер', 'книжный клуб', 'выставки художников')
+
+
+def add_arguments(parser):
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+
+
+def _icontains(query):
+    return (Event.objects.filter(Q(title__icontains=query) | Q(content__icontains=query), is_published=True)
+            .select_related('category', 'user').order_by('-time_update'))
+
+
+def run(options):
+    with benchmark_database():
+        dataset = seed(users=options['users'], events=options['events'], joins=0)
+        analyze()
+        results = {}
+        for query in QUERIES:
+            scan = _icontains(query)
+            ranked = search_events(query)
+            results[query] = {
+                'icontains': {
+                    'page': measure(lambda: list(scan.all()[:PAGE_SIZE]), options['repeat']),
+                    'count': measure(scan.count, options['repeat']),
+                    'matches': scan.count(),
+                },
+                'full_text': {
+                    'page': measure(lambda: ranked[:PAGE_SIZE], options['repeat']),
+                    'count': measure(ranked.count, options['repeat']),
+                    'matches': ranked.count(),
+                },
+            }
+    return {'dataset': dataset, 'vendor': connection.vendor, 'queries': results}
@@ -0,0 +1,146 @@
+"""Latency percentiles and queries per request of every URL in now/urls.py, anonymous and logged in."""
+import json
+import logging
+import tempfile
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from now import urls
+from now.benchmarks import benchmark_database, percentiles
+from now.benchmarks.data import seed
+from now.middleware import QueryCollector
+from now.models import CustomUser, Event, UserJoinEvent
+
+# Views whose GET changes the session or data, the driver restores the state between requests
+RELOGIN_AFTER = {'logout'}
+TOGGLES = {'user_join': 'user_out', 'user_out': 'user_join'}
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--joins', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=50, help='Measured requests per URL and user')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--cold', action='store_true', help='Clear cache before every request')
+    parser.add_argument('--only', nargs='*', help='Url names to measure, all by default')
+    parser.add_argument('--baseline', help='JSON result of an earlier run, adds differences to the report')
+
+
+def _sample_urls(organizer, event):
+    """Return {url name: (path, query)} for every pattern of now/urls.py"""
+    category = event.category
+    arguments = {
+        'update_user': [organizer.slug],
+        'event': [event.slug],
+        'update_event': [event.slug],
+        'category': [category.slug],
+        'delete_event': [event.slug],
+        'event_attendees': [event.slug],
+        'user_join': [event.slug],
+        'user_out': [event.slug],
+        'api_event': [event.slug],
+        'api_category': [category.slug],
+        'api_user': [organizer.slug],
+        'api_membership': [event.slug],
+    }
+    queries = {'search': {'q': event.title.split()[0]}}
+    return {pattern.name: (reverse(pattern.name, args=arguments.get(pattern.name, [])), queries.get(pattern.name))
+            for pattern in urls.urlpatterns}
+
+
+def _request(client, path, query):
+    collector = QueryCollector()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(collector))
+        start = time.perf_counter()
+        response = client.get(path, query)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        elapsed = (time.perf_counter() - start) * 1000
+    return elapsed, collector.count, response.status_code
+
+
+def _measure(client, user, name, path, query, options):
+    timings, queries, statuses = [], [], set()
+    for number in range(options['warmup'] + options['requests']):
+        if options['cold']:
+            cache.clear()
+        elapsed, count, status = _request(client, path, query)
+        if name in RELOGIN_AFTER and user is not None:
+            client.force_login(user)
+        elif name in TOGGLES:
+            # Join and leave alternate, every request changes the membership
+            client.get(reverse(TOGGLES[name], args=[path.rstrip('/').rsplit('/', 1)[-1]]))
+        if number >= options['warmup']:
+            timings.append(elapsed)
+            queries.append(count)
+            statuses.add(status)
+    return {**percentiles(timings), 'queries_per_request': round(sum(queries) / len(queries), 2),
+            'max_queries': max(queries), 'status': sorted(statuses)}
+
+
+def _compare(report, baseline):
+    """Add differences of latency and queries against baseline report"""
+    for mode, views in report['results'].items():
+        for name, current in views.items():
+            previous = baseline.get('results', {}).get(mode, {}).get(name)
+            if previous:
+                current['delta'] = {key: round(current[key] - previous[key], 3)
+                                    for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+                                    if key in previous}
+
+
+def run(options):
+    # 404 of forbidden exports and budget warnings would flood the output of every request
+    logging.disable(logging.WARNING)
+    try:
+        # Own cache directory, --cold clears it before every request and the deployment cache stays intact
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(CACHES={'default': {**settings.CACHE_BACKENDS['file'], 'LOCATION': directory}}):
+            report = _run(options)
+    finally:
+        logging.disable(logging.NOTSET)
+    if options['baseline']:
+        with open(options['baseline'], encoding='utf-8') as file:
+            _compare(report, json.load(file))
+    return report
+
+
+def _run(options):
+    with benchmark_database():
+        dataset = seed(users=options['users'], categories=options['categories'], events=options['events'],
+                       joins=options['joins'], seed=options['seed'])
+        # Event of the busiest organizer, so the attendee export has rows
+        event = (Event.objects.filter(is_published=True).select_related('category', 'user')
+                 .order_by('-attendee_count', 'pk').first())
+        organizer = event.user
+        member = CustomUser.objects.exclude(pk=organizer.pk).order_by('pk').first()
+        UserJoinEvent.objects.filter(event=event, user=member).delete()
+        users = {'anonymous': None, 'member': member, 'organizer': organizer}
+        samples = _sample_urls(organizer, event)
+        results = {}
+        for mode, user in users.items():
+            client = Client()
+            if user is not None:
+                client.force_login(user)
+            results[mode] = {}
+            for name, (path, query) in samples.items():
+                if options['only'] and name not in options['only']:
+                    continue
+                # Logging out as anonymous user is skipped, there is nothing to measure
+                if name in RELOGIN_AFTER and user is None:
+                    continue
+                results[mode][name] = {'path': path, **_measure(client, user, name, path, query, options)}
+        report = {'dataset': dataset, 'vendor': connections['default'].vendor, 'cold_cache': options['cold'],
+                  'requests': options['requests'], 'results': results}
+    return report
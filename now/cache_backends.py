@@ -0,0 +1,110 @@
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.locmem import LocMemCache
+
+# Keys read from the shared tier every time: version keys must change for all processes at once
+DEFAULT_SHARED_ONLY_PREFIXES = ('now:version:',)
+
+
+class TieredCache(BaseCache):
+    """class TieredCache keep a small in-process LRU in front of a shared cache.
+
+    LOCATION is the alias of the shared cache in CACHES. Reads are served from the local
+    tier for at most OPTIONS['LOCAL_TIMEOUT'] seconds, writes go to both tiers. Locks (add)
+    and counters (incr) always use the shared tier, so they stay correct across processes.
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        super().__init__({**params, 'OPTIONS': {}})
+        self._shared_alias = location
+        self._local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self._shared_only_prefixes = tuple(options.get('SHARED_ONLY_PREFIXES', DEFAULT_SHARED_ONLY_PREFIXES))
+        self._local = LocMemCache(f'now-tiered-{location}', {
+            'TIMEOUT': self._local_timeout,
+            'OPTIONS': {'MAX_ENTRIES': options.get('LOCAL_MAX_ENTRIES', 1000)},
+        })
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_only(self, key):
+        return not key.startswith(self._shared_only_prefixes)
+
+    def _local_timeout_for(self, timeout):
+        if timeout is DEFAULT_TIMEOUT or timeout is None:
+            return self._local_timeout
+        return min(timeout, self._local_timeout)
+
+    def get(self, key, default=None, version=None):
+        if self._local_only(key):
+            value = self._local.get(key, self._missing_key, version=version)
+            if value is not self._missing_key:
+                return value
+        value = self.shared.get(key, self._missing_key, version=version)
+        if value is self._missing_key:
+            return default
+        if self._local_only(key):
+            self._local.set(key, value, self._local_timeout, version=version)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._missing_key
+            if self._local_only(key):
+                value = self._local.get(key, value, version=version)
+            if value is self._missing_key:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            shared = self.shared.get_many(missing, version=version)
+            for key, value in shared.items():
+                if self._local_only(key):
+                    self._local.set(key, value, self._local_timeout, version=version)
+            found.update(shared)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        if self._local_only(key):
+            self._local.set(key, value, self._local_timeout_for(timeout), version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        local = {key: value for key, value in data.items() if self._local_only(key) and key not in failed}
+        self._local.set_many(local, self._local_timeout_for(timeout), version=version)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        self._local.delete(key, version=version)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._local.delete(key, version=version)
+        return self.shared.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, self._missing_key, version=version) is not self._missing_key
+
+    def delete(self, key, version=None):
+        self._local.delete(key, version=version)
+        return self.shared.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        self._local.delete_many(keys, version=version)
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        self._local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
@@ -0,0 +1,125 @@
+import hashlib
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.urls import reverse
+
+from now.models import Category, City
+
+# Data keys include the namespace version, so they may live long: a version bump makes them unreachable
+CATEGORIES_TIMEOUT = 60 * 60
+# Anonymous pages are purged by version bump, timeout only limits staleness of attendee counts
+PAGE_TIMEOUT = 60
+# Seconds a regeneration lock is held at most, a crashed worker can not block others for longer
+LOCK_TIMEOUT = 10
+# Seconds a client without lock and without stale copy waits for the lock holder
+LOCK_WAIT = 2
+LOCK_POLL_INTERVAL = 0.05
+
+
+class CategoryRow(namedtuple('CategoryRow', ('id', 'category_name', 'slug', 'event_count'))):
+    """class CategoryRow is cached category with count of its published events."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return str(self.category_name)
+
+    def get_absolute_url(self):
+        """Method get_absolute_url return slug for category"""
+        return reverse('category', kwargs={'category_slug': self.slug})
+
+
+def _version_key(namespace):
+    return f'now:version:{namespace}'
+
+
+def get_version(namespace):
+    """Return current version of namespace, starting from a timestamp if the key was evicted"""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # A timestamp is larger than any version used before eviction, old data keys stay unreachable
+        cache.add(key, time.time_ns() // 1000, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    """Invalidate every key of namespace by moving to the next version"""
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        return get_version(namespace)
+
+
+def get_or_build(namespace, name, build, timeout):
+    """Return cached value of build() for current namespace version with single-flight regeneration
+
+    Only the client holding the lock runs build(). Other clients get the previous value
+    (stale copy) right away or wait up to LOCK_WAIT for the new one.
+    """
+    key = f'now:{namespace}:{name}:v{get_version(namespace)}'
+    value = cache.get(key)
+    if value is not None:
+        return value
+    stale_key = f'now:{namespace}:{name}:stale'
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = build()
+            cache.set_many({key: value, stale_key: value}, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+    value = cache.get(stale_key)
+    deadline = time.monotonic() + LOCK_WAIT
+    while value is None and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key)
+    # Lock holder is too slow or has failed, build without caching
+    return value if value is not None else build()
+
+
+def _build_category_rows():
+    published = Count('event', filter=Q(event__is_published=True, event__is_archived=False))
+    return list(Category.objects.annotate(event_count=published).order_by('id')
+                .values_list('id', 'category_name', 'slug', 'event_count'))
+
+
+def get_category_rows():
+    """Return list of CategoryRow, materialized rows are cached until Event or Category changes"""
+    rows = get_or_build('categories', 'rows', _build_category_rows, CATEGORIES_TIMEOUT)
+    return [CategoryRow(*row) for row in rows]
+
+
+CityRow = namedtuple('CityRow', ('id', 'name', 'slug', 'latitude', 'longitude'))
+
+
+def _build_city_rows():
+    return list(City.objects.order_by('name', 'id').values_list(*CityRow._fields))
+
+
+def get_city_rows():
+    """Return list of CityRow of every city, cached until a city changes"""
+    rows = get_or_build('cities', 'rows', _build_city_rows, CATEGORIES_TIMEOUT)
+    return [CityRow(*row) for row in rows]
+
+
+def _page_name(request):
+    return 'page:' + hashlib.md5(request.get_full_path().encode()).hexdigest()
+
+
+def get_or_build_page(namespace, request, build, timeout=PAGE_TIMEOUT):
+    """Return cached rendered response for request path in namespace, build() on miss"""
+    return get_or_build(namespace, _page_name(request), build, timeout)
+
+
+async def aget_cached_page(namespace, request):
+    """Return cached rendered response for request path with async cache calls, None on miss"""
+    version = await cache.aget(_version_key(namespace))
+    if version is None:
+        return None
+    return await cache.aget(f'now:{namespace}:{_page_name(request)}:v{version}')
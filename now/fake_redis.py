@@ -0,0 +1,197 @@
+import socketserver
+import threading
+import time
+
+
+class _Database:
+    """class _Database is one keyspace of FakeRedisServer with lazy expiry."""
+
+    def __init__(self):
+        self.values = {}
+        self.expires = {}
+
+    def get(self, key):
+        expires = self.expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self.delete(key)
+        return self.values.get(key)
+
+    def set(self, key, value, timeout=None):
+        self.values[key] = value
+        if timeout is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.monotonic() + timeout
+
+    def delete(self, key):
+        self.expires.pop(key, None)
+        return self.values.pop(key, None) is not None
+
+
+class _Error(Exception):
+    """class _Error is sent to client as RESP error reply."""
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """class _Handler serve one client connection speaking RESP2."""
+
+    def setup(self):
+        super().setup()
+        self.db = self.server.databases[0]
+        self.transaction = None
+
+    def handle(self):
+        while True:
+            try:
+                command = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if command is None:
+                return
+            name = command[0].upper().decode()
+            try:
+                if self.transaction is not None and name not in ('EXEC', 'DISCARD', 'MULTI'):
+                    self.transaction.append(command)
+                    reply = self._encode('QUEUED', simple=True)
+                else:
+                    reply = self._encode(*self._execute(name, command[1:]))
+            except _Error as error:
+                reply = f'-ERR {error}\r\n'.encode()
+            self.wfile.write(reply)
+            self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command, e.g. from telnet
+            return line.split()
+        command = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            command.append(self.rfile.read(length + 2)[:-2])
+        return command
+
+    def _encode(self, value, simple=False):
+        if value is None:
+            return b'$-1\r\n'
+        if simple:
+            return f'+{value}\r\n'.encode()
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int):
+            return f':{value}\r\n'.encode()
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(self._encode(*item) for item in value)
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    def _execute(self, name, args):
+        """Return (value, simple) reply for command, transactions run all queued commands under one lock"""
+        if name == 'MULTI':
+            self.transaction = []
+            return 'OK', True
+        if name == 'DISCARD':
+            self.transaction = None
+            return 'OK', True
+        if name == 'EXEC':
+            if self.transaction is None:
+                raise _Error('EXEC without MULTI')
+            queued, self.transaction = self.transaction, None
+            with self.server.lock:
+                return [self._run(command[0].upper().decode(), command[1:]) for command in queued], False
+        with self.server.lock:
+            return self._run(name, args)
+
+    def _run(self, name, args):
+        db = self.db
+        if name == 'PING':
+            return 'PONG', True
+        if name in ('CLIENT', 'AUTH'):
+            return 'OK', True
+        if name == 'SELECT':
+            self.db = self.server.databases.setdefault(int(args[0]), _Database())
+            return 'OK', True
+        if name == 'GET':
+            return db.get(args[0]), False
+        if name == 'SET':
+            key, value, options = args[0], args[1], [option.upper() for option in args[2:]]
+            if b'NX' in options and db.get(key) is not None:
+                return None, False
+            timeout = None
+            if b'EX' in options:
+                timeout = int(options[options.index(b'EX') + 1])
+            elif b'PX' in options:
+                timeout = int(options[options.index(b'PX') + 1]) / 1000
+            db.set(key, value, timeout)
+            return 'OK', True
+        if name == 'MSET':
+            for key, value in zip(args[::2], args[1::2]):
+                db.set(key, value)
+            return 'OK', True
+        if name == 'MGET':
+            return [(db.get(key), False) for key in args], False
+        if name == 'DEL':
+            return sum(db.delete(key) for key in args), False
+        if name == 'EXISTS':
+            return sum(db.get(key) is not None for key in args), False
+        if name == 'EXPIRE':
+            value = db.get(args[0])
+            if value is None:
+                return 0, False
+            db.set(args[0], value, int(args[1]))
+            return 1, False
+        if name == 'PERSIST':
+            return int(db.get(args[0]) is not None and db.expires.pop(args[0], None) is not None), False
+        if name in ('INCR', 'INCRBY', 'DECR', 'DECRBY'):
+            delta = int(args[1]) if len(args) > 1 else 1
+            if name.startswith('DECR'):
+                delta = -delta
+            try:
+                value = int(db.get(args[0]) or 0) + delta
+            except ValueError:
+                raise _Error('value is not an integer or out of range')
+            db.values[args[0]] = str(value).encode()
+            return value, False
+        if name == 'FLUSHDB':
+            db.values.clear()
+            db.expires.clear()
+            return 'OK', True
+        raise _Error(f"unknown command '{name}'")
+
+
+class FakeRedisServer:
+    """class FakeRedisServer is an in-process Redis protocol server for tests and benchmarks.
+
+    It supports the commands used by django.core.cache.backends.redis.RedisCache:
+        with FakeRedisServer() as server:
+            CACHES = {'default': {'BACKEND': '...RedisCache', 'LOCATION': server.url}}
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = socketserver.ThreadingTCPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.databases = {0: _Database()}
+        self._server.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'redis://{host}:{port}/0'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -5,7 +5,8 @@ from captcha.fields import CaptchaField
 from django.core.exceptions import ValidationError
 from django.contrib.auth.forms import AuthenticationForm, UserChangeForm, UserCreationForm
 
-from now.models import CustomUser, Event
+from now.models import Category, City, CustomUser, Event, UserJoinEvent
+from now.services import find_city
 
 
 class RegisterUserForm(UserCreationForm):
@@ -59,6 +60,12 @@ class UpdateUserForm(UserChangeForm):
 
         return username
 
+    def clean_location(self):
+        location = self.cleaned_data['location']
+        # Known city becomes center of the nearby feed, other text is kept as it is
+        self.instance.city = find_city(location)
+        return location
+
 
 class LoginUserForm(AuthenticationForm):
     """class LoginUserForm using for login users."""
@@ -83,11 +90,19 @@ class AddEventForm(forms.ModelForm):
                   'title',
                   'content',
                   'photo',
-                  'category'
+                  'category',
+                  'city',
+                  'latitude',
+                  'longitude',
+                  'starts_at',
+                  'ends_at',
+                  'capacity'
         ]
         widgets = {
                    'title': forms.TextInput(attrs={'class': 'form-input'}),
-                   'content': forms.Textarea(attrs={'cols': 40, 'rows': 5})
+                   'content': forms.Textarea(attrs={'cols': 40, 'rows': 5}),
+                   'starts_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M'),
+                   'ends_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M')
         }
 
     def clean_title(self):
@@ -114,11 +129,19 @@ class UpdateEventForm(forms.ModelForm):
                   'title',
                   'content',
                   'photo',
-                  'category'
+                  'category',
+                  'city',
+                  'latitude',
+                  'longitude',
+                  'starts_at',
+                  'ends_at',
+                  'capacity'
         ]
         widgets = {
                    'title': forms.TextInput(attrs={'class': 'form-input'}),
-                   'content': forms.Textarea(attrs={'cols': 40, 'rows': 5})
+                   'content': forms.Textarea(attrs={'cols': 40, 'rows': 5}),
+                   'starts_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M'),
+                   'ends_at': forms.DateTimeInput(attrs={'type': 'datetime-local'}, format='%Y-%m-%dT%H:%M')
         }
 
     def clean_title(self):
@@ -127,3 +150,57 @@ class UpdateEventForm(forms.ModelForm):
             raise ValidationError('Длина названия превышает 200 символов')
 
         return title
+
+
+class EventApiForm(forms.ModelForm):
+    """class EventApiForm using for create and update event from JSON API, category and city are given by slug."""
+
+    category = forms.ModelChoiceField(Category.objects.all(), to_field_name='slug', label='Категория')
+    city = forms.ModelChoiceField(City.objects.all(), to_field_name='slug', required=False, label='Город')
+
+    class Meta:
+        model = Event
+
+        fields = [
+                  'title',
+                  'content',
+                  'category',
+                  'city',
+                  'latitude',
+                  'longitude',
+                  'starts_at',
+                  'ends_at',
+                  'capacity',
+                  'is_published'
+        ]
+
+    def clean_title(self):
+        title = self.cleaned_data['title']
+        if len(title) > 200:
+            raise ValidationError('Длина названия превышает 200 символов')
+
+        return title
+
+
+class UserJoinEventAdminForm(forms.ModelForm):
+    """class UserJoinEventAdminForm using for add membership in admin, the event must have a free spot."""
+
+    class Meta:
+        model = UserJoinEvent
+
+        fields = [
+                  'event',
+                  'user'
+        ]
+
+    def clean(self):
+        cleaned_data = super().clean()
+        event, user = cleaned_data.get('event'), cleaned_data.get('user')
+        if event is None or user is None or not self.has_changed():
+            return cleaned_data
+        if UserJoinEvent.objects.filter(event=event, user=user).exclude(pk=self.instance.pk).exists():
+            raise ValidationError('Пользователь уже участвует в этом событии')
+        moved_in = self.instance.pk is None or 'event' in self.changed_data
+        if moved_in and event.capacity is not None and event.attendee_count >= event.capacity:
+            raise ValidationError('В событии нет свободных мест, пользователь может встать в лист ожидания')
+        return cleaned_data
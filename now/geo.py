@@ -0,0 +1,72 @@
+import math
+
+# Geohash cell of this precision is about 38 x 19 m, stored hashes are searched by shorter prefixes
+GEOHASH_PRECISION = 8
+KM_PER_DEGREE = 111.32
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Return geohash of point, bits alternate between longitude and latitude starting with longitude"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_BASE32[value])
+            bits = value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Return (latitude, longitude) size of geohash cell of precision in degrees"""
+    bits = precision * 5
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """Return (south, west, north, east) of square around point, the antimeridian is not wrapped"""
+    lat_delta = radius_km / KM_PER_DEGREE
+    lon_delta = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return (max(latitude - lat_delta, -90.0), max(longitude - lon_delta, -180.0),
+            min(latitude + lat_delta, 90.0), min(longitude + lon_delta, 180.0))
+
+
+def covering_cells(south, west, north, east, max_cells=32):
+    """Return the finest geohash cells, at most max_cells of them, which together cover the box"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_size, lon_size = cell_size(precision)
+        rows = range(int((south + 90) // lat_size), int((min(north, 89.999999) + 90) // lat_size) + 1)
+        columns = range(int((west + 180) // lon_size), int((min(east, 179.999999) + 180) // lon_size) + 1)
+        if len(rows) * len(columns) <= max_cells or precision == 1:
+            return sorted({encode(-90 + (row + 0.5) * lat_size, -180 + (column + 0.5) * lon_size, precision)
+                           for row in rows for column in columns})
+
+
+def prefix_range(prefix):
+    """Return (first, last) stored geohash starting with prefix, BETWEEN them is an index range"""
+    return prefix, prefix + _BASE32[-1] * (GEOHASH_PRECISION - len(prefix))
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Return distance from first point to second by equirectangular approximation
+
+    Within a few hundred kilometers it differs from the great-circle distance by less than 1%,
+    now.services.nearby_events() computes the same formula in SQL.
+    """
+    north = (lat2 - lat1) * KM_PER_DEGREE
+    east = (lon2 - lon1) * KM_PER_DEGREE * math.cos(math.radians(lat1))
+    return math.sqrt(north * north + east * east)
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from now.services import ARCHIVE_AFTER, ARCHIVE_BATCH_SIZE, archive_events
+
+
+class Command(BaseCommand):
+    """class Command move finished events out of the hot listing, run it periodically e.g. from cron."""
+
+    help = 'Flag events which ended more than --grace-hours ago as archived, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--grace-hours', type=float, default=ARCHIVE_AFTER.total_seconds() / 3600,
+                            help='Finished events stay in the listing this long')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(hours=options['grace_hours'])
+        archived = archive_events(before=before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'archived {archived} events which ended before {before:%Y-%m-%d %H:%M}'))
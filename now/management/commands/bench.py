@@ -0,0 +1,40 @@
+import json
+from importlib import import_module
+
+from django.core.management.base import BaseCommand
+
+BENCHMARKS = {
+    'archive': 'now.benchmarks.archive',
+    'api': 'now.benchmarks.api',
+    'asgi': 'now.benchmarks.asgi',
+    'cache': 'now.benchmarks.cache',
+    'capacity': 'now.benchmarks.capacity',
+    'indexes': 'now.benchmarks.indexes',
+    'nearby': 'now.benchmarks.nearby',
+    'recommendations': 'now.benchmarks.recommendations',
+    'search': 'now.benchmarks.search',
+    'views': 'now.benchmarks.views',
+}
+
+
+class Command(BaseCommand):
+    """class Command run a benchmark from now.benchmarks and print JSON results."""
+
+    help = 'Run a benchmark against a throwaway test database and print JSON results'
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='benchmark', required=True)
+        for name, path in BENCHMARKS.items():
+            module = import_module(path)
+            subparser = subparsers.add_parser(name, help=module.__doc__)
+            subparser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+            module.add_arguments(subparser)
+
+    def handle(self, *args, **options):
+        result = import_module(BENCHMARKS[options['benchmark']]).run(options)
+        report = json.dumps(result, indent=2, ensure_ascii=False, default=str)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(report + '\n')
+        else:
+            self.stdout.write(report)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from now.transfer import BATCH_SIZE, FORMATS, KINDS, export_records, write_records
+
+
+class Command(BaseCommand):
+    """class Command stream categories, events or joins to NDJSON or CSV."""
+
+    help = 'Export categories, events or joins as NDJSON or CSV, rows are streamed in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', help='Write to this file instead of stdout')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        records = export_records(options['kind'], batch_size=options['batch_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                written = write_records(file, options['format'], options['kind'], records)
+            self.stderr.write(self.style.SUCCESS(f'exported {written} {options["kind"]}'))
+        else:
+            write_records(self.stdout, options['format'], options['kind'], records)
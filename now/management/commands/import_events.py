@@ -0,0 +1,39 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from now.transfer import BATCH_SIZE, FORMATS, KINDS, Importer, read_records
+
+
+class Command(BaseCommand):
+    """class Command load categories, events or joins from NDJSON or CSV in batches."""
+
+    help = ('Import categories, events or joins from NDJSON or CSV written by export_events. '
+            'Import categories and users first, events reference them by slug and username')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=KINDS)
+        parser.add_argument('path', help="File to read, '-' for stdin")
+        parser.add_argument('--format', choices=FORMATS,
+                            help='Defaults to csv for .csv files and ndjson otherwise')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        if path == '-':
+            created, skipped = self._import(sys.stdin, fmt, options)
+        else:
+            if not os.path.exists(path):
+                raise CommandError(f'File {path} does not exist')
+            with open(path, encoding='utf-8', newline='') as file:
+                created, skipped = self._import(file, fmt, options)
+        self.stdout.write(self.style.SUCCESS(f'imported {created} {options["kind"]}, skipped {skipped}'))
+
+    def _import(self, file, fmt, options):
+        importer = Importer(options['kind'], batch_size=options['batch_size'])
+        created, skipped = importer.run(read_records(file, fmt))
+        for line, error in importer.errors:
+            self.stderr.write(f'line {line}: {error}, skipped')
+        return created, skipped
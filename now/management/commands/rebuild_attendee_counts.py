@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from now.services import rebuild_attendee_counts
+
+
+class Command(BaseCommand):
+    """class Command recount Event.attendee_count from UserJoinEvent and report drift."""
+
+    help = 'Recount Event.attendee_count from UserJoinEvent in batches and report drifted events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, do not fix counters')
+
+    def handle(self, *args, **options):
+        drift = rebuild_attendee_counts(batch_size=options['batch_size'], fix=not options['dry_run'])
+        if options['verbosity'] > 1:
+            for event_id, stored, actual in drift:
+                self.stdout.write(f'event {event_id}: {stored} -> {actual}')
+        total = sum(abs(actual - stored) for _, stored, actual in drift)
+        action = 'found' if options['dry_run'] else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'{action} {len(drift)} drifted events, total drift {total}'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from now.models import City
+from now.services import CITY_FEED_BATCH_SIZE, rebuild_city_events
+
+
+class Command(BaseCommand):
+    """class Command fill precomputed nearby feeds of cities from the geohash index of events."""
+
+    help = 'Recompute CityEvent rows of every city or of the given ones, needed after bulk loads of events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('cities', nargs='*', help='Slugs of cities, every city by default')
+        parser.add_argument('--batch-size', type=int, default=CITY_FEED_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        cities = City.objects.order_by('id')
+        if options['cities']:
+            cities = cities.filter(slug__in=options['cities'])
+            missing = set(options['cities']) - set(cities.values_list('slug', flat=True))
+            if missing:
+                raise CommandError(f'unknown cities: {", ".join(sorted(missing))}')
+        total = 0
+        for city_id, slug in cities.values_list('id', 'slug'):
+            created = rebuild_city_events(city_id, batch_size=options['batch_size'])
+            total += created
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{slug}: {created} events')
+        self.stdout.write(self.style.SUCCESS(f'indexed {total} events in nearby feeds'))
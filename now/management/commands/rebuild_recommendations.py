@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from now.recommendations import RECOMMENDATION_BATCH_SIZE, np, rebuild_recommendations
+
+
+class Command(BaseCommand):
+    """class Command recompute recommended feeds of every user from UserJoinEvent."""
+
+    help = 'Recompute UserEventScore rows of every user, vectorized with NumPy when it is installed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECOMMENDATION_BATCH_SIZE,
+                            help='Users scored at once by NumPy')
+
+    def handle(self, *args, **options):
+        if np is None:
+            self.stdout.write(self.style.WARNING('NumPy is not installed, users are scored one by one'))
+        created = rebuild_recommendations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'stored {created} recommendations'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from now.search import rebuild_index
+
+
+class Command(BaseCommand):
+    """class Command fill the full-text search index of events from scratch."""
+
+    help = 'Index every event again, needed on SQLite after bulk loads that bypass post_save'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'indexed {indexed} events'))
@@ -0,0 +1,33 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from now.tasks import VISIBILITY_TIMEOUT, Worker
+
+
+class Command(BaseCommand):
+    """class Command run background jobs queued with now.tasks, no broker besides the database."""
+
+    help = 'Run queued background jobs in a thread pool until interrupted, start more processes to scale out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Jobs run at the same time by this process')
+        parser.add_argument('--visibility-timeout', type=int, default=VISIBILITY_TIMEOUT,
+                            help='Seconds before a job claimed by a dead worker is run again')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls of empty queue')
+        parser.add_argument('--once', action='store_true', help='Exit when no job is due instead of polling')
+
+    def handle(self, *args, **options):
+        # Tasks register on import, apps keep them in their tasks module or import them from ready()
+        autodiscover_modules('tasks')
+        worker = Worker(threads=options['threads'], visibility_timeout=options['visibility_timeout'])
+        stop = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            # Stop claiming, jobs already running are finished before exit
+            signal.signal(signum, lambda *_: stop.set())
+        if options['verbosity'] > 1:
+            self.stdout.write(f'worker {worker.name} started with {worker.threads} threads')
+        worker.run(stop, poll_interval=options['poll_interval'], once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f'processed {worker.processed} jobs, {worker.failed} failed'))
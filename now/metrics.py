@@ -0,0 +1,96 @@
+import bisect
+import threading
+from collections import defaultdict
+
+# Upper bounds of histogram buckets, the last +Inf bucket is implicit
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class _Histogram:
+    """class _Histogram is cumulative Prometheus histogram of one label set."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """Yield (le, cumulative count), then ('+Inf', total)"""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield repr(bound), total
+        yield '+Inf', total + self.counts[-1]
+
+
+def _labels(names, values):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+class Registry:
+    """class Registry keep request metrics of this process and render them in Prometheus text format.
+
+    Every worker process has its own registry, Prometheus sums the series of all scraped workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = defaultdict(int)
+            self.latency = defaultdict(lambda: _Histogram(LATENCY_BUCKETS))
+            self.queries = defaultdict(lambda: _Histogram(QUERY_BUCKETS))
+            self.db_seconds = defaultdict(float)
+            self.template_seconds = defaultdict(float)
+            self.over_budget = defaultdict(int)
+
+    def record(self, view, method, status, latency, queries, db_seconds, template_seconds, over_budget):
+        with self._lock:
+            self.requests[(view, method, status)] += 1
+            self.latency[(view,)].observe(latency)
+            self.queries[(view,)].observe(queries)
+            self.db_seconds[(view,)] += db_seconds
+            self.template_seconds[(view,)] += template_seconds
+            if over_budget:
+                self.over_budget[(view,)] += 1
+
+    def render(self):
+        """Return all metrics in Prometheus text exposition format 0.0.4"""
+        lines = []
+
+        def counter(name, help_text, values, label_names):
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} counter'])
+            for key, value in sorted(values.items()):
+                lines.append(f'{name}{{{_labels(label_names, key)}}} {value}')
+
+        def histogram(name, help_text, values):
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} histogram'])
+            for key, value in sorted(values.items()):
+                labels = _labels(('view',), key)
+                for bound, count in value.samples():
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_sum{{{labels}}} {value.sum}')
+                lines.append(f'{name}_count{{{labels}}} {sum(value.counts)}')
+
+        with self._lock:
+            counter('now_requests_total', 'Requests served by now views.', self.requests,
+                    ('view', 'method', 'status'))
+            histogram('now_request_duration_seconds', 'Total latency of now views.', self.latency)
+            histogram('now_db_queries', 'SQL queries per request of now views.', self.queries)
+            counter('now_db_duration_seconds_total', 'Time spent in SQL queries.', self.db_seconds, ('view',))
+            counter('now_template_render_seconds_total', 'Time spent rendering templates.',
+                    self.template_seconds, ('view',))
+            counter('now_query_budget_exceeded_total', 'Requests over their query budget.', self.over_budget,
+                    ('view',))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
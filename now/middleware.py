@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from now.metrics import registry
+from now.routers import STICKY_COOKIE, end_request, start_request
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCollector:
+    """class QueryCollector count SQL queries and their time, installed with connection.execute_wrapper()."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+# Collector of the request being served. sync_to_async copies the context into its thread, so
+# queries of sync views, middleware and sessions under ASGI are counted into the same collector
+_current_collector = ContextVar('now_query_collector', default=None)
+
+
+def collect_queries(execute, sql, params, many, context):
+    """Execute wrapper of every connection, count query into collector of current request if any"""
+    collector = _current_collector.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+    return collector(execute, sql, params, many, context)
+
+
+def install_query_collector(connection):
+    """Install collect_queries on connection once, called for every new connection of any thread"""
+    if collect_queries not in connection.execute_wrappers:
+        # First in the list: execute_wrapper() context managers pop the last wrapper on exit
+        connection.execute_wrappers.insert(0, collect_queries)
+
+
+def get_query_budget(view, method='GET'):
+    """Return query budget of url name and HTTP method from NOW_QUERY_BUDGETS, None if view has no budget
+
+    A url name key is the budget of GET and HEAD, writes are budgeted with (url name, method) keys.
+    """
+    budgets = getattr(settings, 'NOW_QUERY_BUDGETS', {})
+    key = view if method in ('GET', 'HEAD') else (view, method)
+    return budgets.get(key, getattr(settings, 'NOW_DEFAULT_QUERY_BUDGET', None))
+
+
+class MetricsMiddleware:
+    """class MetricsMiddleware record query count, DB time, template time and latency of now views.
+
+    Only views defined in the now app are measured, admin and third-party views are skipped.
+    Requests with more queries than their budget are logged as warnings.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark instance as coroutine function like django.utils.deprecation.MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        collector = QueryCollector()
+        request._template_seconds = 0.0
+        token = _current_collector.set(collector)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_collector.reset(token)
+        self._record(request, response, time.perf_counter() - start, collector)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        collector = QueryCollector()
+        request._template_seconds = 0.0
+        # Connections are thread-local, the collector reaches sync_to_async threads through the context
+        token = _current_collector.set(collector)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_collector.reset(token)
+        self._record(request, response, time.perf_counter() - start, collector)
+        return response
+
+    def _record(self, request, response, latency, collector):
+        match = getattr(request, 'resolver_match', None)
+        if match is None or not match.func.__module__.startswith('now.') or match.url_name == 'metrics':
+            return
+        view = match.url_name or match.view_name
+        budget = get_query_budget(view, request.method)
+        over_budget = budget is not None and collector.count > budget
+        if over_budget:
+            logger.warning('View %s ran %d queries, budget is %d: %s', view, collector.count, budget,
+                           request.get_full_path())
+        registry.record(view, request.method, response.status_code, latency, collector.count, collector.seconds,
+                        request._template_seconds, over_budget)
+
+    def process_template_response(self, request, response):
+        """Time rendering of TemplateResponse which happens right after this hook"""
+        start = time.perf_counter()
+
+        def rendered(response):
+            request._template_seconds += time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class ReplicaMiddleware:
+    """class ReplicaMiddleware keep routing state of request for now.routers.ReplicaRouter.
+
+    Responses to requests which wrote to the primary set a short-lived cookie, reads of the
+    client stay on the primary until it expires, e.g. the events page after joining an event.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            state = end_request(token)
+        return self._stick(response, state)
+
+    async def __acall__(self, request):
+        token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = end_request(token)
+        return self._stick(response, state)
+
+    @staticmethod
+    def _stick(response, state):
+        if state.wrote and getattr(settings, 'NOW_REPLICA_DATABASES', []):
+            response.set_cookie(STICKY_COOKIE, '1', max_age=settings.NOW_REPLICA_STICKY_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
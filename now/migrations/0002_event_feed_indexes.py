@@ -0,0 +1,45 @@
+# Generated by Django 4.0.2 on 2026-10-18 18:00
+
+from django.db import migrations, models
+
+
+def remove_duplicate_joins(apps, schema_editor):
+    """Keep the first membership of every (event, user) pair before the unique constraint"""
+    UserJoinEvent = apps.get_model('now', 'UserJoinEvent')
+    duplicates = (UserJoinEvent.objects.values('event_id', 'user_id')
+                  .annotate(first_id=models.Min('id'), total=models.Count('id'))
+                  .filter(total__gt=1).order_by())
+    for row in duplicates:
+        (UserJoinEvent.objects.filter(event_id=row['event_id'], user_id=row['user_id'])
+         .exclude(id=row['first_id']).delete())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('now', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='event',
+            options={'ordering': ['-time_update', '-id'], 'verbose_name': 'now events', 'verbose_name_plural': 'now events'},
+        ),
+        migrations.AlterModelOptions(
+            name='userjoinevent',
+            options={'ordering': ['pk'], 'verbose_name': 'now user_join_event', 'verbose_name_plural': 'now user_join_event'},
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-time_update', '-id'], name='now_event_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['category', '-time_update', '-id'], name='now_event_category_feed_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_joins, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userjoinevent',
+            constraint=models.UniqueConstraint(fields=('event', 'user'), name='now_userjoinevent_event_user_uniq'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.0.2 on 2026-10-18 18:02
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_attendee_count(apps, schema_editor):
+    """Count existing memberships of every event in one UPDATE"""
+    Event = apps.get_model('now', 'Event')
+    UserJoinEvent = apps.get_model('now', 'UserJoinEvent')
+    counts = (UserJoinEvent.objects.filter(event_id=models.OuterRef('pk')).order_by()
+              .values('event_id').annotate(total=models.Count('id')).values('total'))
+    Event.objects.update(attendee_count=Coalesce(models.Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('now', '0002_event_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='attendee_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Участники'),
+        ),
+        migrations.RunPython(fill_attendee_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+import re
+
+import snowballstemmer
+from django.db import migrations
+
+# Stems come from the snowballstemmer package instead of now.search, the index does not change with the app code
+_WORD = re.compile(r'\w+')
+
+
+def _normalize(text):
+    """Return space separated stems of all words in text"""
+    stemmer = snowballstemmer.stemmer('russian')
+    return ' '.join(stemmer.stemWord(word.lower().replace('ё', 'е')) for word in _WORD.findall(text or ''))
+
+
+def create_search_index(apps, schema_editor):
+    """PostgreSQL: generated tsvector column with GIN index, SQLite: FTS5 table of stemmed text"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE now_event ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(content, '')), 'B')) STORED")
+        schema_editor.execute('CREATE INDEX now_event_search_idx ON now_event USING GIN (search_vector)')
+    elif vendor == 'sqlite':
+        schema_editor.execute("CREATE VIRTUAL TABLE now_event_search USING fts5(title, content, "
+                              "tokenize='unicode61 remove_diacritics 0')")
+        Event = apps.get_model('now', 'Event')
+        rows = [(event_id, _normalize(title), _normalize(content))
+                for event_id, title, content in Event.objects.values_list('id', 'title', 'content')]
+        if rows:
+            with schema_editor.connection.cursor() as cursor:
+                cursor.executemany('INSERT INTO now_event_search (rowid, title, content) VALUES (%s, %s, %s)', rows)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX now_event_search_idx')
+        schema_editor.execute('ALTER TABLE now_event DROP COLUMN search_vector')
+    elif vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE now_event_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('now', '0003_event_attendee_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
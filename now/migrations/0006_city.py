@@ -0,0 +1,135 @@
+# Generated by Django 4.0.2 on 2026-10-18 18:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Name, slug, latitude and longitude of city center
+CITIES = (
+    ('Москва', 'moskva', 55.7558, 37.6173),
+    ('Санкт-Петербург', 'sankt-peterburg', 59.9343, 30.3351),
+    ('Новосибирск', 'novosibirsk', 55.0084, 82.9357),
+    ('Екатеринбург', 'ekaterinburg', 56.8389, 60.6057),
+    ('Казань', 'kazan', 55.7961, 49.1064),
+    ('Нижний Новгород', 'nizhnii-novgorod', 56.2965, 43.9361),
+    ('Челябинск', 'cheliabinsk', 55.1644, 61.4368),
+    ('Самара', 'samara', 53.1959, 50.1002),
+    ('Омск', 'omsk', 54.9885, 73.3242),
+    ('Ростов-на-Дону', 'rostov-na-donu', 47.2357, 39.7015),
+    ('Уфа', 'ufa', 54.7388, 55.9721),
+    ('Красноярск', 'krasnoiarsk', 56.0153, 92.8932),
+    ('Воронеж', 'voronezh', 51.6720, 39.1843),
+    ('Пермь', 'perm', 58.0105, 56.2502),
+    ('Волгоград', 'volgograd', 48.7080, 44.5133),
+    ('Краснодар', 'krasnodar', 45.0355, 38.9753),
+    ('Подольск', 'podolsk', 55.4312, 37.5458),
+    ('Химки', 'khimki', 55.8970, 37.4297),
+)
+
+
+def normalize(name):
+    return ' '.join(name.split()).lower().replace('ё', 'е')
+
+
+def add_cities(apps, schema_editor):
+    """Fill city table and match free-text locations of users to it"""
+    City = apps.get_model('now', 'City')
+    CustomUser = apps.get_model('now', 'CustomUser')
+    City.objects.bulk_create(City(name=name, normalized_name=normalize(name), slug=slug, latitude=latitude,
+                                  longitude=longitude)
+                             for name, slug, latitude, longitude in CITIES)
+    cities = dict(City.objects.values_list('normalized_name', 'pk'))
+    users = CustomUser.objects.exclude(location='').only('pk', 'location')
+    matched = []
+    for user in users.iterator(chunk_size=2000):
+        user.city_id = cities.get(normalize(user.location))
+        if user.city_id is not None:
+            matched.append(user)
+    CustomUser.objects.bulk_update(matched, ['city'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('now', '0005_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='City',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('normalized_name', models.CharField(editable=False, max_length=100, unique=True)),
+                ('slug', models.SlugField(max_length=255, unique=True, verbose_name='URL')),
+                ('latitude', models.FloatField(verbose_name='Широта')),
+                ('longitude', models.FloatField(verbose_name='Долгота')),
+            ],
+            options={
+                'verbose_name': 'now city',
+                'verbose_name_plural': 'now cities',
+                'ordering': ['name', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ring', models.PositiveSmallIntegerField(verbose_name='Кольцо')),
+                ('distance_km', models.FloatField(verbose_name='Расстояние, км')),
+                ('time_update', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'now city_event',
+                'verbose_name_plural': 'now city_events',
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='geohash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Широта'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, verbose_name='Долгота'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['geohash'], name='now_event_geohash_idx'),
+        ),
+        migrations.AddField(
+            model_name='cityevent',
+            name='city',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='now.city', verbose_name='Город'),
+        ),
+        migrations.AddField(
+            model_name='cityevent',
+            name='event',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='now.event', verbose_name='Событие'),
+        ),
+        migrations.AddField(
+            model_name='customuser',
+            name='city',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='now.city', verbose_name='Город (справочник)'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='city',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='now.city', verbose_name='Город'),
+        ),
+        migrations.AddIndex(
+            model_name='cityevent',
+            index=models.Index(fields=['city', 'ring', '-time_update', '-event'], name='now_cityevent_feed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cityevent',
+            constraint=models.UniqueConstraint(fields=('event', 'city'), name='now_cityevent_event_city_uniq'),
+        ),
+        migrations.RunPython(add_cities, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0.2 on 2026-10-18 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('now', '0006_city'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserEventScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='now.event', verbose_name='Событие')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'now user_event_score',
+                'verbose_name_plural': 'now user_event_scores',
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='usereventscore',
+            index=models.Index(fields=['user', '-score', '-event'], name='now_usereventscore_feed_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='usereventscore',
+            constraint=models.UniqueConstraint(fields=('event', 'user'), name='now_usereventscore_event_user_uniq'),
+        ),
+    ]
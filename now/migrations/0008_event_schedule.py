@@ -0,0 +1,60 @@
+# Generated by Django 4.0.2 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('now', '0007_usereventscore'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='event',
+            name='now_event_feed_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='event',
+            name='now_event_category_feed_idx',
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Окончание'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='is_archived',
+            field=models.BooleanField(default=False, editable=False, verbose_name='В архиве'),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='starts_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Начало'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_archived', False), ('is_published', True)), fields=['-time_update', '-id'], name='now_event_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_archived', False), ('is_published', True)), fields=['category', '-time_update', '-id'], name='now_event_category_feed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_archived', False), ('is_published', True)), fields=['starts_at', 'id'], name='now_event_upcoming_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_archived', False), ('is_published', True)), fields=['category', 'starts_at', 'id'], name='now_event_category_soon_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-ends_at', '-id'], name='now_event_past_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('is_archived', False)), fields=['ends_at', 'id'], name='now_event_ends_idx'),
+        ),
+    ]
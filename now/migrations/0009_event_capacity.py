@@ -0,0 +1,43 @@
+# Generated by Django 4.0.2 on 2026-10-18 19:23
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('now', '0008_event_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='capacity',
+            field=models.PositiveIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Мест'),
+        ),
+        migrations.CreateModel(
+            name='WaitlistEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_create', models.DateTimeField(auto_now_add=True, verbose_name='В очереди с')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='now.event', verbose_name='Событие')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'now waitlist_entry',
+                'verbose_name_plural': 'now waitlist_entries',
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='waitlistentry',
+            index=models.Index(fields=['event', 'id'], name='now_waitlistentry_queue_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='waitlistentry',
+            constraint=models.UniqueConstraint(fields=('event', 'user'), name='now_waitlistentry_event_user_uniq'),
+        ),
+    ]
@@ -1,14 +1,81 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 from django.db import models
 from django.urls import reverse
 from django.utils import timezone
 
-from slugify import slugify
+from now import geo
+from now.slugs import SlugMixin
+
+
+def normalize_city_name(name):
+    """Return key of city name: trimmed, single spaces, lowercase, 'ё' as 'е'"""
+    return ' '.join((name or '').split()).lower().replace('ё', 'е')
+
+
+class PhotoMixin(models.Model):
+    """class PhotoMixin remember photo name loaded from the database, thumbnails are made for new photos only."""
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred photo is not read here, it can not have changed either
+        instance._loaded_photo = instance.__dict__.get('photo')
+        return instance
+
+    def photo_changed(self, update_fields):
+        """Check whether saved photo differs from the one loaded, called from post_save"""
+        if update_fields is not None and 'photo' not in update_fields:
+            return False
+        if 'photo' not in self.__dict__:
+            return False
+        return self.photo.name != getattr(self, '_loaded_photo', None)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if 'photo' in self.__dict__:
+            self._loaded_photo = self.photo.name
+
+
+class City(SlugMixin, models.Model):
+    """class City create structure object city with coordinates of its center."""
+
+    slug_source = 'name'
+    slug_default = 'city'
+
+    name = models.CharField(max_length=100, verbose_name='Название')
+    # Free-text locations of users are matched against this key
+    normalized_name = models.CharField(max_length=100, unique=True, editable=False)
+    slug = models.SlugField(max_length=255, unique=True, db_index=True, verbose_name='URL')
+    latitude = models.FloatField(verbose_name='Широта')
+    longitude = models.FloatField(verbose_name='Долгота')
+
+    def __str__(self):
+        return str(self.name)
+
+    def save(self, *args, **kwargs):
+        """Method save keep normalized_name in sync with name"""
+        self.normalized_name = normalize_city_name(self.name)
+        super().save(*args, **kwargs)
 
+    class Meta:
+        verbose_name = 'now city'
+        verbose_name_plural = 'now cities'
+        ordering = ['name', 'id']
 
-class CustomUser(AbstractUser):
+
+class CustomUser(SlugMixin, PhotoMixin, AbstractUser):
     """class CustomUser create structure object user."""
 
+    slug_source = 'username'
+    slug_default = 'user'
+
     id = models.AutoField(primary_key=True)
     username = models.CharField(max_length=255, verbose_name='Логин', unique=True)
     slug = models.SlugField(max_length=255, unique=True, db_index=True, verbose_name='URL')
@@ -17,6 +84,8 @@ class CustomUser(AbstractUser):
     photo = models.ImageField(upload_to='photos/%Y/%m/%d/', verbose_name='Фото', default='logo_profile.png')
     bio = models.TextField(max_length=500, verbose_name='О пользователе', blank=True)
     location = models.CharField(max_length=30, verbose_name='Город', blank=True)
+    # City matched to location, center of the nearby feed
+    city = models.ForeignKey(City, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Город (справочник)')
     date_joined = models.DateTimeField(default=timezone.now, verbose_name='Дата регистрации')
 
     def __str__(self):
@@ -26,11 +95,6 @@ class CustomUser(AbstractUser):
         """Method get_absolute_url return slug for user"""
         return reverse('username', kwargs={'user_slug': self.slug})
 
-    def save(self, *args, **kwargs):
-        """Method save create slug for user from username"""
-        self.slug = slugify(self.username)
-        super(CustomUser, self).save(*args, **kwargs)
-
     class Meta:
         verbose_name = 'now user'
         verbose_name_plural = 'now user'
@@ -56,9 +120,18 @@ class Category(models.Model):
         ordering = ['id']
 
 
-class Event(models.Model):
+# Events given only start time end this much later
+DEFAULT_EVENT_DURATION = timedelta(hours=2)
+# Condition of partial indexes of listings, archived events are not in them
+HOT_EVENTS = models.Q(is_published=True, is_archived=False)
+
+
+class Event(SlugMixin, PhotoMixin, models.Model):
     """class Event create structure object event."""
 
+    slug_source = 'title'
+    slug_default = 'event'
+
     title = models.CharField(max_length=255, verbose_name='Название')
     slug = models.SlugField(max_length=255, unique=True, db_index=True, verbose_name='URL')
     content = models.TextField(blank=False, verbose_name='Описание')
@@ -66,25 +139,151 @@ class Event(models.Model):
     time_create = models.DateTimeField(auto_now_add=True)
     time_update = models.DateTimeField(auto_now=True)
     is_published = models.BooleanField(default=True, verbose_name='Публикация')
+    # Denormalized number of UserJoinEvent rows, changed only with F() expressions
+    attendee_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Участники')
+    # Spots of the event, no limit when empty; joins over it go to the waitlist
+    capacity = models.PositiveIntegerField(null=True, blank=True, validators=[MinValueValidator(1)],
+                                           verbose_name='Мест')
     category = models.ForeignKey(Category, on_delete=models.PROTECT, verbose_name='Категория')
     user = models.ForeignKey(CustomUser, on_delete=models.PROTECT, verbose_name='Автор')
+    city = models.ForeignKey(City, on_delete=models.PROTECT, null=True, blank=True, verbose_name='Город')
+    # Point of the event, the center of its city when not given
+    latitude = models.FloatField(null=True, blank=True, verbose_name='Широта')
+    longitude = models.FloatField(null=True, blank=True, verbose_name='Долгота')
+    # Geohash of the point, nearby feed reads cells of it as ranges of now_event_geohash_idx
+    geohash = models.CharField(max_length=12, blank=True, editable=False)
+    # Events without schedule stay in the listing until unpublished
+    starts_at = models.DateTimeField(null=True, blank=True, verbose_name='Начало')
+    ends_at = models.DateTimeField(null=True, blank=True, verbose_name='Окончание')
+    # Finished events are moved out of the hot listing by now.services.archive_events()
+    is_archived = models.BooleanField(default=False, editable=False, verbose_name='В архиве')
 
     def __str__(self):
         return str(self.pk)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Capacity as stored, post_save promotes waiting users when it grows
+        instance._loaded_capacity = instance.__dict__.get('capacity')
+        return instance
+
+    def capacity_raised(self):
+        """Check whether capacity of the instance gives more spots than the one loaded from the database"""
+        if 'capacity' not in self.__dict__ or getattr(self, '_loaded_capacity', None) is None:
+            return False
+        return self.capacity is None or self.capacity > self._loaded_capacity
+
+    def clean(self):
+        if self.starts_at and self.ends_at and self.ends_at < self.starts_at:
+            raise ValidationError({'ends_at': 'Окончание события раньше его начала'})
+
+    def save(self, *args, **kwargs):
+        """Method save fill point from city, geohash from point and end from start"""
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            # attendee_count is changed by F() updates only, saving a loaded event must not write it back
+            deferred = self.get_deferred_fields()
+            update_fields = kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred and field.name != 'attendee_count']
+        if update_fields is None or {'city', 'latitude', 'longitude'} & set(update_fields):
+            if (self.latitude is None or self.longitude is None) and self.city_id is not None:
+                self.latitude, self.longitude = self.city.latitude, self.city.longitude
+            has_point = self.latitude is not None and self.longitude is not None
+            self.geohash = geo.encode(self.latitude, self.longitude) if has_point else ''
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'latitude', 'longitude', 'geohash'}
+        if update_fields is None or {'starts_at', 'ends_at'} & set(update_fields):
+            if self.starts_at is not None and self.ends_at is None:
+                self.ends_at = self.starts_at + DEFAULT_EVENT_DURATION
+            # Rescheduled to the future, the event returns to the listing
+            if self.is_archived and self.ends_at is not None and self.ends_at > timezone.now():
+                self.is_archived = False
+            if update_fields is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'ends_at', 'is_archived'}
+        super().save(*args, **kwargs)
+        if 'capacity' in self.__dict__:
+            self._loaded_capacity = self.capacity
+
     def get_absolute_url(self):
         """Method get_absolute_url return slug for event"""
         return reverse('event', kwargs={'event_slug': self.slug})
 
-    def save(self, *args, **kwargs):
-        """Method save create slug for event from title"""
-        self.slug = slugify(self.title)
-        super(Event, self).save(*args, **kwargs)
-
     class Meta:
         verbose_name = 'now events'
         verbose_name_plural = 'now events'
-        ordering = ['id', 'time_update', 'title']
+        # Feed ordering: newest first, id breaks ties so every event has a stable position
+        ordering = ['-time_update', '-id']
+        indexes = [
+            # Partial indexes cover the listing filters and the ordering, rows are read in index order
+            models.Index(fields=['-time_update', '-id'], name='now_event_feed_idx', condition=HOT_EVENTS),
+            models.Index(fields=['category', '-time_update', '-id'], name='now_event_category_feed_idx',
+                         condition=HOT_EVENTS),
+            models.Index(fields=['geohash'], name='now_event_geohash_idx', condition=models.Q(is_published=True)),
+            # Time windows of now.services.EVENT_WINDOWS, past events are listed from the archive too
+            models.Index(fields=['starts_at', 'id'], name='now_event_upcoming_idx', condition=HOT_EVENTS),
+            models.Index(fields=['category', 'starts_at', 'id'], name='now_event_category_soon_idx',
+                         condition=HOT_EVENTS),
+            models.Index(fields=['-ends_at', '-id'], name='now_event_past_idx', condition=models.Q(is_published=True)),
+            # Events not archived yet: ongoing window and candidates of now.services.archive_events()
+            models.Index(fields=['ends_at', 'id'], name='now_event_ends_idx', condition=models.Q(is_archived=False)),
+        ]
+
+
+class CityEvent(models.Model):
+    """class CityEvent create structure object precomputed position of event in nearby feed of city.
+
+    Rows exist for published not archived events within the last ring of now.services.NEARBY_RINGS_KM around the city,
+    the feed of a city is read in order of now_cityevent_feed_idx.
+    """
+
+    city = models.ForeignKey(City, on_delete=models.CASCADE, verbose_name='Город')
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name='Событие')
+    ring = models.PositiveSmallIntegerField(verbose_name='Кольцо')
+    distance_km = models.FloatField(verbose_name='Расстояние, км')
+    # Copy of Event.time_update, the feed is ordered without reading event rows
+    time_update = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.city_id} {self.event_id}'
+
+    class Meta:
+        verbose_name = 'now city_event'
+        verbose_name_plural = 'now city_events'
+        ordering = ['pk']
+        indexes = [
+            models.Index(fields=['city', 'ring', '-time_update', '-event'], name='now_cityevent_feed_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'city'], name='now_cityevent_event_city_uniq'),
+        ]
+
+
+class UserEventScore(models.Model):
+    """class UserEventScore create structure object precomputed score of event in recommended feed of user.
+
+    Rows are written by now.recommendations for published events the user has not joined,
+    the feed of a user is read in order of now_usereventscore_feed_idx.
+    """
+
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Пользователь')
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name='Событие')
+    score = models.FloatField(verbose_name='Оценка')
+
+    def __str__(self):
+        return f'{self.user_id} {self.event_id}'
+
+    class Meta:
+        verbose_name = 'now user_event_score'
+        verbose_name_plural = 'now user_event_scores'
+        ordering = ['pk']
+        indexes = [
+            models.Index(fields=['user', '-score', '-event'], name='now_usereventscore_feed_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'user'], name='now_usereventscore_event_user_uniq'),
+        ]
 
 
 class UserJoinEvent(models.Model):
@@ -100,3 +299,76 @@ class UserJoinEvent(models.Model):
         verbose_name = 'now user_join_event'
         verbose_name_plural = 'now user_join_event'
         ordering = ['pk']
+        constraints = [
+            # One membership per user and event, the index also serves lookups by (event, user)
+            models.UniqueConstraint(fields=['event', 'user'], name='now_userjoinevent_event_user_uniq'),
+        ]
+
+
+class WaitlistEntry(models.Model):
+    """class WaitlistEntry create structure object place of user in waitlist of full event.
+
+    Entries are promoted to UserJoinEvent by now.services in order of id when spots of the event free up.
+    """
+
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name='Событие')
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name='Пользователь')
+    time_create = models.DateTimeField(auto_now_add=True, verbose_name='В очереди с')
+
+    def __str__(self):
+        return f'{self.event_id} {self.user_id}'
+
+    class Meta:
+        verbose_name = 'now waitlist_entry'
+        verbose_name_plural = 'now waitlist_entries'
+        ordering = ['pk']
+        indexes = [
+            # Head of the queue of an event is the first row of this index range
+            models.Index(fields=['event', 'id'], name='now_waitlistentry_queue_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'user'], name='now_waitlistentry_event_user_uniq'),
+        ]
+
+
+class Job(models.Model):
+    """class Job create structure object background task stored for now.tasks worker."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(max_length=255, verbose_name='Задача')
+    payload = models.JSONField(default=dict, verbose_name='Аргументы')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED, verbose_name='Статус')
+    # Same key is queued at most once while pending, e.g. thumbnails of one photo
+    unique_key = models.CharField(max_length=64, null=True, blank=True, verbose_name='Ключ')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попытки')
+    max_attempts = models.PositiveSmallIntegerField(default=3, verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(default=timezone.now, verbose_name='Запуск')
+    # Running job whose lock expired is claimed again, its worker is considered dead
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='Заблокирована до')
+    locked_by = models.CharField(max_length=64, blank=True, verbose_name='Обработчик')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    time_create = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
+
+    class Meta:
+        verbose_name = 'now job'
+        verbose_name_plural = 'now jobs'
+        ordering = ['run_at', 'id']
+        indexes = [
+            # Workers look for due jobs, finished jobs are deleted so the table stays small
+            models.Index(fields=['status', 'run_at'], name='now_job_due_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['unique_key'], name='now_job_pending_key_uniq',
+                                    condition=models.Q(status__in=['queued', 'running'])),
+        ]
@@ -0,0 +1,219 @@
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.http import Http404
+from django.utils.functional import cached_property
+
+# Below this many estimated rows the planner estimate is replaced by an exact COUNT(*)
+APPROXIMATE_COUNT_THRESHOLD = 10000
+# Seconds a counted total is reused when the database has no planner estimate
+APPROXIMATE_COUNT_TIMEOUT = 300
+
+
+class InvalidCursor(Exception):
+    """class InvalidCursor raised when a cursor token can not be decoded."""
+
+
+def estimate_count(queryset, threshold=APPROXIMATE_COUNT_THRESHOLD, timeout=APPROXIMATE_COUNT_TIMEOUT):
+    """Return approximate number of rows in queryset without COUNT(*) on every call"""
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    if connection.vendor == 'postgresql':
+        # Ask the planner how many rows it expects, exact COUNT(*) only for small results
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= threshold:
+            return estimate
+        return queryset.count()
+    # Other databases have no cheap estimate, so the exact count is shared for a while
+    digest = hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+    key = f'now:count:{queryset.db}:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class EstimatedCountPaginator(Paginator):
+    """class EstimatedCountPaginator is Paginator whose count of large querysets comes from estimate_count()."""
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            return estimate_count(self.object_list)
+        return super().count
+
+
+def _cursor_value(value):
+    """JSON value for cursor, datetimes keep microseconds so boundary rows compare exactly"""
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+class CursorPage:
+    """class CursorPage is one page of objects returned by CursorPaginator."""
+
+    is_cursor = True
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """class CursorPaginator using for keyset pagination over a stable ordering.
+
+    The last field of ordering must be unique (usually 'id' or '-id') so every row has
+    exactly one position. Pages are fetched with a WHERE on the ordering values of the
+    page boundary instead of OFFSET, so a deep page costs the same as the first one.
+    """
+
+    def __init__(self, queryset, per_page, ordering, count_mode=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        # count_mode: None - no total, 'exact' - COUNT(*), 'approximate' - estimate_count()
+        self.count_mode = count_mode
+        self._fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    @cached_property
+    def count(self):
+        """Total number of objects or None when count_mode is not set"""
+        if self.count_mode == 'exact':
+            return self.queryset.count()
+        if self.count_mode == 'approximate':
+            return estimate_count(self.queryset)
+        return None
+
+    def encode_cursor(self, obj, reverse=False):
+        """Build opaque token from ordering values of obj"""
+        values = [getattr(obj, self._get_attname(name)) for name, _ in self._fields]
+        payload = json.dumps([int(reverse), values], default=_cursor_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        """Return (reverse, values) from token created by encode_cursor"""
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            reverse, raw_values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if len(raw_values) != len(self._fields):
+                raise InvalidCursor('Cursor does not match ordering')
+            values = [self._get_field(name).to_python(value)
+                      for (name, _), value in zip(self._fields, raw_values)]
+        except (TypeError, ValueError, binascii.Error, ValidationError) as error:
+            raise InvalidCursor('Invalid cursor') from error
+        return bool(reverse), values
+
+    def page(self, cursor=None):
+        """Return CursorPage after (or before, for previous cursors) the given cursor"""
+        if not cursor:
+            rows = list(self._ordered(reverse=False)[:self.per_page + 1])
+            return self._build_page(rows, reverse=False, has_cursor=False)
+        reverse, values = self.decode_cursor(cursor)
+        queryset = self._ordered(reverse).filter(self._keyset_filter(values, reverse))
+        rows = list(queryset[:self.per_page + 1])
+        return self._build_page(rows, reverse=reverse, has_cursor=True)
+
+    def _build_page(self, rows, reverse, has_cursor):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = has_cursor, has_more
+        else:
+            has_next, has_previous = has_more, has_cursor
+        next_cursor = self.encode_cursor(rows[-1]) if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0], reverse=True) if rows and has_previous else None
+        return CursorPage(rows, self, next_cursor=next_cursor, previous_cursor=previous_cursor)
+
+    def _ordered(self, reverse):
+        ordering = []
+        for name, descending in self._fields:
+            descending = descending != reverse
+            ordering.append(f'-{name}' if descending else name)
+        return self.queryset.order_by(*ordering)
+
+    def _keyset_filter(self, values, reverse):
+        """Rows strictly after values in (possibly reversed) ordering"""
+        condition = Q()
+        for index, (name, descending) in enumerate(self._fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[index]})
+            for (previous_name, _), value in zip(self._fields[:index], values[:index]):
+                step &= Q(**{previous_name: value})
+            condition |= step
+        # Redundant range on the first field lets the database seek the index instead of scanning it
+        name, descending = self._fields[0]
+        lookup = 'lte' if descending != reverse else 'gte'
+        return Q(**{f'{name}__{lookup}': values[0]}) & condition
+
+    def _get_field(self, name):
+        # Annotations may be ordered by too, e.g. ring of now.services.nearby_events()
+        annotation = self.queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return self.queryset.model._meta.get_field(name)
+
+    def _get_attname(self, name):
+        if name in self.queryset.query.annotations:
+            return name
+        return self._get_field(name).attname
+
+
+class CursorPaginationMixin:
+    """class CursorPaginationMixin replaces offset pagination of ListView with CursorPaginator."""
+
+    # Fields used for keyset pagination, the last one must be unique
+    cursor_ordering = ('id',)
+    cursor_query_param = 'cursor'
+    # None, 'exact' or 'approximate' (see CursorPaginator.count)
+    count_mode = None
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        """Paginate queryset by cursor from request query string"""
+        paginator = CursorPaginator(queryset, page_size, self.get_cursor_ordering(), count_mode=self.count_mode)
+        try:
+            page = paginator.page(self.request.GET.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise Http404('Неверный курсор страницы')
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,201 @@
+import heapq
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.db import connection, transaction
+from django.db.models import Count, F
+
+from now.models import Category, Event, UserEventScore, UserJoinEvent
+from now.tasks import task
+
+try:
+    import numpy as np
+except ImportError:
+    # Web processes do not need it, rebuild_recommendations() falls back to scoring users one by one
+    np = None
+
+# Score of event for user: CATEGORY_WEIGHT * share of joins of user in category of event
+#                        + COATTENDANCE_WEIGHT * share of co-attendees of user who joined event
+CATEGORY_WEIGHT = 1.0
+COATTENDANCE_WEIGHT = 2.0
+# Newest published events of every category joined by user are scored even without co-attendees
+CATEGORY_CANDIDATES = 50
+# Rows kept per user, the feed is not paginated further
+RECOMMENDATION_FEED_SIZE = 100
+# Other attendees of joined event whose feeds are refreshed too, the nightly rebuild catches up with the rest
+RECOMMENDATION_FANOUT = 50
+RECOMMENDATION_BATCH_SIZE = 500
+
+
+def category_candidates(category_ids, limit=CATEGORY_CANDIDATES):
+    """Return {category_id: [event_id, ...]} of newest published events, each read from now_event_category_feed_idx"""
+    return {category_id: list(Event.objects.filter(category_id=category_id, is_published=True, is_archived=False)
+                              .order_by('-time_update', '-id').values_list('pk', flat=True)[:limit])
+            for category_id in category_ids}
+
+
+def score_user(user_id, feed_size=RECOMMENDATION_FEED_SIZE):
+    """Return best (score, event_id) of user, highest first, from joins of the user and of co-attendees"""
+    joined = dict(UserJoinEvent.objects.filter(user_id=user_id).values_list('event_id', 'event__category_id'))
+    if not joined:
+        return []
+    affinity = {category_id: count / len(joined) for category_id, count in Counter(joined.values()).items()}
+    user_events = UserJoinEvent.objects.filter(user_id=user_id).values('event_id')
+    co_attendees = UserJoinEvent.objects.filter(event_id__in=user_events).exclude(user_id=user_id)
+    # Number of events each co-attendee shares with user
+    shared = dict(co_attendees.order_by().values('user_id').annotate(shared=Count('id'))
+                  .values_list('user_id', 'shared'))
+    total = sum(shared.values())
+    co_sums = defaultdict(int)
+    categories = {}
+    rows = (UserJoinEvent.objects.filter(user_id__in=co_attendees.values('user_id'), event__is_published=True,
+                                         event__is_archived=False)
+            .values_list('user_id', 'event_id', 'event__category_id'))
+    for other_id, event_id, category_id in rows.iterator(chunk_size=2000):
+        co_sums[event_id] += shared[other_id]
+        categories[event_id] = category_id
+    for category_id, event_ids in category_candidates(affinity).items():
+        categories.update(dict.fromkeys(event_ids, category_id))
+    scores = ((CATEGORY_WEIGHT * affinity.get(category_id, 0.0)
+               + COATTENDANCE_WEIGHT * (co_sums[event_id] / total if event_id in co_sums else 0.0), event_id)
+              for event_id, category_id in categories.items() if event_id not in joined)
+    return heapq.nlargest(feed_size, scores)
+
+
+def save_scores(user_ids, rows):
+    """Replace feed rows of users with rows of (user_id, event_id, score), return number of rows"""
+    with transaction.atomic():
+        UserEventScore.objects.filter(user_id__in=user_ids).delete()
+        if rows:
+            # Plain executemany, model instances cost more than scoring in full rebuilds
+            with connection.cursor() as cursor:
+                cursor.executemany(f'INSERT INTO {UserEventScore._meta.db_table} (user_id, event_id, score) '
+                                   f'VALUES (%s, %s, %s)', rows)
+    return len(rows)
+
+
+def refresh_recommendations(user_id):
+    """Recompute feed of one user, return number of rows"""
+    return save_scores([user_id], [(user_id, event_id, score) for score, event_id in score_user(user_id)])
+
+
+@task(unique=True)
+def update_recommendations(user_id, event_id):
+    """Refresh feeds changed by join or leave: of the user and of the latest other attendees of event"""
+    refresh_recommendations(user_id)
+    others = (UserJoinEvent.objects.filter(event_id=event_id).exclude(user_id=user_id).order_by('-pk')
+              .values_list('user_id', flat=True)[:RECOMMENDATION_FANOUT])
+    for other_id in others:
+        refresh_recommendations(other_id)
+
+
+def remove_event(event_id):
+    """Drop unpublished event from every feed with one DELETE on the (event, user) index"""
+    UserEventScore.objects.filter(event_id=event_id).delete()
+
+
+def recommended_events(user_id):
+    """Return events of recommended feed of user, ordered by now_usereventscore_feed_idx without sorting
+
+    Events are annotated with rec_score and rec_event from the UserEventScore row, the feed is
+    paginated by these annotations so serving a page is one range read of the index.
+    """
+    return (Event.objects.filter(usereventscore__user_id=user_id)
+            .annotate(rec_score=F('usereventscore__score'), rec_event=F('usereventscore__event_id')))
+
+
+def rebuild_recommendations(batch_size=RECOMMENDATION_BATCH_SIZE):
+    """Recompute feeds of every user, return number of rows
+
+    Scores are computed with NumPy for batch_size users at once when it is installed,
+    otherwise users are scored one by one with score_user().
+    """
+    UserEventScore.objects.exclude(user_id__in=UserJoinEvent.objects.values('user_id')).delete()
+    if np is not None:
+        return _rebuild_vectorized(batch_size)
+    users = UserJoinEvent.objects.order_by('user_id').values_list('user_id', flat=True).distinct()
+    return sum(refresh_recommendations(user_id) for user_id in users.iterator())
+
+
+def _csr(keys, values, size):
+    """Return (indptr, values sorted by key), values of key k are values[indptr[k]:indptr[k + 1]]"""
+    order = np.argsort(keys, kind='stable')
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=size), out=indptr[1:])
+    return indptr, values[order]
+
+
+def _expand(keys, indptr, values):
+    """Return (position of key, value) for every value of every key, a CSR lookup without Python loop"""
+    starts = indptr[keys]
+    counts = indptr[keys + 1] - starts
+    owner = np.repeat(np.arange(len(keys)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, values[np.repeat(starts, counts) + offsets]
+
+
+def _rebuild_vectorized(batch_size):
+    """Score users batch by batch with sparse joins of user x event arrays, same formula as score_user()"""
+    rows = UserJoinEvent.objects.order_by().values_list('user_id', 'event_id').iterator(chunk_size=10000)
+    joins = np.fromiter(chain.from_iterable(rows), dtype=np.int64).reshape(-1, 2)
+    if not len(joins):
+        return 0
+    candidates = category_candidates(Category.objects.values_list('pk', flat=True))
+    candidate_rows = [(event_id, category_id, True, False)
+                      for category_id, event_ids in candidates.items() for event_id in event_ids]
+    meta = list(Event.objects.filter(pk__in=UserJoinEvent.objects.values('event_id'))
+                .values_list('pk', 'category_id', 'is_published', 'is_archived').iterator(chunk_size=10000))
+    meta = np.array(meta + candidate_rows, dtype=np.int64)
+    # Dense numbering of users, events and categories
+    event_ids, first = np.unique(meta[:, 0], return_index=True)
+    category_ids, event_category = np.unique(meta[first, 1], return_inverse=True)
+    # Only listed events are recommended
+    published = meta[first, 2].astype(bool) & ~meta[first, 3].astype(bool)
+    user_ids, join_user = np.unique(joins[:, 0], return_inverse=True)
+    join_event = np.searchsorted(event_ids, joins[:, 1])
+    n_users, n_events, n_categories = len(user_ids), len(event_ids), len(category_ids)
+    user_ptr, user_events = _csr(join_user, join_event, n_users)
+    event_ptr, event_users = _csr(join_event, join_user, n_events)
+    candidate_events = np.searchsorted(event_ids, meta[len(meta) - len(candidate_rows):, 0])
+    candidate_ptr, candidate_events = _csr(event_category[candidate_events], candidate_events, n_categories)
+
+    created = 0
+    for start in range(0, n_users, batch_size):
+        batch = np.arange(start, min(start + batch_size, n_users))
+        owner, joined = _expand(batch, user_ptr, user_events)
+        affinity = np.zeros((len(batch), n_categories))
+        np.add.at(affinity, (owner, event_category[joined]), 1)
+        affinity /= np.diff(user_ptr)[batch][:, None]
+        # Co-attendees of every user and number of events shared with them
+        position, other = _expand(joined, event_ptr, event_users)
+        position = owner[position]
+        pairs = position * n_users + other
+        pairs, shared = np.unique(pairs[other != batch[position]], return_counts=True)
+        pair_owner, pair_user = pairs // n_users, pairs % n_users
+        total = np.bincount(pair_owner, weights=shared, minlength=len(batch))
+        position, event = _expand(pair_user, user_ptr, user_events)
+        weight, position = shared[position], pair_owner[position]
+        keep = published[event]
+        co_keys, inverse = np.unique(position[keep] * n_events + event[keep], return_inverse=True)
+        co = np.bincount(inverse, weights=weight[keep]) / total[co_keys // n_events]
+        # Newest events of categories joined by the user
+        affine_owner, affine_category = np.nonzero(affinity)
+        position, event = _expand(affine_category, candidate_ptr, candidate_events)
+        keys = np.union1d(co_keys, affine_owner[position] * n_events + event)
+        keys = keys[~np.isin(keys, owner * n_events + joined)]
+        key_owner, key_event = keys // n_events, keys % n_events
+        co_all = np.zeros(len(keys))
+        found = np.searchsorted(keys, co_keys)
+        present = found < len(keys)
+        present[present] = keys[found[present]] == co_keys[present]
+        co_all[found[present]] = co[present]
+        scores = CATEGORY_WEIGHT * affinity[key_owner, event_category[key_event]] + COATTENDANCE_WEIGHT * co_all
+        # Best RECOMMENDATION_FEED_SIZE of every user: highest score, then highest event id like score_user()
+        order = np.lexsort((-event_ids[key_event], -scores, key_owner))
+        key_owner, key_event, scores = key_owner[order], key_event[order], scores[order]
+        rank = np.arange(len(order)) - np.searchsorted(key_owner, key_owner)
+        top = rank < RECOMMENDATION_FEED_SIZE
+        created += save_scores(user_ids[batch].tolist(),
+                               list(zip(user_ids[batch][key_owner[top]].tolist(), event_ids[key_event[top]].tolist(),
+                                        scores[top].tolist())))
+    return created
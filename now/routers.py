@@ -0,0 +1,73 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# Cookie of clients which wrote recently, their reads stay on the primary until replicas catch up
+STICKY_COOKIE = 'now_primary'
+
+_state = ContextVar('now_routing_state', default=None)
+
+
+class RoutingState:
+    """class RoutingState is database routing decision of one request, set by ReplicaMiddleware.
+
+    The object is shared with sync_to_async threads of the request, changes made there are seen by the middleware.
+    """
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+
+def start_request():
+    """Install fresh routing state for current request, return token for end_request()"""
+    return _state.set(RoutingState())
+
+
+def end_request(token):
+    """Return routing state of request started with start_request() and remove it"""
+    state = _state.get()
+    _state.reset(token)
+    return state
+
+
+def read_from_replica(request):
+    """Send remaining reads of request to a replica, unless the client wrote within the sticky window"""
+    state = _state.get()
+    replicas = getattr(settings, 'NOW_REPLICA_DATABASES', [])
+    if state is None or not replicas or STICKY_COOKIE in request.COOKIES:
+        return
+    # One replica per request, so paginated queries see the same snapshot
+    state.replica = random.choice(replicas)
+
+
+class ReplicaRouter:
+    """class ReplicaRouter route reads of views marked with ReplicaReadMixin to NOW_REPLICA_DATABASES.
+
+    Writes and reads of every other code, management commands and the task worker included, use the primary.
+    After the first write of a request its reads go to the primary too.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.replica is None or state.wrote:
+            # Explicit alias, otherwise Django reads related objects from the database of the hinted instance
+            return DEFAULT_DB_ALIAS
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        # Objects read from a replica are saved to the primary, not back to their replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold copies of the primary rows
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema by replication
+        return db not in getattr(settings, 'NOW_REPLICA_DATABASES', [])
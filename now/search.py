@@ -0,0 +1,180 @@
+import re
+import threading
+
+import snowballstemmer
+from django.db import connection, connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from now.models import Event
+
+SQLITE_TABLE = 'now_event_search'
+# Title matches rank higher than content matches
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+INDEX_BATCH_SIZE = 1000
+
+_WORD = re.compile(r'\w+')
+_local = threading.local()
+
+
+def stem(word):
+    """Return stem of Russian word by Snowball algorithm, other words are returned lowercased"""
+    stemmer = getattr(_local, 'stemmer', None)
+    if stemmer is None:
+        # Stemmer keeps its state while stemming a word, every thread gets its own
+        stemmer = _local.stemmer = snowballstemmer.stemmer('russian')
+    return stemmer.stemWord(word.lower().replace('ё', 'е'))
+
+
+def normalize(text):
+    """Return space separated stems of all words in text"""
+    return ' '.join(stem(word) for word in _WORD.findall(text or ''))
+
+
+def index_rows(cursor, rows):
+    """Write (id, title, content) rows into SQLite FTS5 table"""
+    rows = list(rows)
+    if not rows:
+        return
+    cursor.executemany(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+    cursor.executemany(f'INSERT INTO {SQLITE_TABLE} (rowid, title, content) VALUES (%s, %s, %s)',
+                       [(event_id, normalize(title), normalize(content)) for event_id, title, content in rows])
+
+
+def uses_fts_table():
+    """PostgreSQL keeps its generated tsvector column up to date, SQLite needs the FTS5 table written"""
+    return connection.vendor == 'sqlite'
+
+
+def index_events(events):
+    """Update search index for saved events"""
+    if uses_fts_table():
+        with connection.cursor() as cursor:
+            index_rows(cursor, [(event.pk, event.title, event.content) for event in events])
+
+
+def remove_events(event_ids):
+    """Remove deleted events from search index"""
+    if uses_fts_table() and event_ids:
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [(event_id,) for event_id in event_ids])
+
+
+def rebuild_index(batch_size=INDEX_BATCH_SIZE):
+    """Index every event again, return number of indexed events"""
+    if not uses_fts_table():
+        return 0
+    indexed = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+        rows = Event.objects.order_by('pk').values_list('pk', 'title', 'content')
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) == batch_size:
+                index_rows(cursor, batch)
+                indexed, batch = indexed + len(batch), []
+        index_rows(cursor, batch)
+    return indexed + len(batch)
+
+
+class SearchResults:
+    """class SearchResults is lazy ranked result of search_events() usable by Paginator.
+
+    Only the requested slice of ids and ranks is read from the full-text index,
+    then events of that slice are loaded in one query.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        # Read from the replica chosen for the request, like the events loaded by in_bulk()
+        self.connection = connections[router.db_for_read(Event)]
+        self.vendor = self.connection.vendor
+        self._terms = normalize(query).split() if self.vendor == 'sqlite' else []
+
+    def _is_empty(self):
+        return not self.query.strip() or (self.vendor == 'sqlite' and not self._terms)
+
+    def count(self):
+        if self._is_empty():
+            return 0
+        if self.vendor not in ('sqlite', 'postgresql'):
+            return self._fallback().count()
+        sql, params = self._sql('COUNT(*)', '')
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if self._is_empty():
+            return []
+        start = index.start or 0
+        stop = index.stop if index.stop is not None else self.count()
+        if stop <= start:
+            return []
+        if self.vendor not in ('sqlite', 'postgresql'):
+            return list(self._fallback()[start:stop])
+        sql, params = self._sql('e.id, rank', 'ORDER BY rank DESC, e.id DESC LIMIT %s OFFSET %s')
+        params += [stop - start, start]
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ranks = cursor.fetchall()
+        events = Event.objects.select_related('category', 'user').in_bulk([event_id for event_id, _ in ranks])
+        results = []
+        for event_id, rank in ranks:
+            # Deleted between the rank query and in_bulk()
+            event = events.get(event_id)
+            if event is None:
+                continue
+            event.rank = rank
+            results.append(event)
+        return results
+
+    def _sql(self, columns, tail):
+        """Return SQL over the full-text index of current database for published events"""
+        if self.vendor == 'postgresql':
+            sql = (f'SELECT {columns} FROM (SELECT e.id, ts_rank_cd(e.search_vector, q) AS rank '
+                   f"FROM now_event e, websearch_to_tsquery('russian', %s) q "
+                   f'WHERE e.search_vector @@ q AND e.is_published) e {tail}')
+            return sql, [self.query]
+        # bm25() is smaller for better matches, negate so both databases sort by rank DESC
+        match = _fts_match(self._terms)
+        sql = (f'SELECT {columns} FROM (SELECT {SQLITE_TABLE}.rowid AS id, -bm25({SQLITE_TABLE}, %s, %s) AS rank '
+               f'FROM {SQLITE_TABLE} JOIN now_event ev ON ev.id = {SQLITE_TABLE}.rowid '
+               f'WHERE {SQLITE_TABLE} MATCH %s AND ev.is_published) e {tail}')
+        return sql, [TITLE_WEIGHT, CONTENT_WEIGHT, match]
+
+    def _fallback(self):
+        return (Event.objects.filter(Q(title__icontains=self.query) | Q(content__icontains=self.query),
+                                     is_published=True).select_related('category', 'user'))
+
+
+def _fts_match(terms):
+    """Return FTS5 query matching rows with every normalized term"""
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def filter_events(queryset, query):
+    """Return queryset narrowed to events matching query in the full-text index, unpublished ones included"""
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        return queryset.filter(pk__in=RawSQL(
+            "SELECT id FROM now_event WHERE search_vector @@ websearch_to_tsquery('russian', %s)", [query]))
+    if vendor == 'sqlite':
+        terms = normalize(query).split()
+        if not terms:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s',
+                                             [_fts_match(terms)]))
+    return queryset.filter(Q(title__icontains=query) | Q(content__icontains=query))
+
+
+def search_events(query):
+    """Return SearchResults of published events matching query, best matches first"""
+    return SearchResults(query)
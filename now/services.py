@@ -0,0 +1,361 @@
+import math
+from datetime import timedelta
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, Exists, ExpressionWrapper, F, FloatField, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from now import geo
+from now.caching import bump_version, get_city_rows
+from now.models import City, CityEvent, Event, UserEventScore, UserJoinEvent, WaitlistEntry, normalize_city_name
+from now.recommendations import update_recommendations
+from now.tasks import task
+
+# Attendee fields exported to organizers, read with the UserJoinEvent row in one join
+ATTENDEE_FIELDS = ('username', 'first_name', 'last_name', 'email')
+ATTENDEE_CHUNK_SIZE = 2000
+# Outer bounds of distance rings of the nearby feed, events of a closer ring come first, newest first inside a ring
+NEARBY_RINGS_KM = (5, 15, 50)
+CITY_FEED_BATCH_SIZE = 2000
+# Window of ?when= parameter: (label, cursor ordering matching its partial index)
+EVENT_WINDOWS = {
+    'upcoming': ('Скоро', ('starts_at', 'id')),
+    'ongoing': ('Сейчас', ('ends_at', 'id')),
+    'past': ('Прошедшие', ('-ends_at', '-id')),
+}
+# Finished events stay in the listing this long before archive_events() moves them out
+ARCHIVE_AFTER = timedelta(days=1)
+ARCHIVE_BATCH_SIZE = 1000
+# Results of request_spot()
+JOINED = 'joined'
+WAITLISTED = 'waitlisted'
+_FULL = 'full'
+
+
+def change_attendee_count(event_id, delta):
+    """Add delta to Event.attendee_count in one UPDATE without reading the row"""
+    if delta:
+        Event.objects.filter(pk=event_id).update(attendee_count=F('attendee_count') + delta)
+
+
+def rebuild_attendee_counts(batch_size=1000, fix=True, event_ids=None):
+    """Compare Event.attendee_count with UserJoinEvent rows and return list of (event_id, stored, actual)
+
+    With event_ids only those events are compared, e.g. events of imported memberships.
+    """
+    events = Event.objects.all() if event_ids is None else Event.objects.filter(pk__in=event_ids)
+    drift = []
+    last_id = 0
+    while True:
+        # Walk events by primary key, every batch costs two indexed queries
+        batch = list(events.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'attendee_count')[:batch_size])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        joins = UserJoinEvent.objects.filter(event_id__gte=batch[0][0], event_id__lte=last_id)
+        if event_ids is not None:
+            joins = joins.filter(event_id__in=[event_id for event_id, _ in batch])
+        actual = dict(joins.order_by().values('event_id').annotate(total=Count('id')).values_list('event_id', 'total'))
+        changed = [(event_id, stored, actual.get(event_id, 0)) for event_id, stored in batch
+                   if stored != actual.get(event_id, 0)]
+        if changed and fix:
+            Event.objects.bulk_update([Event(pk=event_id, attendee_count=count) for event_id, _, count in changed],
+                                      ['attendee_count'])
+        drift.extend(changed)
+    return drift
+
+
+class _EventFull(Exception):
+    """Raised inside the join transaction to roll back the membership of event without free spot"""
+
+
+def claim_spot(event_id):
+    """Add one attendee with conditional UPDATE, return False when event has no free spot
+
+    The UPDATE checks the cap and increments the counter in one statement under the row lock,
+    so concurrent joins can never take more spots than Event.capacity.
+    """
+    has_spot = Q(capacity__isnull=True) | Q(attendee_count__lt=F('capacity'))
+    return bool(Event.objects.filter(has_spot, pk=event_id).update(attendee_count=F('attendee_count') + 1))
+
+
+def _has_spot_after_leave(event_id):
+    """Lock event row and return whether it is under capacity without one attendee
+
+    Capacity lowered below attendee_count is reached by leaves first, the waitlist is not promoted meanwhile.
+    """
+    has_spot = Q(capacity__isnull=True) | Q(attendee_count__lte=F('capacity'))
+    return Event.objects.select_for_update().filter(has_spot, pk=event_id).exists()
+
+
+def _join(event_id, user_id):
+    """Insert membership and take spot in one transaction, return JOINED, _FULL or None if joined already"""
+    try:
+        # Unique constraint now_userjoinevent_event_user_uniq rejects repeat joins without a SELECT
+        with transaction.atomic():
+            UserJoinEvent.objects.create(event_id=event_id, user_id=user_id)
+            if not claim_spot(event_id):
+                raise _EventFull
+            # Feed refresh job commits together with the membership
+            update_recommendations.enqueue(user_id, event_id)
+    except IntegrityError:
+        return None
+    except _EventFull:
+        return _FULL
+    # Validators of pages personalized for this user change with the membership version
+    bump_version(f'memberships:{user_id}')
+    return JOINED
+
+
+def join_event(event_id, user_id):
+    """Add user to event with one INSERT, return False if user has joined already or event is full"""
+    return _join(event_id, user_id) == JOINED
+
+
+def request_spot(event_id, user_id):
+    """Join event or queue user on its waitlist when it is full, return JOINED, WAITLISTED or None if already there"""
+    status = _join(event_id, user_id)
+    if status != _FULL:
+        return status
+    try:
+        with transaction.atomic():
+            WaitlistEntry.objects.create(event_id=event_id, user_id=user_id)
+    except IntegrityError:
+        return None
+    bump_version(f'memberships:{user_id}')
+    # The claim has just found the event full, so no promotion is tried here. A spot freed between the
+    # claim and the insert goes to the next join, and leaves and raised capacity promote the queue
+    return WAITLISTED
+
+
+def _pop_waitlist(event_id):
+    """Delete head of waitlist of event and add its user to the event, return user id or None if nobody waits
+
+    Called inside the transaction which holds the spot, the counter is not changed here.
+    """
+    while True:
+        head = (WaitlistEntry.objects.filter(event_id=event_id).order_by('pk')
+                .values_list('pk', 'user_id').first())
+        if head is None:
+            return None
+        entry_id, user_id = head
+        # Concurrent promotion may have taken the entry between SELECT and DELETE
+        if not WaitlistEntry.objects.filter(pk=entry_id).delete()[0]:
+            continue
+        try:
+            with transaction.atomic():
+                UserJoinEvent.objects.create(event_id=event_id, user_id=user_id)
+        except IntegrityError:
+            # Joined while waiting, e.g. added by admin
+            continue
+        update_recommendations.enqueue(user_id, event_id)
+        return user_id
+
+
+def promote_waitlist(event_id):
+    """Move waiting users into free spots of event in queue order, return list of promoted user ids"""
+    promoted = []
+    while WaitlistEntry.objects.filter(event_id=event_id).exists():
+        with transaction.atomic():
+            if not claim_spot(event_id):
+                break
+            user_id = _pop_waitlist(event_id)
+            if user_id is None:
+                # Queue emptied concurrently, give the spot back
+                transaction.set_rollback(True)
+                break
+        promoted.append(user_id)
+    for user_id in promoted:
+        bump_version(f'memberships:{user_id}')
+    return promoted
+
+
+def leave_event(event_id, user_id):
+    """Remove user from event or its waitlist, return False if user has neither joined nor waited
+
+    Spot of leaving attendee passes to the head of the waitlist in the same transaction,
+    attendee_count stays as it is then. Event over its lowered capacity keeps the spot empty.
+    """
+    promoted = None
+    with transaction.atomic():
+        deleted, _ = UserJoinEvent.objects.filter(event_id=event_id, user_id=user_id).delete()
+        if deleted:
+            if _has_spot_after_leave(event_id):
+                promoted = _pop_waitlist(event_id)
+            if promoted is None:
+                change_attendee_count(event_id, -1)
+            update_recommendations.enqueue(user_id, event_id)
+        else:
+            deleted, _ = WaitlistEntry.objects.filter(event_id=event_id, user_id=user_id).delete()
+    if deleted:
+        bump_version(f'memberships:{user_id}')
+    if promoted is not None:
+        bump_version(f'memberships:{promoted}')
+    return bool(deleted)
+
+
+def delete_event(event):
+    """Delete event together with its memberships (UserJoinEvent.event is PROTECT)"""
+    with transaction.atomic():
+        UserJoinEvent.objects.filter(event_id=event.pk).delete()
+        event.delete()
+
+
+def has_joined(user, event_id):
+    """Check membership of current user with one EXISTS query, anonymous user never joined"""
+    if not user.is_authenticated:
+        return False
+    return UserJoinEvent.objects.filter(event_id=event_id, user_id=user.pk).exists()
+
+
+def membership_state(user, event_id):
+    """Return (joined, waiting) of current user for event with one query of two EXISTS subqueries"""
+    if not user.is_authenticated:
+        return False, False
+    state = (Event.objects.filter(pk=event_id)
+             .annotate(joined=Exists(UserJoinEvent.objects.filter(event_id=event_id, user_id=user.pk)),
+                       waiting=Exists(WaitlistEntry.objects.filter(event_id=event_id, user_id=user.pk)))
+             .values_list('joined', 'waiting').first())
+    return state or (False, False)
+
+
+def joined_event_ids(user, event_ids):
+    """Return set of event ids joined by user with one IN query for all events"""
+    if not user.is_authenticated or not event_ids:
+        return set()
+    return set(UserJoinEvent.objects.filter(event_id__in=event_ids, user_id=user.pk)
+               .values_list('event_id', flat=True))
+
+
+def iter_attendees(event_id, chunk_size=ATTENDEE_CHUNK_SIZE):
+    """Yield attendee tuples of ATTENDEE_FIELDS, rows are fetched chunk by chunk"""
+    # Ordering by user_id follows the (event, user) unique index, no sort of all attendees is needed
+    rows = (UserJoinEvent.objects.filter(event_id=event_id).order_by('user_id')
+            .values_list(*(f'user__{field}' for field in ATTENDEE_FIELDS)))
+    return rows.iterator(chunk_size=chunk_size)
+
+
+def find_city(location):
+    """Return City matching free-text location, None when the city is unknown"""
+    name = normalize_city_name(location)
+    if not name:
+        return None
+    return City.objects.filter(normalized_name=name).first()
+
+
+def nearby_events(latitude, longitude, rings_km=NEARBY_RINGS_KM):
+    """Return published events within the last ring around point, annotated with ring number
+
+    Candidates are read from now_event_geohash_idx as ranges of the geohash cells covering the
+    bounding box, distance and ring are computed by the database for those rows only.
+    """
+    south, west, north, east = geo.bounding_box(latitude, longitude, rings_km[-1])
+    cells = Q()
+    for cell in geo.covering_cells(south, west, north, east):
+        # SQLite searches the partial index for every OR term only when each term repeats its condition
+        cells |= Q(geohash__range=geo.prefix_range(cell), is_published=True)
+    # Same formula as now.geo.distance_km()
+    lon_scale = geo.KM_PER_DEGREE * math.cos(math.radians(latitude))
+    north_km = (F('latitude') - Value(latitude)) * Value(geo.KM_PER_DEGREE)
+    east_km = (F('longitude') - Value(longitude)) * Value(lon_scale)
+    distance2 = ExpressionWrapper(north_km * north_km + east_km * east_km, output_field=FloatField())
+    ring = Case(*(When(distance2__lte=Value(float(radius * radius)), then=Value(number))
+                  for number, radius in enumerate(rings_km)), output_field=IntegerField())
+    return (Event.objects.filter(cells, is_published=True, is_archived=False, latitude__range=(south, north),
+                                 longitude__range=(west, east))
+            .annotate(distance2=distance2).filter(distance2__lte=rings_km[-1] ** 2).annotate(ring=ring))
+
+
+def ring_of(distance_km, rings_km=NEARBY_RINGS_KM):
+    """Return number of the first ring containing distance, None beyond the last ring"""
+    return next((number for number, radius in enumerate(rings_km) if distance_km <= radius), None)
+
+
+def update_city_events(events):
+    """Recompute CityEvent rows of saved events from distances to the cached city centers"""
+    located = [event for event in events
+               if event.is_published and not event.is_archived
+               and event.latitude is not None and event.longitude is not None]
+    cities = get_city_rows() if located else []
+    rows = []
+    for event in located:
+        for city in cities:
+            distance = geo.distance_km(city.latitude, city.longitude, event.latitude, event.longitude)
+            ring = ring_of(distance)
+            if ring is not None:
+                rows.append(CityEvent(city_id=city.id, event_id=event.pk, ring=ring, distance_km=distance,
+                                      time_update=event.time_update))
+    CityEvent.objects.filter(event_id__in=[event.pk for event in events]).delete()
+    CityEvent.objects.bulk_create(rows, batch_size=CITY_FEED_BATCH_SIZE)
+
+
+@task(unique=True)
+def rebuild_city_events(city_id, batch_size=CITY_FEED_BATCH_SIZE):
+    """Fill CityEvent rows of city from now_event_geohash_idx, return number of rows"""
+    city = City.objects.filter(pk=city_id).first()
+    CityEvent.objects.filter(city_id=city_id).delete()
+    if city is None:
+        return 0
+    rows = (nearby_events(city.latitude, city.longitude).order_by()
+            .values_list('pk', 'ring', 'distance2', 'time_update').iterator(chunk_size=batch_size))
+    created = 0
+    while True:
+        batch = [CityEvent(city_id=city_id, event_id=event_id, ring=ring, distance_km=distance2 ** 0.5,
+                           time_update=time_update)
+                 for event_id, ring, distance2, time_update in islice(rows, batch_size)]
+        if not batch:
+            return created
+        CityEvent.objects.bulk_create(batch)
+        created += len(batch)
+
+
+def city_feed(city_id):
+    """Return published events of nearby feed of city, ordered by now_cityevent_feed_idx without sorting
+
+    Events are annotated with ring, feed_time and feed_event from the CityEvent row, the feed is
+    paginated by these annotations so the database walks the index of one city in order.
+    """
+    return (Event.objects.filter(cityevent__city_id=city_id)
+            .annotate(ring=F('cityevent__ring'), distance_km=F('cityevent__distance_km'),
+                      feed_time=F('cityevent__time_update'), feed_event=F('cityevent__event_id')))
+
+
+def in_window(queryset, when, now=None):
+    """Filter published events to window of EVENT_WINDOWS, empty window is the hot listing without archive"""
+    now = now or timezone.now()
+    if when == 'upcoming':
+        return queryset.filter(is_archived=False, starts_at__gt=now)
+    if when == 'ongoing':
+        return queryset.filter(is_archived=False, starts_at__lte=now, ends_at__gte=now)
+    if when == 'past':
+        # Archived events are still listed here, read from now_event_past_idx
+        return queryset.filter(ends_at__lt=now)
+    return queryset.filter(is_archived=False)
+
+
+def archive_events(before=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """Flag events which ended before given time as archived in batches, return number of events
+
+    Archived events leave the partial indexes of listings, nearby feeds and recommended feeds.
+    Every batch is one indexed SELECT of ids and one UPDATE, so the table is never locked for long.
+    """
+    before = before or timezone.now() - ARCHIVE_AFTER
+    archived = 0
+    while True:
+        with transaction.atomic():
+            # Read from now_event_ends_idx, archived rows leave it so every batch starts at its beginning
+            batch = list(Event.objects.filter(is_archived=False, ends_at__lt=before).order_by()
+                         .values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            Event.objects.filter(pk__in=batch).update(is_archived=True)
+            CityEvent.objects.filter(event_id__in=batch).delete()
+            UserEventScore.objects.filter(event_id__in=batch).delete()
+            WaitlistEntry.objects.filter(event_id__in=batch).delete()
+        archived += len(batch)
+    if archived:
+        # update() sends no post_save, cached listings are purged once
+        bump_version('events')
+        bump_version('categories')
+    return archived
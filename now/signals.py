@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from now.caching import bump_version
+from now.middleware import install_query_collector
+from now.models import Category, City, CustomUser, Event
+from now.recommendations import remove_event
+from now.search import index_events, remove_events
+from now.services import promote_waitlist, rebuild_city_events, update_city_events
+from now.thumbnails import schedule_thumbnails
+
+
+@receiver([post_save, post_delete], sender=Event)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_categories(sender, **kwargs):
+    """Category rows cache counts published events, so both models invalidate it"""
+    # Bumped after commit, a page rebuilt before it would cache old rows under the new version
+    transaction.on_commit(lambda: bump_version('categories'))
+
+
+@receiver([post_save, post_delete], sender=Event)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_events(sender, **kwargs):
+    """Event pages and cards show category name, so both models purge them"""
+    transaction.on_commit(lambda: bump_version('events'))
+
+
+@receiver([post_save, post_delete], sender=City)
+def invalidate_cities(sender, **kwargs):
+    transaction.on_commit(lambda: bump_version('cities'))
+
+
+@receiver(post_save, sender=City)
+def rebuild_city_feed(sender, instance, **kwargs):
+    """New or moved city gets its feed rows from the geohash index in background"""
+    rebuild_city_events.enqueue(instance.pk)
+
+
+@receiver(post_save, sender=Event)
+def update_city_feeds(sender, instance, **kwargs):
+    update_city_events([instance])
+
+
+@receiver(post_save, sender=Event)
+def update_recommended_feeds(sender, instance, **kwargs):
+    """Unpublished event leaves feeds at once, new events enter them with the next refresh of each user"""
+    if not instance.is_published or instance.is_archived:
+        remove_event(instance.pk)
+
+
+@receiver(post_save, sender=Event)
+def promote_waiting_users(sender, instance, created, update_fields=None, **kwargs):
+    """Spots added by raising capacity go to the waitlist at once"""
+    if created or (update_fields is not None and 'capacity' not in update_fields):
+        return
+    if instance.capacity_raised():
+        promote_waitlist(instance.pk)
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_save, sender=CustomUser)
+def create_thumbnails(sender, instance, update_fields=None, **kwargs):
+    """Photos are resized in background, templates use the original until thumbnails exist"""
+    # Saves which keep the photo do not touch the storage
+    if instance.photo_changed(update_fields):
+        schedule_thumbnails(instance.photo.name)
+
+
+@receiver(post_save, sender=Event)
+def update_search_index(sender, instance, **kwargs):
+    index_events([instance])
+
+
+@receiver(post_delete, sender=Event)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_events([instance.pk])
+
+
+@receiver(connection_created)
+def count_request_queries(sender, connection, **kwargs):
+    """Connections of sync_to_async threads count queries of ASGI requests too"""
+    install_query_collector(connection)
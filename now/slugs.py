@@ -0,0 +1,124 @@
+import re
+
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Length
+from slugify import slugify
+
+# Room left at the end of SlugField for '-<number>' suffix
+SUFFIX_LENGTH = 11
+# Concurrent saves may allocate the same slug, the loser allocates again
+SAVE_ATTEMPTS = 3
+
+
+def slug_base(text, max_length=255, default='item'):
+    """Return ASCII slug of text which fits max_length together with a suffix"""
+    # Transliterated slugs match the <slug:...> URL converter, Cyrillic ones do not
+    base = slugify(text or '', only_ascii=True)[:max_length - SUFFIX_LENGTH].strip('-')
+    return base or default
+
+
+def _suffix_range(field, base):
+    """Filter of base-<anything> as an indexed range: '-' sorts right before '.'"""
+    return models.Q(**{f'{field}__gt': f'{base}-', f'{field}__lt': f'{base}.'})
+
+
+def _suffix(slug, base):
+    match = re.fullmatch(rf'{re.escape(base)}-(\d+)', slug)
+    return int(match.group(1)) if match else None
+
+
+def allocate_slug(model, base, field='slug', exclude_pk=None):
+    """Return base or base-<n> not used by any row of model, with one indexed range query
+
+    n is one more than the largest suffix in use, gaps left by deleted rows are not reused.
+    """
+    numbered = _suffix_range(field, base) & models.Q(**{f'{field}__regex': rf'^{re.escape(base)}-[0-9]+$'})
+    queryset = model._base_manager.filter(models.Q(**{field: base}) | numbered)
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    # base-10 sorts before base-9 as text, longest slug first puts the largest number on top
+    last = queryset.order_by(Length(field).desc(), f'-{field}').values_list(field, flat=True).first()
+    if last is None:
+        return base
+    return f'{base}-{(_suffix(last, base) or 1) + 1}'
+
+
+def allocate_slugs(model, bases, field='slug'):
+    """Return unique slugs for list of bases, in order, with one query for the whole list
+
+    Repeated bases in the list get consecutive suffixes, e.g. for imports of same-title rows.
+    """
+    distinct = sorted(set(bases))
+    if not distinct:
+        return []
+    lookup = models.Q(**{f'{field}__in': distinct})
+    for base in distinct:
+        lookup |= _suffix_range(field, base)
+    wanted = set(distinct)
+    last = {}
+    for slug in model._base_manager.filter(lookup).order_by().values_list(field, flat=True).iterator():
+        if slug in wanted:
+            last[slug] = max(last.get(slug, 0), 1)
+        base, _, number = slug.rpartition('-')
+        if base in wanted and number.isdigit():
+            last[base] = max(last.get(base, 0), int(number))
+    slugs = []
+    for base in bases:
+        number = last.get(base, 0) + 1
+        last[base] = number
+        slugs.append(base if number == 1 else f'{base}-{number}')
+    return slugs
+
+
+class SlugMixin(models.Model):
+    """class SlugMixin keep slug unique and regenerate it only when its source field changes.
+
+    Models set slug_source to the name of the field the slug is made from.
+    """
+
+    slug_source = None
+    slug_default = 'item'
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Deferred source field is not read here, it can not have changed either
+        instance._slug_source_value = instance.__dict__.get(cls.slug_source)
+        return instance
+
+    def _slug_is_stale(self, update_fields):
+        if not self.slug or self._state.adding:
+            return True
+        if update_fields is not None and self.slug_source not in update_fields:
+            return False
+        if self.slug_source not in self.__dict__:
+            return False
+        return self.__dict__[self.slug_source] != getattr(self, '_slug_source_value', None)
+
+    def save(self, *args, **kwargs):
+        """Method save allocate slug from source field when the source has changed"""
+        update_fields = kwargs.get('update_fields')
+        if not self._slug_is_stale(update_fields):
+            return super().save(*args, **kwargs)
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'slug'}
+        max_length = self._meta.get_field('slug').max_length
+        base = slug_base(getattr(self, self.slug_source), max_length, self.slug_default)
+        if self.slug and not self._state.adding and (self.slug == base or _suffix(self.slug, base)):
+            # Source changed but gives the same slug, e.g. only letter case differs
+            self._slug_source_value = getattr(self, self.slug_source)
+            return super().save(*args, **kwargs)
+        for attempt in range(SAVE_ATTEMPTS):
+            self.slug = allocate_slug(type(self), base, exclude_pk=self.pk)
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                break
+            except IntegrityError:
+                # Another row took the slug between allocation and insert, any other error is raised
+                if attempt == SAVE_ATTEMPTS - 1 or not type(self)._base_manager.filter(slug=self.slug).exists():
+                    raise
+        self._slug_source_value = getattr(self, self.slug_source)
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from now.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed job stays invisible to other workers, longer running tasks are run twice
+VISIBILITY_TIMEOUT = 5 * 60
+# Seconds before the first retry of a failed job, doubled on every next attempt
+RETRY_DELAY = 10
+MAX_ATTEMPTS = 3
+
+# Task name: Task, filled by the @task decorator when modules with tasks are imported
+TASKS = {}
+
+
+class Task:
+    """class Task wrap function which runs in a worker process, enqueue() stores a call of it as Job row."""
+
+    def __init__(self, func, name, max_attempts, retry_delay, unique):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.unique = unique
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, **kwargs):
+        """Store call with JSON arguments, it is visible to workers once current transaction commits"""
+        return enqueue(self.name, *args, **kwargs)
+
+
+def task(func=None, *, name=None, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY, unique=False):
+    """Register function as task, unique tasks are queued once per arguments until they run"""
+    def register(func):
+        registered = Task(func, name or f'{func.__module__}.{func.__qualname__}', max_attempts, retry_delay, unique)
+        TASKS[registered.name] = registered
+        return registered
+
+    return register(func) if func is not None else register
+
+
+def enqueue(name, *args, **kwargs):
+    """Insert Job row for task name with one INSERT, duplicate of a pending unique job is ignored"""
+    registered = TASKS[name]
+    payload = {'args': list(args), 'kwargs': kwargs}
+    unique_key = None
+    if registered.unique:
+        serialized = json.dumps([name, payload], sort_keys=True, ensure_ascii=False)
+        unique_key = hashlib.md5(serialized.encode()).hexdigest()
+    # ignore_conflicts skips the row instead of failing on now_job_pending_key_uniq, no lookup needed
+    Job.objects.bulk_create([Job(name=name, payload=payload, unique_key=unique_key,
+                                 max_attempts=registered.max_attempts)], ignore_conflicts=registered.unique)
+
+
+def _claimable(now):
+    """Due queued jobs and running jobs whose worker did not finish them in time"""
+    return ((Q(status=Job.QUEUED, run_at__lte=now) | Q(status=Job.RUNNING, locked_until__lt=now))
+            & Q(attempts__lt=F('max_attempts')))
+
+
+class Worker:
+    """class Worker claim due jobs with a conditional UPDATE and run them in a thread pool.
+
+    Any number of workers may share the table: a job is claimed by whichever UPDATE changes
+    its row first, the others do not see it until its visibility timeout expires.
+    """
+
+    def __init__(self, threads=4, visibility_timeout=VISIBILITY_TIMEOUT):
+        self.threads = threads
+        self.visibility_timeout = visibility_timeout
+        self.name = f'{socket.gethostname()}:{os.getpid()}'[:50]
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def claim(self, limit):
+        """Lock at most limit due jobs for this worker and return them"""
+        now = timezone.now()
+        self._expire(now)
+        candidates = list(Job.objects.filter(_claimable(now)).order_by('run_at', 'id')
+                          .values_list('pk', flat=True)[:limit])
+        if not candidates:
+            return []
+        # Token of this claim, the same job claimed again after a timeout gets another one
+        token = f'{self.name}:{uuid.uuid4().hex[:12]}'
+        Job.objects.filter(_claimable(now), pk__in=candidates).update(
+            status=Job.RUNNING, locked_by=token, attempts=F('attempts') + 1,
+            locked_until=now + timedelta(seconds=self.visibility_timeout))
+        return list(Job.objects.filter(locked_by=token))
+
+    @staticmethod
+    def _expire(now):
+        """Fail running jobs which used every attempt and still timed out"""
+        Job.objects.filter(status=Job.RUNNING, locked_until__lt=now, attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED, last_error='Visibility timeout expired on the last attempt')
+
+    def execute(self, job):
+        """Run claimed job, delete it on success and schedule retry or fail it on error"""
+        mine = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+        registered = TASKS.get(job.name)
+        try:
+            if registered is None:
+                raise LookupError(f'Task {job.name} is not registered in this worker')
+            registered(*job.payload.get('args', ()), **job.payload.get('kwargs', {}))
+        except Exception:
+            logger.exception('Job %s failed on attempt %d of %d', job, job.attempts, job.max_attempts)
+            retry_delay = registered.retry_delay if registered else RETRY_DELAY
+            if registered is not None and job.attempts < job.max_attempts:
+                mine.update(status=Job.QUEUED, locked_by='', locked_until=None, last_error=traceback.format_exc(),
+                            run_at=timezone.now() + timedelta(seconds=retry_delay * 2 ** (job.attempts - 1)))
+            else:
+                mine.update(status=Job.FAILED, locked_until=None, last_error=traceback.format_exc())
+            with self._lock:
+                self.failed += 1
+            return False
+        mine.delete()
+        with self._lock:
+            self.processed += 1
+        return True
+
+    def _execute_in_thread(self, job):
+        # Pool threads keep their own connections, close them like request handlers do
+        close_old_connections()
+        try:
+            return self.execute(job)
+        finally:
+            close_old_connections()
+
+    def run_pending(self, limit=None):
+        """Run due jobs in the current thread until none is left, return number of jobs run"""
+        ran = 0
+        while limit is None or ran < limit:
+            jobs = self.claim(1)
+            if not jobs:
+                break
+            self.execute(jobs[0])
+            ran += 1
+        return ran
+
+    def run(self, stop, poll_interval=1.0, once=False):
+        """Claim jobs for free pool threads until stop is set or, with once, the queue is drained"""
+        running = set()
+        with ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='now-worker') as executor:
+            while not stop.is_set():
+                running = {future for future in running if not future.done()}
+                free = self.threads - len(running)
+                jobs = self.claim(free) if free else []
+                for job in jobs:
+                    running.add(executor.submit(self._execute_in_thread, job))
+                if once and not jobs and not running:
+                    break
+                if not jobs:
+                    stop.wait(poll_interval)
+            # Leaving the with block waits for jobs already started
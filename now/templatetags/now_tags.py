@@ -0,0 +1,28 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from now.thumbnails import thumbnail_name, thumbnails_ready
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail_url(photo, size='card', fmt='webp'):
+    """Return URL of photo thumbnail or of the original photo while thumbnail is pending"""
+    if not photo:
+        return ''
+    if thumbnails_ready(photo.name):
+        return default_storage.url(thumbnail_name(photo.name, size, fmt))
+    return photo.url
+
+
+@register.simple_tag(takes_context=True)
+def url_replace(context, **kwargs):
+    """Return query string of current request with given parameters replaced, empty values remove parameter"""
+    query = context['request'].GET.copy()
+    for key, value in kwargs.items():
+        if value in (None, ''):
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return '?' + query.urlencode()
@@ -1,3 +1,1424 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.db import connection, connections, router
+from django.db.models import QuerySet
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings, \
+    skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+
+from now import api
+from now.caching import get_category_rows, get_or_build, get_version
+from now.fake_redis import FakeRedisServer
+from now.metrics import registry
+from now.middleware import get_query_budget
+from now import geo
+from now.benchmarks.capacity import stress
+from now.models import Category, City, CityEvent, CustomUser, Event, Job, UserEventScore, UserJoinEvent, \
+    WaitlistEntry
+from now.pagination import CursorPaginator, InvalidCursor
+from now.recommendations import score_user
+from now.routers import STICKY_COOKIE, end_request, read_from_replica, start_request
+from now.search import normalize, search_events, stem
+from now.services import JOINED, WAITLISTED, archive_events, find_city, has_joined, join_event, joined_event_ids, \
+    leave_event, nearby_events, request_spot
+from now.slugs import allocate_slug, allocate_slugs
+from now.tasks import Worker, task
+from now.thumbnails import THUMBNAIL_ROOT, generate_thumbnails, thumbnail_name, thumbnails_exist
+from now.transfer import import_records
+from now.utils import stream_json
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class NowTestCase(TestCase):
+    """class NowTestCase runs every test with an empty in-memory cache."""
+
+    @classmethod
+    def setUpClass(cls):
+        # Worker runs thumbnail jobs of the default photos, thumbnails go to a copy of MEDIA_ROOT
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root)
+        shutil.copytree(settings.MEDIA_ROOT, media_root, dirs_exist_ok=True,
+                        ignore=shutil.ignore_patterns(THUMBNAIL_ROOT))
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+
+    def assertQueryBudget(self, url, data=None, method='GET', **extra):
+        """Request url and fail when its view runs more queries than NOW_QUERY_BUDGETS allows for method"""
+        view = resolve(url).url_name
+        budget = get_query_budget(view, method)
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method.lower())(url, data, **extra)
+        self.assertLessEqual(len(queries), budget, '{} ran {} queries, budget is {}:\n{}'.format(
+            view, len(queries), budget, '\n'.join(query['sql'] for query in queries)))
+        return response
+
+
+# Calls of test tasks, the worker runs them in the test thread
+task_calls = []
+
+
+@task(max_attempts=2, retry_delay=60)
+def record_call(value, fail=False):
+    task_calls.append(value)
+    if fail:
+        raise ValueError(value)
+
+
+def create_events(count, category=None, user=None, **kwargs):
+    """Create count published events with unique titles"""
+    category = category or Category.objects.create(category_name='Спорт', slug='sport')
+    user = user or CustomUser.objects.create_user(username='organizer', password='password')
+    return [Event.objects.create(title=f'event {number}', content='content', category=category,
+                                 user=user, **kwargs)
+            for number in range(count)]
+
+
+class CursorPaginatorTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(7)
+
+    def test_walks_forward_and_back(self):
+        paginator = CursorPaginator(Event.objects.all(), 3, ('-id',))
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+        ids = [e.id for e in reversed(self.events)]
+        self.assertEqual([e.id for e in first], ids[:3])
+        self.assertEqual([e.id for e in second], ids[3:6])
+        self.assertEqual([e.id for e in third], ids[6:])
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+        self.assertEqual([e.id for e in paginator.page(third.previous_cursor)], ids[3:6])
+        self.assertEqual([e.id for e in paginator.page(second.previous_cursor)], ids[:3])
+
+    def test_multi_field_ordering(self):
+        paginator = CursorPaginator(Event.objects.all(), 2, ('title', '-id'))
+        seen, cursor = [], None
+        while True:
+            page = paginator.page(cursor)
+            seen.extend(e.id for e in page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, list(Event.objects.order_by('title', '-id').values_list('id', flat=True)))
+
+    def test_page_query_does_not_count(self):
+        paginator = CursorPaginator(Event.objects.all(), 3, ('id',))
+        with self.assertNumQueries(1):
+            paginator.page()
+        self.assertIsNone(paginator.count)
+
+    def test_invalid_cursor(self):
+        paginator = CursorPaginator(Event.objects.all(), 3, ('id',))
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+
+    def test_events_view(self):
+        response = self.client.get(reverse('events'))
+        self.assertEqual(response.status_code, 200)
+        next_cursor = response.context['page_obj'].next_cursor
+        response = self.client.get(reverse('events'), {'cursor': next_cursor})
+        self.assertEqual(len(response.context['events']), 3)
+        self.assertEqual(self.client.get(reverse('events'), {'cursor': '!!'}).status_code, 404)
+
+
+class AttendeeCountTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(4)
+        cls.user = CustomUser.objects.create_user(username='guest', password='password')
+
+    def test_join_and_leave_update_counter(self):
+        event = self.events[0]
+        self.client.force_login(self.user)
+        self.client.get(reverse('user_join', args=[event.slug]))
+        self.client.get(reverse('user_join', args=[event.slug]))
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 1)
+        self.client.get(reverse('user_out', args=[event.slug]))
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 0)
+
+    def test_rebuild_command_fixes_drift(self):
+        UserJoinEvent.objects.create(event=self.events[1], user=self.user)
+        Event.objects.filter(pk=self.events[2].pk).update(attendee_count=5)
+        out = StringIO()
+        call_command('rebuild_attendee_counts', '--dry-run', stdout=out)
+        self.assertIn('found 2 drifted events, total drift 6', out.getvalue())
+        call_command('rebuild_attendee_counts', batch_size=2, stdout=StringIO())
+        counts = dict(Event.objects.values_list('pk', 'attendee_count'))
+        self.assertEqual(counts[self.events[1].pk], 1)
+        self.assertEqual(counts[self.events[2].pk], 0)
+
+    def test_list_pages_do_not_query_per_event(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('events'))
+        # session, user, events page, memberships of the page
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('events'))
+        self.assertContains(response, 'участников: 0')
+
+
+class JoinServiceTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event, = create_events(1)
+        cls.users = [CustomUser.objects.create_user(username=f'guest{number}', password='password')
+                     for number in range(3)]
+
+    def test_join_is_one_statement_and_idempotent(self):
+        with self.assertNumQueries(5):
+            # savepoint, INSERT, counter UPDATE, INSERT of feed refresh job, release savepoint
+            self.assertTrue(join_event(self.event.pk, self.users[0].pk))
+        self.assertFalse(join_event(self.event.pk, self.users[0].pk))
+        self.assertEqual(UserJoinEvent.objects.filter(event=self.event).count(), 1)
+
+    def test_leave_only_removes_own_membership(self):
+        for user in self.users:
+            join_event(self.event.pk, user.pk)
+        self.assertTrue(leave_event(self.event.pk, self.users[1].pk))
+        self.assertFalse(leave_event(self.event.pk, self.users[1].pk))
+        self.assertEqual(set(UserJoinEvent.objects.values_list('user_id', flat=True)),
+                         {self.users[0].pk, self.users[2].pk})
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.attendee_count, 2)
+
+    def test_views_require_login(self):
+        response = self.client.get(reverse('user_join', args=[self.event.slug]))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('user_join', args=[self.event.slug])}")
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(reverse('user_join', args=['missing'])).status_code, 404)
+
+    def test_delete_event_with_members(self):
+        join_event(self.event.pk, self.users[0].pk)
+        self.client.force_login(self.event.user)
+        self.client.post(reverse('delete_event', args=[self.event.slug]))
+        self.assertFalse(Event.objects.filter(pk=self.event.pk).exists())
+
+
+class CapacityTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event, = create_events(1, capacity=2)
+        cls.users = [CustomUser.objects.create_user(username=f'guest{number}', password='password')
+                     for number in range(4)]
+
+    def setUp(self):
+        super().setUp()
+        self.statuses = [request_spot(self.event.pk, user.pk) for user in self.users]
+
+    def members(self):
+        return set(UserJoinEvent.objects.filter(event=self.event).values_list('user_id', flat=True))
+
+    def waiting(self):
+        return list(WaitlistEntry.objects.filter(event=self.event).order_by('pk').values_list('user_id', flat=True))
+
+    def test_joins_stop_at_capacity_and_queue_the_rest(self):
+        self.assertEqual(self.statuses, [JOINED, JOINED, WAITLISTED, WAITLISTED])
+        self.assertIsNone(request_spot(self.event.pk, self.users[0].pk))
+        self.assertIsNone(request_spot(self.event.pk, self.users[2].pk))
+        self.assertFalse(join_event(self.event.pk, self.users[3].pk))
+        self.assertEqual(self.waiting(), [self.users[2].pk, self.users[3].pk])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.attendee_count, 2)
+
+    def test_leave_passes_spot_to_head_of_waitlist(self):
+        self.assertTrue(leave_event(self.event.pk, self.users[0].pk))
+        self.assertEqual(self.members(), {self.users[1].pk, self.users[2].pk})
+        self.assertEqual(self.waiting(), [self.users[3].pk])
+        # Waiting user leaves the waitlist only
+        self.assertTrue(leave_event(self.event.pk, self.users[3].pk))
+        self.assertFalse(leave_event(self.event.pk, self.users[3].pk))
+        self.assertEqual(self.waiting(), [])
+        self.assertTrue(leave_event(self.event.pk, self.users[1].pk))
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.attendee_count, 1)
+        self.assertEqual(self.members(), {self.users[2].pk})
+
+    def test_leave_over_lowered_capacity_keeps_waitlist(self):
+        Event.objects.filter(pk=self.event.pk).update(capacity=1)
+        self.assertTrue(leave_event(self.event.pk, self.users[0].pk))
+        self.assertEqual(self.members(), {self.users[1].pk})
+        self.assertEqual(self.waiting(), [self.users[2].pk, self.users[3].pk])
+        # Back under capacity, the next leave passes its spot on
+        self.assertTrue(leave_event(self.event.pk, self.users[1].pk))
+        self.assertEqual(self.members(), {self.users[2].pk})
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.attendee_count, 1)
+
+    def test_raised_capacity_promotes_waiting_users(self):
+        event = Event.objects.get(pk=self.event.pk)
+        event.content = 'changed'
+        event.save()
+        self.assertEqual(len(self.waiting()), 2)
+        event.capacity = 3
+        event.save()
+        self.assertEqual(self.members(), {user.pk for user in self.users[:3]})
+        event.capacity = None
+        event.save()
+        self.assertEqual(self.waiting(), [])
+        event.refresh_from_db()
+        self.assertEqual(event.attendee_count, 4)
+
+    def test_event_page_shows_waitlist(self):
+        self.client.force_login(self.users[3])
+        response = self.client.get(self.event.get_absolute_url())
+        self.assertContains(response, 'участников: 2 / 2')
+        self.assertContains(response, 'покинуть лист ожидания')
+        self.client.get(reverse('user_out', args=[self.event.slug]))
+        self.assertContains(self.client.get(self.event.get_absolute_url()), 'в лист ожидания')
+        self.client.get(reverse('user_join', args=[self.event.slug]))
+        self.assertEqual(self.waiting(), [self.users[2].pk, self.users[3].pk])
+
+    def test_admin_goes_through_join_and_leave(self):
+        admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin)
+        add_url = reverse('admin:now_userjoinevent_add')
+        response = self.client.post(add_url, {'event': self.event.pk, 'user': self.users[3].pk})
+        self.assertContains(response, 'нет свободных мест')
+        membership = UserJoinEvent.objects.get(event=self.event, user=self.users[0])
+        self.client.post(reverse('admin:now_userjoinevent_delete', args=[membership.pk]), {'post': 'yes'})
+        # Freed spot goes to the head of the waitlist
+        self.assertEqual(self.members(), {self.users[1].pk, self.users[2].pk})
+        Event.objects.filter(pk=self.event.pk).update(capacity=3)
+        response = self.client.post(add_url, {'event': self.event.pk, 'user': self.users[3].pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.members(), {user.pk for user in self.users[1:]})
+        self.assertEqual(self.waiting(), [])
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.attendee_count, 3)
+
+    def test_admin_reports_failed_join(self):
+        admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com', password='password')
+        self.client.force_login(admin)
+        other, = create_events(1, category=self.event.category, user=self.event.user)
+        membership = UserJoinEvent.objects.get(event=self.event, user=self.users[0])
+        change_url = reverse('admin:now_userjoinevent_change', args=[membership.pk])
+        # Filled up between the form validation and the join
+        with mock.patch('now.admin.join_event', return_value=False):
+            response = self.client.post(change_url, {'event': other.pk, 'user': self.users[0].pk}, follow=True)
+        self.assertRedirects(response, change_url)
+        self.assertContains(response, 'Пользователь не добавлен в событие')
+        # Leave of the move is rolled back with the failed join
+        self.assertEqual(self.members(), {self.users[0].pk, self.users[1].pk})
+        self.assertEqual(self.waiting(), [self.users[2].pk, self.users[3].pk])
+
+    def test_waitlist_paths_stay_within_query_budgets(self):
+        # Join of a full event queues the user, leave of an attendee promotes the head of the queue
+        self.client.force_login(self.users[3])
+        self.client.get(reverse('user_out', args=[self.event.slug]))
+        self.assertQueryBudget(reverse('user_join', args=[self.event.slug]))
+        self.assertEqual(self.waiting(), [self.users[2].pk, self.users[3].pk])
+        self.client.force_login(self.users[0])
+        self.assertQueryBudget(reverse('user_out', args=[self.event.slug]))
+        self.assertEqual(self.members(), {self.users[1].pk, self.users[2].pk})
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class CapacityConcurrencyTest(TransactionTestCase):
+    """class CapacityConcurrencyTest joins from many threads, each with its own connection.
+
+    SQLite test databases live in shared-cache memory, where concurrent writers fail instead of waiting;
+    there `manage.py bench capacity` runs the same rush on a database file.
+    """
+
+    # Cities of migration 0006 are restored after the flush
+    serialized_rollback = True
+
+    def test_rush_does_not_overbook(self):
+        event, = create_events(1, capacity=10)
+        users = [CustomUser.objects.create(username=f'guest{number}', slug=f'guest{number}') for number in range(60)]
+        report = stress(event.pk, [user.pk for user in users], threads=8, leaves=5)
+        self.assertEqual(report['joins']['joined'], 10)
+        self.assertEqual(report['joins']['waitlisted'], 50)
+        self.assertTrue(report['after_joins']['consistent'])
+        self.assertTrue(report['after_leaves']['consistent'])
+        self.assertEqual(report['after_leaves']['members'], 10)
+        self.assertEqual(report['after_leaves']['waiting'], 45)
+
+
+class MembershipLookupTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(5)
+        cls.user = CustomUser.objects.create_user(username='guest', password='password')
+        cls.other = CustomUser.objects.create_user(username='other', password='password')
+        join_event(cls.events[4].pk, cls.user.pk)
+        join_event(cls.events[3].pk, cls.other.pk)
+
+    def test_lookups_are_scoped_to_user(self):
+        ids = [event.pk for event in self.events]
+        with self.assertNumQueries(1):
+            self.assertEqual(joined_event_ids(self.user, ids), {self.events[4].pk})
+        self.assertTrue(has_joined(self.user, self.events[4].pk))
+        self.assertFalse(has_joined(self.user, self.events[3].pk))
+
+    def test_event_page_shows_state_of_current_user(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('event', args=[self.events[3].slug]))
+        self.assertFalse(response.context['user_joined'])
+        response = self.client.get(reverse('event', args=[self.events[4].slug]))
+        self.assertTrue(response.context['user_joined'])
+        self.assertContains(response, reverse('user_out', args=[self.events[4].slug]))
+
+    def test_list_page_uses_one_membership_query(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('events'))
+        # session, user, events page, memberships of the page
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('events'))
+        self.assertEqual(response.context['joined_event_ids'], {self.events[4].pk})
+
+
+class CategoryCacheTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(2)
+        cls.category = cls.events[0].category
+
+    def test_rows_are_cached_until_event_changes(self):
+        self.assertEqual(get_category_rows()[0].event_count, 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_category_rows()[0].event_count, 2)
+        self.events[1].is_published = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.events[1].save()
+        self.assertEqual(get_category_rows()[0].event_count, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(category_name='Музыка', slug='music')
+        self.assertEqual([row.slug for row in get_category_rows()], ['sport', 'music'])
+
+    def test_single_flight_serves_stale_copy(self):
+        calls = []
+        get_or_build('test', 'value', lambda: calls.append(1) or 'old', 60)
+        cache.incr('now:version:test')
+        # Another client holds the regeneration lock of the new version
+        cache.add(f"now:test:value:v{get_version('test')}:lock", 1)
+        self.assertEqual(get_or_build('test', 'value', lambda: calls.append(1) or 'new', 60), 'old')
+        self.assertEqual(len(calls), 1)
+
+    def test_categories_view(self):
+        response = self.client.get(reverse('categories'))
+        self.assertContains(response, self.category.get_absolute_url())
+
+
+class CacheBackendTest(NowTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeRedisServer().start()
+        cls.redis = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': cls.server.url}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def test_redis_backend_on_fake_server(self):
+        with self.settings(CACHES={'default': self.redis}):
+            cache.set('key', {'a': 1})
+            self.assertEqual(cache.get('key'), {'a': 1})
+            self.assertFalse(cache.add('key', 2))
+            cache.set('counter', 1)
+            self.assertEqual(cache.incr('counter', 5), 6)
+            cache.set_many({'x': 1, 'y': 2}, 30)
+            self.assertEqual(cache.get_many(['x', 'y', 'z']), {'x': 1, 'y': 2})
+            cache.delete('x')
+            self.assertIsNone(cache.get('x'))
+
+    def test_tiered_backend(self):
+        tiered = {'default': {'BACKEND': 'now.cache_backends.TieredCache', 'LOCATION': 'shared'},
+                  'shared': self.redis}
+        with self.settings(CACHES=tiered):
+            cache.clear()
+            cache.set('key', 'value')
+            caches['shared'].set('key', 'changed')
+            # Local tier serves the value until LOCAL_TIMEOUT, version keys always read the shared tier
+            self.assertEqual(cache.get('key'), 'value')
+            version = get_version('categories')
+            caches['shared'].incr('now:version:categories')
+            self.assertEqual(get_version('categories'), version + 1)
+            self.assertTrue(cache.add('lock', 1))
+            self.assertFalse(cache.add('lock', 1))
+
+
+class PageCacheTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(3)
+
+    def test_anonymous_pages_are_cached_until_event_changes(self):
+        url = reverse('event', args=[self.events[0].slug])
+        self.client.get(url)
+        # Only the validators row, page comes from cache
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(url), 'event 0')
+        self.events[0].content = 'новое описание'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.events[0].save()
+        self.assertContains(self.client.get(url), 'новое описание')
+
+    def test_versions_are_bumped_after_commit(self):
+        version = get_version('events')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.events[0].save()
+            # Readers of the old rows must not cache them under a new version
+            self.assertEqual(get_version('events'), version)
+        self.assertTrue(callbacks)
+        self.assertEqual(get_version('events'), version + 1)
+
+    def test_authenticated_users_get_personal_header(self):
+        self.client.get(reverse('events'))
+        self.client.force_login(self.events[0].user)
+        response = self.client.get(reverse('events'))
+        self.assertContains(response, reverse('logout'))
+
+    def test_cards_are_cached_fragments(self):
+        self.client.force_login(self.events[0].user)
+        self.client.get(reverse('events'))
+        # Changing a row without save() does not purge the cached card
+        Event.objects.filter(pk=self.events[2].pk).update(content='тихое изменение')
+        self.assertNotContains(self.client.get(reverse('events')), 'тихое изменение')
+
+    def test_cards_follow_renamed_organizer(self):
+        self.client.force_login(self.events[0].user)
+        for url in (reverse('events'), reverse('category', args=['sport'])):
+            self.client.get(url)
+        organizer = CustomUser.objects.get(pk=self.events[0].user_id)
+        organizer.username = 'renamed'
+        organizer.save()
+        for url in (reverse('events'), reverse('category', args=['sport'])):
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), '>renamed</a>')
+
+
+class ConditionalGetTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(3)
+
+    def test_not_modified_before_rendering(self):
+        url = reverse('event', args=[self.events[0].slug])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        # Only the validators row, no page cache lookup and no rendering
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        join_event(self.events[0].pk, self.events[1].user.pk)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_listing_validators_follow_events_version(self):
+        response = self.client.get(reverse('events'))
+        # Newest time_update goes back when the newest event is deleted, listings send no Last-Modified
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(reverse('events'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.events[2].save()
+        self.assertEqual(self.client.get(reverse('events'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(reverse('events'))['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.events[2].delete()
+        self.assertEqual(self.client.get(reverse('events'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_differs_per_user(self):
+        url = reverse('category', args=['sport'])
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(self.events[0].user)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ThumbnailTest(NowTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def save_photo(self, name):
+        from PIL import Image
+
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'orange').save(buffer, 'PNG')
+        return default_storage.save(name, SimpleUploadedFile(name, buffer.getvalue()))
+
+    def test_generates_fixed_size_thumbnails(self):
+        from PIL import Image
+
+        name = self.save_photo('photos/event.png')
+        generate_thumbnails(name)
+        with default_storage.open(thumbnail_name(name, 'card', 'webp')) as file:
+            self.assertEqual(Image.open(file).size, (225, 225))
+        with default_storage.open(thumbnail_name(name, 'card2x', 'jpeg')) as file:
+            self.assertEqual(Image.open(file).size, (450, 450))
+
+    def test_tag_falls_back_to_original_while_pending(self):
+        event, = create_events(1)
+        event.photo = self.save_photo('photos/pending.png')
+        template = Template("{% load now_tags %}{% thumbnail_url event.photo 'card' %}")
+        self.assertEqual(template.render(Context({'event': event})), event.photo.url)
+        generate_thumbnails(event.photo.name)
+        # Readiness is cached by the job, rendering does not check storage
+        with mock.patch('now.thumbnails.thumbnails_exist') as exists:
+            self.assertEqual(template.render(Context({'event': event})),
+                             default_storage.url(thumbnail_name(event.photo.name, 'card', 'webp')))
+        exists.assert_not_called()
+
+    def test_saved_photo_is_queued_for_worker_once(self):
+        event, = create_events(1)
+        Job.objects.all().delete()
+        event.photo = self.save_photo('photos/queued.png')
+        event.save()
+        event.save()
+        self.assertEqual(Job.objects.get().payload, {'args': [event.photo.name], 'kwargs': {}})
+        self.assertEqual(Worker().run_pending(), 1)
+        self.assertTrue(thumbnails_exist(event.photo.name))
+        event.save()
+        self.assertFalse(Job.objects.exists())
+
+    def test_saves_keeping_photo_do_not_touch_storage(self):
+        event, = create_events(1)
+        event = Event.objects.get(pk=event.pk)
+        user = CustomUser.objects.get(pk=event.user_id)
+        with mock.patch('now.thumbnails.thumbnails_exist') as exists:
+            event.title = 'Новое название'
+            event.save()
+            event.save(update_fields=['content'])
+            user.bio = 'Организатор'
+            user.save()
+        exists.assert_not_called()
+        event.photo = self.save_photo('photos/changed.png')
+        event.save(update_fields=['photo'])
+        self.assertEqual(Job.objects.filter(payload__args=[event.photo.name]).count(), 1)
+
+
+class SearchTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(category_name='Спорт', slug='sport')
+        user = CustomUser.objects.create_user(username='organizer', password='password')
+        cls.match = Event.objects.create(title='Футбольный матч', content='Играем в парке', category=category,
+                                         user=user)
+        cls.mention = Event.objects.create(title='Пикник', content='После пикника футбольные игры',
+                                           category=category, user=user)
+        cls.hidden = Event.objects.create(title='Футбол', content='', category=category, user=user,
+                                          is_published=False)
+
+    def test_stemming(self):
+        self.assertEqual(stem('футбольный'), stem('футбольные'))
+        self.assertEqual(stem('выставки'), stem('выставка'))
+        self.assertEqual(normalize('Джаз-вечер, ЁЛКА!'), 'джаз вечер елк')
+
+    def test_stems_match_snowball_reference(self):
+        # Words and stems from voc.txt and output.txt of the Snowball Russian stemmer
+        reference = {'вавиловка': 'вавиловк', 'вагнера': 'вагнер', 'важнее': 'важн', 'важнейшие': 'важн',
+                     'важничаешь': 'важнича', 'важную': 'важн', 'валандался': 'валанда',
+                     'валериановых': 'валерианов', 'валерию': 'валер', 'валетами': 'валет', 'валился': 'вал',
+                     'вальдшнепа': 'вальдшнеп'}
+        self.assertEqual({word: stem(word) for word in reference}, reference)
+
+    def test_title_matches_rank_first(self):
+        results = search_events('футбольная')
+        self.assertEqual(results.count(), 2)
+        self.assertEqual(list(results[:10]), [self.match, self.mention])
+        self.assertEqual(search_events('').count(), 0)
+        self.assertEqual(search_events('"').count(), 0)
+
+    def test_events_deleted_after_ranking_are_skipped(self):
+        in_bulk = QuerySet.in_bulk
+        # Second event is deleted between the rank query and in_bulk()
+        with mock.patch.object(QuerySet, 'in_bulk', lambda queryset, ids: in_bulk(queryset, ids[:1])):
+            self.assertEqual(list(search_events('футбольная')[:10]), [self.match])
+
+    def test_index_follows_save_and_delete(self):
+        self.mention.title = 'Концерт'
+        self.mention.content = 'Джаз'
+        self.mention.save()
+        self.assertEqual(list(search_events('футбольный')[:10]), [self.match])
+        self.assertEqual(list(search_events('пикника')[:10]), [])
+        self.assertEqual(list(search_events('джаз')[:10]), [self.mention])
+        self.match.delete()
+        self.assertEqual(search_events('матч').count(), 0)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM now_event_search')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(search_events('парк').count(), 1)
+
+    def test_search_view(self):
+        response = self.client.get(reverse('search'), {'q': 'футбольный'})
+        self.assertEqual(list(response.context['events']), [self.match, self.mention])
+        self.assertContains(response, 'value="футбольный"')
+        self.assertEqual(self.client.get(reverse('search')).status_code, 200)
+
+
+class TransferTest(NowTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def export(self, kind, fmt):
+        path = f'{self.directory}/{kind}.{fmt}'
+        call_command('export_events', kind, format=fmt, output=path, stderr=StringIO())
+        return path
+
+    def test_round_trip(self):
+        for fmt in ('ndjson', 'csv'):
+            with self.subTest(fmt=fmt):
+                events = create_events(3)
+                user = CustomUser.objects.create_user(username='guest', password='password')
+                join_event(events[0].pk, user.pk)
+                paths = [self.export(kind, fmt) for kind in ('categories', 'events', 'joins')]
+                expected = list(Event.objects.order_by('slug').values_list('slug', 'title', 'time_create'))
+                UserJoinEvent.objects.all().delete()
+                Event.objects.all().delete()
+                Category.objects.all().delete()
+                for kind, path in zip(('categories', 'events', 'joins'), paths):
+                    call_command('import_events', kind, path, stdout=StringIO())
+                self.assertEqual(list(Event.objects.order_by('slug').values_list('slug', 'title', 'time_create')),
+                                 expected)
+                self.assertEqual(Event.objects.get(slug=events[0].slug).attendee_count, 1)
+                self.assertEqual(search_events('content').count(), 3)
+                out = StringIO()
+                call_command('import_events', 'events', paths[1], stdout=out)
+                self.assertIn('imported 0 events, skipped 3', out.getvalue())
+                UserJoinEvent.objects.all().delete()
+                Event.objects.all().delete()
+                CustomUser.objects.all().delete()
+                Category.objects.all().delete()
+
+    def test_slugs_are_computed_in_batch(self):
+        event, = create_events(1)
+        records = [{'title': event.title, 'content': 'content', 'category': 'sport', 'user': 'organizer'}
+                   for _ in range(5)]
+        # Batch of 5 records: category, user, existing slugs, slug allocation, insert, search index
+        with self.assertNumQueries(8):
+            created, skipped = import_records('events', records, batch_size=5)
+        self.assertEqual((created, skipped), (5, 0))
+        self.assertEqual(sorted(Event.objects.exclude(pk=event.pk).values_list('slug', flat=True)),
+                         [f'{event.slug}-{number}' for number in range(2, 7)])
+
+    def test_explicit_slugs_are_kept(self):
+        event, = create_events(1)
+        Event.objects.filter(pk=event.pk).update(slug='concert-2')
+        records = [{'title': 'Концерт', 'slug': 'concert', 'content': 'a', 'category': 'sport', 'user': 'organizer'},
+                   {'title': 'concert', 'content': 'b', 'category': 'sport', 'user': 'organizer'}]
+        self.assertEqual(import_records('events', records), (2, 0))
+        self.assertEqual(Event.objects.get(content='a').slug, 'concert')
+        self.assertEqual(Event.objects.get(content='b').slug, 'concert-3')
+        self.assertEqual(import_records('events', records[:1]), (0, 1))
+        self.assertFalse(Event.objects.filter(slug='concert-4').exists())
+
+    def test_unknown_references_are_skipped(self):
+        create_events(1)
+        records = [{'title': 'a', 'content': 'b', 'category': 'missing', 'user': 'organizer'},
+                   {'title': 'c', 'content': 'd', 'category': 'sport', 'user': 'nobody'}]
+        self.assertEqual(import_records('events', records), (0, 2))
+
+    def test_invalid_records_are_reported_by_line(self):
+        create_events(1)
+        path = f'{self.directory}/events.ndjson'
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write('{"title": "a", "category": "sport", "user": "organizer"}\n'
+                       '{"content": "без названия", "category": "sport", "user": "organizer"}\n'
+                       '\n'
+                       '{"title": "b", "starts_at": "завтра", "category": "sport", "user": "organizer"}\n'
+                       'not json\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_events', 'events', path, stdout=out, stderr=err)
+        self.assertIn('imported 1 events, skipped 3', out.getvalue())
+        self.assertEqual([line.split(':')[0] for line in err.getvalue().splitlines()], ['line 2', 'line 4', 'line 5'])
+
+    def test_joins_recount_only_their_events(self):
+        events = create_events(2)
+        user = CustomUser.objects.create_user(username='guest', password='password')
+        Event.objects.filter(pk=events[1].pk).update(attendee_count=5)
+        self.assertEqual(import_records('joins', [{'event': events[0].slug, 'user': 'guest'}]), (1, 0))
+        self.assertEqual(list(Event.objects.order_by('pk').values_list('attendee_count', flat=True)), [1, 5])
+        self.assertTrue(UserJoinEvent.objects.filter(event=events[0], user=user).exists())
+
+
+class SlugTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(category_name='Спорт', slug='sport')
+        cls.user = CustomUser.objects.create_user(username='Организатор', password='password')
+
+    def create(self, title):
+        return Event.objects.create(title=title, content='content', category=self.category, user=self.user)
+
+    def test_same_title_events_get_suffixes(self):
+        first, second, third = (self.create('Футбольный матч') for _ in range(3))
+        self.assertEqual([first.slug, second.slug, third.slug],
+                         ['futbolnyi-match', 'futbolnyi-match-2', 'futbolnyi-match-3'])
+        self.assertEqual(self.user.slug, 'organizator')
+        self.assertEqual(self.client.get(second.get_absolute_url()).status_code, 200)
+
+    def test_thousands_of_same_title_events(self):
+        slugs = allocate_slugs(Event, ['match'] * 3000)
+        self.assertEqual(len(set(slugs)), 3000)
+        Event.objects.bulk_create(Event(title='Match', slug=slug, content='content', category=self.category,
+                                        user=self.user) for slug in slugs)
+        # One indexed range query however many rows share the prefix
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_slug(Event, 'match'), 'match-3001')
+        with self.assertNumQueries(1):
+            self.assertEqual(allocate_slugs(Event, ['match', 'other', 'match']), ['match-3001', 'other', 'match-3002'])
+        self.assertEqual(self.create('Match').slug, 'match-3001')
+
+    def test_unrelated_update_keeps_slug_without_lookup(self):
+        event = Event.objects.get(pk=self.create('Лекция').pk)
+        event.content = 'changed'
+        with CaptureQueriesContext(connection) as queries:
+            event.save()
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT')])
+        self.assertEqual(event.slug, 'lektsiia')
+        event.title = 'Лекция о джазе'
+        event.save()
+        self.assertEqual(Event.objects.get(pk=event.pk).slug, 'lektsiia-o-dzhaze')
+
+    def test_similar_prefixes_do_not_collide(self):
+        self.create('Match')
+        self.create('Match day')
+        self.create('Match 2')
+        self.assertEqual(allocate_slug(Event, 'match'), 'match-3')
+        self.assertEqual(allocate_slug(Event, 'match-day'), 'match-day-2')
+
+
+class AttendeeExportTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.event, = create_events(1)
+        cls.guests = [CustomUser.objects.create_user(username=f'guest{number}', email=f'guest{number}@example.com',
+                                                     password='password')
+                      for number in range(5)]
+        for guest in cls.guests:
+            join_event(cls.event.pk, guest.pk)
+
+    def test_organizer_gets_streamed_csv(self):
+        self.client.force_login(self.event.user)
+        response = self.client.get(reverse('event_attendees', args=[self.event.slug]))
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'username,first_name,last_name,email')
+        self.assertEqual(lines[1:], [f'guest{number},,,guest{number}@example.com' for number in range(5)])
+
+    def test_json_export(self):
+        self.client.force_login(self.event.user)
+        response = self.client.get(reverse('event_attendees', args=[self.event.slug]), {'format': 'json'})
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([row['username'] for row in rows], [f'guest{number}' for number in range(5)])
+        self.assertEqual(json.loads(''.join(stream_json(('a',), iter([]), 2))), [])
+
+    def test_only_organizer_can_export(self):
+        url = reverse('event_attendees', args=[self.event.slug])
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.guests[0])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.event.user)
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 404)
+
+
+class AdminChangelistTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(username='admin', email='admin@example.com',
+                                                        password='password')
+        cls.events = create_events(3)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        start = CustomUser.objects.count()
+        for number in range(start, start + count):
+            user = CustomUser.objects.create_user(username=f'guest{number}', password='password')
+            for event in self.events:
+                join_event(event.pk, user.pk)
+
+    def assertChangelistQueries(self, url, expected, **params):
+        """Changelist must run the same number of queries with more rows"""
+        for _ in range(2):
+            self.add_rows(10)
+            cache.clear()
+            with self.assertNumQueries(expected):
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_user_join_event_changelist(self):
+        # session, user, estimated count, page with event and user joined
+        response = self.assertChangelistQueries(reverse('admin:now_userjoinevent_changelist'), 4)
+        self.assertNotContains(response, f'<option value="{self.events[0].pk}"')
+        self.assertChangelistQueries(reverse('admin:now_userjoinevent_changelist'), 4,
+                                     event_slug=self.events[0].slug, q='guest1')
+
+    def test_custom_user_changelist(self):
+        # session, user, estimated count, page
+        self.assertChangelistQueries(reverse('admin:now_customuser_changelist'), 4, q='guest')
+
+    def test_event_changelist(self):
+        self.assertChangelistQueries(reverse('admin:now_event_changelist'), 4)
+
+    def test_event_autocomplete_searches_slug_prefix(self):
+        url = reverse('admin:autocomplete')
+        params = {'app_label': 'now', 'model_name': 'userjoinevent', 'field_name': 'event'}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {**params, 'term': 'event-1'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [str(self.events[1].pk)])
+        self.assertNotIn('%event-1%', ' '.join(query['sql'] for query in queries))
+        self.assertEqual(self.client.get(url, {**params, 'term': 'vent'}).json()['results'], [])
+
+    def test_event_changelist_searches_title_words(self):
+        event = Event.objects.create(title='Футбольный матч', content='', category=self.events[0].category,
+                                     user=self.events[0].user, is_published=False)
+        url = reverse('admin:now_event_changelist')
+        for term in ('футбольные', event.slug[:5]):
+            with self.subTest(term=term):
+                response = self.client.get(url, {'q': term})
+                self.assertEqual(list(response.context['cl'].result_list), [event])
+        # Autocomplete keeps the slug prefix only
+        params = {'app_label': 'now', 'model_name': 'userjoinevent', 'field_name': 'event', 'term': 'футбольные'}
+        self.assertEqual(self.client.get(reverse('admin:autocomplete'), params).json()['results'], [])
+
+    def test_input_filter(self):
+        url = reverse('admin:now_userjoinevent_changelist')
+        self.add_rows(2)
+        response = self.client.get(url, {'username': 'guest2', 'event_slug': self.events[1].slug})
+        self.assertEqual([(join.event, join.user.username) for join in response.context['cl'].result_list],
+                         [(self.events[1], 'guest2')])
+        self.assertContains(response, 'name="username" value="guest2"')
+
+
+class MetricsTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(4)
+        cls.guest = CustomUser.objects.create_user(username='guest', password='password')
+        join_event(cls.events[0].pk, cls.guest.pk)
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_views_stay_within_query_budget(self):
+        for user in (None, self.guest, self.events[0].user):
+            if user:
+                self.client.force_login(user)
+            for url, data in ((reverse('home'), None), (reverse('events'), None),
+                              (reverse('category', args=['sport']), None), (reverse('categories'), None),
+                              (self.events[0].get_absolute_url(), None), (reverse('search'), {'q': 'event'})):
+                with self.subTest(url=url, user=user):
+                    self.assertEqual(self.assertQueryBudget(url, data).status_code, 200)
+        response = self.assertQueryBudget(reverse('event_attendees', args=[self.events[0].slug]))
+        self.assertEqual(response.status_code, 200)
+        self.client.force_login(self.guest)
+        self.assertQueryBudget(reverse('user_join', args=[self.events[1].slug]))
+        self.assertQueryBudget(reverse('user_out', args=[self.events[1].slug]))
+
+    def test_metrics_are_exported(self):
+        self.client.get(reverse('events'))
+        self.client.get(reverse('events'))
+        self.client.get(reverse('admin:index'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        self.assertIn('now_requests_total{view="events",method="GET",status="200"} 2', text)
+        self.assertIn('now_request_duration_seconds_count{view="events"} 2', text)
+        self.assertIn('now_db_queries_bucket{view="events",le="+Inf"} 2', text)
+        self.assertIn('now_template_render_seconds_total{view="events"}', text)
+        self.assertNotIn('admin', text)
+        self.assertNotIn('view="metrics"', text)
+
+    def test_metrics_are_internal(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 404)
+
+    @override_settings(NOW_QUERY_BUDGETS={'events': 1})
+    def test_requests_over_budget_are_logged(self):
+        with self.assertLogs('now.middleware', 'WARNING') as logs:
+            self.client.get(reverse('events'))
+        self.assertIn('View events ran', logs.output[0])
+        self.assertIn('now_query_budget_exceeded_total{view="events"} 1', registry.render())
+
+
+@override_settings(ROOT_URLCONF='now_events_app.asgi_urls')
+class AsgiTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(4)
+        cls.guest = CustomUser.objects.create_user(username='guest', password='password')
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    async def test_cached_pages_are_served_without_queries(self):
+        client = AsyncClient()
+        for url in (reverse('events'), reverse('category', args=['sport']), reverse('categories'),
+                    self.events[0].get_absolute_url()):
+            with self.subTest(url=url):
+                first = await client.get(url)
+                self.assertEqual(first.status_code, 200)
+                view = resolve(url).url_name
+                queries = registry.queries[(view,)].sum
+                second = await client.get(url)
+                self.assertEqual(second.content, first.content)
+                self.assertEqual(registry.queries[(view,)].sum, queries)
+                self.assertGreater(queries, 0)
+
+    async def test_cached_page_answers_conditional_get(self):
+        client = AsyncClient()
+        url = self.events[0].get_absolute_url()
+        await client.get(url)
+        cached = await client.get(url)
+        self.assertIn('ETag', cached)
+        view = resolve(url).url_name
+        queries = registry.queries[(view,)].sum
+        response = await client.get(url, **{'if-none-match': cached['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(registry.queries[(view,)].sum, queries)
+
+    async def test_logged_in_user_is_served_in_thread(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.guest)
+        # First request also counts published events for the paginator, the count is cached
+        await client.get(reverse('events'))
+        registry.reset()
+        response = await client.get(reverse('events'))
+        self.assertContains(response, 'присоединиться')
+        self.assertEqual(registry.queries[('events',)].sum, 4)
+        # AsyncClient of Django 4.0 takes header names as sent, without HTTP_ prefix
+        response = await client.get(reverse('events'), **{'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_queries_of_sync_views_are_counted(self):
+        url = reverse('search')
+        await sync_to_async(self.client.get)(url, {'q': 'content'})
+        queries = registry.queries[('search',)].sum
+        self.assertGreater(queries, 0)
+        response = await AsyncClient().get(url, {'q': 'content'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(registry.queries[('search',)].sum, 2 * queries)
+
+
+class TaskTest(NowTestCase):
+    def setUp(self):
+        super().setUp()
+        task_calls.clear()
+        self.worker = Worker()
+
+    def test_queued_job_runs_once(self):
+        record_call.enqueue('first')
+        record_call.enqueue('second')
+        self.assertEqual(task_calls, [])
+        self.assertEqual(self.worker.run_pending(), 2)
+        self.assertEqual(task_calls, ['first', 'second'])
+        # Finished jobs are deleted
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(self.worker.run_pending(), 0)
+
+    def test_failed_job_is_retried_later_then_failed(self):
+        record_call.enqueue('broken', fail=True)
+        with self.assertLogs('now.tasks', 'ERROR'):
+            self.assertEqual(self.worker.run_pending(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('ValueError', job.last_error)
+        # Retry waits retry_delay seconds
+        self.assertEqual(self.worker.run_pending(), 0)
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('now.tasks', 'ERROR'):
+            self.assertEqual(self.worker.run_pending(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(task_calls, ['broken', 'broken'])
+
+    def test_job_of_dead_worker_is_claimed_after_visibility_timeout(self):
+        record_call.enqueue('lost')
+        job, = self.worker.claim(1)
+        self.assertEqual(job.status, Job.RUNNING)
+        # Another worker does not see the claimed job
+        self.assertEqual(Worker().claim(1), [])
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        other = Worker()
+        self.assertEqual(other.run_pending(), 1)
+        self.assertEqual(task_calls, ['lost'])
+        # The first worker lost its lock, finishing the job does not touch the row of the second claim
+        self.worker.execute(job)
+        self.assertFalse(Job.objects.exists())
+
+
+@override_settings(NOW_REPLICA_DATABASES=['replica'])
+class ReplicaTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.events = create_events(4)
+        cls.guest = CustomUser.objects.create_user(username='guest', password='password')
+
+    def setUp(self):
+        super().setUp()
+        # The replica alias shares the test database connection, objects read through it keep the alias
+        connections['replica'] = connections['default']
+        self.addCleanup(connections.__delitem__, 'replica')
+        self.client.force_login(self.guest)
+
+    def listed_databases(self, response):
+        return {event._state.db for event in response.context['page_obj']}
+
+    def test_listings_are_read_from_replica(self):
+        for url in (reverse('events'), reverse('category', args=['sport'])):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(self.listed_databases(response), {'replica'})
+                self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.client.get(self.events[0].get_absolute_url()).context['event']._state.db, 'replica')
+        response = self.client.get(reverse('search'), {'q': 'event'})
+        self.assertEqual({event._state.db for event in response.context['events']}, {'replica'})
+
+    def test_reads_after_join_stay_on_primary(self):
+        response = self.client.get(reverse('user_join', args=[self.events[-1].slug]))
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 10)
+        response = self.client.get(reverse('events'))
+        self.assertEqual(self.listed_databases(response), {'default'})
+        self.assertContains(response, 'покинуть')
+
+    def test_objects_from_replica_are_saved_to_primary(self):
+        token = start_request()
+        self.addCleanup(end_request, token)
+        read_from_replica(RequestFactory().get(reverse('events')))
+        event = Event.objects.get(pk=self.events[0].pk)
+        self.assertEqual(event._state.db, 'replica')
+        self.assertEqual(router.db_for_write(Event, instance=event), 'default')
+        # The request has written, its next reads see the primary
+        self.assertEqual(Event.objects.all().db, 'default')
+
+
+class NearbyTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Cities come from migration 0006
+        cls.moscow = City.objects.get(slug='moskva')
+        category = Category.objects.create(category_name='Спорт', slug='sport')
+        cls.user = CustomUser.objects.create_user(username='moscow', password='password', city=cls.moscow)
+        points = {
+            'center': (55.7558, 37.6173),
+            'ten_km_north': (55.8458, 37.6173),
+            'khimki': (55.8970, 37.4297),
+            'podolsk': (55.4312, 37.5458),
+            'petersburg': (59.9343, 30.3351),
+        }
+        cls.events = {}
+        for name, (latitude, longitude) in points.items():
+            cls.events[name] = Event.objects.create(title=name, content='content', category=category, user=cls.user,
+                                                    latitude=latitude, longitude=longitude)
+        cls.events['in_city'] = Event.objects.create(title='in city', content='content', category=category,
+                                                     user=cls.user, city=cls.moscow)
+
+    def test_geohash(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.prefix_range('u4z'), ('u4z', 'u4zzzzzz'))
+        south, west, north, east = geo.bounding_box(55.7558, 37.6173, 50)
+        cells = geo.covering_cells(south, west, north, east)
+        self.assertLessEqual(len(cells), 32)
+        for latitude, longitude in ((south, west), (north, east), (55.7558, 37.6173)):
+            self.assertTrue(any(geo.encode(latitude, longitude).startswith(cell) for cell in cells))
+
+    def test_event_point_defaults_to_city(self):
+        event = self.events['in_city']
+        self.assertEqual((event.latitude, event.longitude), (self.moscow.latitude, self.moscow.longitude))
+        self.assertEqual(event.geohash, geo.encode(self.moscow.latitude, self.moscow.longitude))
+
+    def test_events_are_ranked_by_ring_then_recency(self):
+        events = list(nearby_events(self.moscow.latitude, self.moscow.longitude)
+                      .order_by('ring', '-time_update', '-id'))
+        self.assertEqual([(event.title, event.ring) for event in events],
+                         [('in city', 0), ('center', 0), ('ten_km_north', 1), ('podolsk', 2), ('khimki', 2)])
+
+    def test_feed_of_user_city_is_paginated_by_cursor(self):
+        self.client.force_login(self.user)
+        first = self.assertQueryBudget(reverse('nearby'))
+        self.assertEqual([event.title for event in first.context['page_obj']], ['in city', 'center', 'ten_km_north'])
+        self.assertContains(first, '10,0 км')
+        second = self.client.get(reverse('nearby'), {'cursor': first.context['page_obj'].next_cursor})
+        self.assertEqual([event.title for event in second.context['page_obj']], ['podolsk', 'khimki'])
+
+    def test_feed_rows_follow_event_changes(self):
+        event = self.events['podolsk']
+        self.assertEqual(set(CityEvent.objects.filter(event=event).values_list('city__slug', 'ring')),
+                         {('moskva', 2), ('podolsk', 0)})
+        event.is_published = False
+        event.save()
+        self.assertFalse(CityEvent.objects.filter(event=event).exists())
+        # Only the feed of the new city is queued, not thumbnails of the fixtures
+        Job.objects.all().delete()
+        city = City.objects.create(name='Видное', latitude=55.5517, longitude=37.7086)
+        self.assertEqual(Worker().run_pending(), 1)
+        self.assertEqual(set(CityEvent.objects.filter(city=city).values_list('event__title', flat=True)),
+                         {'center', 'in city', 'ten_km_north', 'khimki'})
+        call_command('rebuild_city_events', 'moskva', stdout=StringIO())
+        self.assertEqual(CityEvent.objects.filter(city=self.moscow).count(), 4)
+
+    def test_city_from_query_string(self):
+        response = self.client.get(reverse('nearby'), {'city': 'sankt-peterburg'})
+        self.assertEqual([event.title for event in response.context['page_obj']], ['petersburg'])
+        self.assertEqual(self.client.get(reverse('nearby'), {'city': 'atlantida'}).status_code, 404)
+        self.assertContains(self.client.get(reverse('nearby')), 'Выберите город')
+
+    def test_location_is_matched_to_city(self):
+        self.assertEqual(find_city('  москва '), self.moscow)
+        self.assertEqual(find_city('Нижний  новгород').slug, 'nizhnii-novgorod')
+        self.assertIsNone(find_city('Атлантида'))
+
+
+class RecommendationTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        sport = Category.objects.create(category_name='Спорт', slug='sport')
+        music = Category.objects.create(category_name='Музыка', slug='music')
+        organizer = CustomUser.objects.create_user(username='organizer', password='password')
+        cls.events = {}
+        for name, category in (('s1', sport), ('s2', sport), ('s3', sport), ('s4', sport),
+                               ('m1', music), ('m2', music), ('m3', music)):
+            cls.events[name] = Event.objects.create(title=name, content='content', category=category, user=organizer)
+        cls.users = {}
+        joins = {'alice': ('s1', 's2', 'm1'), 'bob': ('s1', 's3'), 'carol': ('s1', 's2', 'm2'), 'dave': ('m1', 'm3')}
+        for username, titles in joins.items():
+            cls.users[username] = CustomUser.objects.create_user(username=username, password='password')
+            for title in titles:
+                join_event(cls.events[title].pk, cls.users[username].pk)
+
+    def setUp(self):
+        super().setUp()
+        # Feeds of the fixture joins are computed by the queued jobs
+        Worker().run_pending()
+
+    def feed(self, username):
+        return list(UserEventScore.objects.filter(user=self.users[username]).order_by('-score', '-event_id')
+                    .values_list('event__title', 'score'))
+
+    def test_scores_combine_category_affinity_and_co_attendance(self):
+        # alice: 2 of 3 joins in sport; co-attendees bob (1 shared event), carol (2) and dave (1)
+        expected = [('m2', 1 / 3 + 2 * 2 / 4), ('s3', 2 / 3 + 2 * 1 / 4), ('m3', 1 / 3 + 2 * 1 / 4), ('s4', 2 / 3)]
+        for (title, score), (expected_title, expected_score) in zip(self.feed('alice'), expected, strict=True):
+            self.assertEqual(title, expected_title)
+            self.assertAlmostEqual(score, expected_score)
+        self.assertEqual([(score, event_id) for score, event_id in score_user(self.users['alice'].pk)],
+                         [(score, self.events[title].pk) for title, score in self.feed('alice')])
+
+    def test_feed_is_paginated_by_cursor(self):
+        self.client.force_login(self.users['alice'])
+        first = self.assertQueryBudget(reverse('recommended'))
+        self.assertEqual([event.title for event in first.context['page_obj']], ['m2', 's3', 'm3'])
+        second = self.client.get(reverse('recommended'), {'cursor': first.context['page_obj'].next_cursor})
+        self.assertEqual([event.title for event in second.context['page_obj']], ['s4'])
+        self.client.logout()
+        self.assertRedirects(self.client.get(reverse('recommended')), f"{reverse('login')}?next=/recommended/")
+
+    def test_join_refreshes_feeds_of_user_and_co_attendees(self):
+        erin = CustomUser.objects.create_user(username='erin', password='password')
+        self.assertNotIn('m3', dict(self.feed('bob')))
+        join_event(self.events['s3'].pk, erin.pk)
+        join_event(self.events['m3'].pk, erin.pk)
+        Worker().run_pending()
+        # bob shares s3 with erin, who joined m3
+        self.assertIn('m3', dict(self.feed('bob')))
+        self.assertNotIn('s3', dict(UserEventScore.objects.filter(user=erin).values_list('event__title', 'score')))
+        leave_event(self.events['m2'].pk, self.users['carol'].pk)
+        Worker().run_pending()
+        # Nobody else joined m2 and carol has no music events left
+        self.assertEqual(set(dict(self.feed('carol'))), {'s3', 's4', 'm1'})
+
+    def test_unpublished_event_leaves_feeds(self):
+        event = self.events['m2']
+        event.is_published = False
+        event.save()
+        self.assertFalse(UserEventScore.objects.filter(event=event).exists())
+
+    def test_rebuild_matches_incremental_updates(self):
+        incremental = set(UserEventScore.objects.values_list('user_id', 'event_id', 'score'))
+        UserEventScore.objects.all().delete()
+        call_command('rebuild_recommendations', stdout=StringIO())
+        self.assertEqual(set(UserEventScore.objects.values_list('user_id', 'event_id', 'score')), incremental)
+
+
+class EventScheduleTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        moscow = City.objects.get(slug='moskva')
+        schedules = {
+            'past': (now - timedelta(days=3), now - timedelta(days=3, hours=-2)),
+            'ongoing': (now - timedelta(hours=1), None),
+            'upcoming': (now + timedelta(days=1), None),
+            'unscheduled': (None, None),
+        }
+        category = Category.objects.create(category_name='Спорт', slug='sport')
+        cls.events = {}
+        for title, (starts_at, ends_at) in schedules.items():
+            cls.events[title], = create_events(1, category=category, city=moscow, starts_at=starts_at, ends_at=ends_at,
+                                               user=CustomUser.objects.create_user(username=title, password='password'))
+            cls.events[title].title = title
+            cls.events[title].save(update_fields=['title'])
+
+    def listed(self, url, when=None):
+        response = self.client.get(url, {'when': when} if when else {})
+        return [event.title for event in response.context['page_obj']]
+
+    def test_end_defaults_to_start_and_follows_it(self):
+        event = self.events['ongoing']
+        self.assertEqual(event.ends_at - event.starts_at, timedelta(hours=2))
+        self.assertIsNone(self.events['unscheduled'].ends_at)
+        event.ends_at = event.starts_at - timedelta(minutes=1)
+        with self.assertRaises(ValidationError):
+            event.full_clean()
+
+    def test_time_windows_of_listings(self):
+        for url in (reverse('events'), reverse('category', args=['sport'])):
+            with self.subTest(url=url):
+                self.assertEqual(self.listed(url, 'upcoming'), ['upcoming'])
+                self.assertEqual(self.listed(url, 'ongoing'), ['ongoing'])
+                self.assertEqual(self.listed(url, 'past'), ['past'])
+                self.assertEqual(self.client.get(url, {'when': 'someday'}).status_code, 404)
+        self.assertContains(self.client.get(reverse('events')), '?when=upcoming')
+        self.events['upcoming'].delete()
+        self.assertEqual(self.client.get(reverse('category', args=['sport']), {'when': 'upcoming'}).status_code, 200)
+
+    def test_archive_moves_finished_events_out_of_listing(self):
+        past = self.events['past']
+        self.assertTrue(CityEvent.objects.filter(event=past).exists())
+        self.assertEqual(archive_events(batch_size=1), 1)
+        self.assertEqual(archive_events(), 0)
+        past.refresh_from_db()
+        self.assertTrue(past.is_archived)
+        self.assertFalse(CityEvent.objects.filter(event=past).exists())
+        self.assertEqual(sorted(self.listed(reverse('events'))), ['ongoing', 'unscheduled', 'upcoming'])
+        self.assertEqual(self.listed(reverse('events'), 'past'), ['past'])
+        # Rescheduled event comes back
+        past.starts_at = timezone.now() + timedelta(days=2)
+        past.ends_at = None
+        past.save()
+        self.assertFalse(past.is_archived)
+        out = StringIO()
+        call_command('archive_events', '--grace-hours', '0', stdout=out)
+        self.assertIn('archived 0 events', out.getvalue())
+
+
+class ApiTest(NowTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.get(slug='moskva')
+        cls.events = create_events(5, city=cls.city)
+        cls.organizer = cls.events[0].user
+        cls.guest = CustomUser.objects.create_user(username='guest', password='password', email='guest@example.com')
+
+    def get(self, url, data=None, status=200):
+        response = self.assertQueryBudget(url, data)
+        self.assertEqual(response.status_code, status, response.content)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        return json.loads(response.content)
+
+    def send(self, method, url, data=None):
+        return self.assertQueryBudget(url, json.dumps(data or {}), method.upper(), content_type='application/json')
+
+    def test_sparse_fields_and_includes_read_one_page_query(self):
+        url = reverse('api_events')
+        with CaptureQueriesContext(connection) as queries:
+            first = self.get(url, {'fields': 'title', 'include': 'category,city', 'limit': 3})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"content"', queries[0]['sql'])
+        self.assertEqual([event['title'] for event in first['data']], ['event 4', 'event 3', 'event 2'])
+        self.assertEqual(first['data'][0]['category'], {'slug': 'sport', 'category_name': 'Спорт'})
+        self.assertEqual(first['data'][0]['city']['slug'], 'moskva')
+        with self.assertNumQueries(1):
+            second = self.get(url, {'fields': 'slug,user,photo', 'limit': 3, 'cursor': first['next']})
+        self.assertEqual(second['data'][-1], {'slug': 'event-0', 'user': 'organizer',
+                                              'photo': self.events[0].photo.url})
+        self.assertIsNone(second['next'])
+
+    def test_batched_lookup_by_slug(self):
+        with self.assertNumQueries(1):
+            batch = self.get(reverse('api_events'), {'slug': 'event-1,missing,event-3',
+                                                     'fields': 'slug,attendee_count'})
+        self.assertEqual(batch['data'], [{'slug': 'event-1', 'attendee_count': 0},
+                                         {'slug': 'event-3', 'attendee_count': 0}])
+        self.assertEqual(batch['missing'], ['missing'])
+        users = self.get(reverse('api_users'), {'slug': 'guest', 'include': 'city'})['data']
+        self.assertNotIn('email', users[0])
+        self.assertEqual(self.get(reverse('api_category', args=['sport']))['data']['category_name'], 'Спорт')
+
+    def test_invalid_requests_are_answered_with_json_errors(self):
+        url = reverse('api_events')
+        self.assertIn('password', self.get(reverse('api_users'), {'fields': 'password'}, 400)['error'])
+        self.assertIn('tags', self.get(url, {'include': 'tags'}, 400)['error'])
+        self.get(url, {'limit': 0}, 400)
+        self.get(url, {'cursor': 'broken'}, 400)
+        self.get(reverse('api_event', args=['missing']), status=404)
+        self.get(reverse('api_memberships'), status=401)
+        self.assertEqual(self.send('post', url, {'title': 'new'}).status_code, 401)
+
+    def test_author_creates_updates_and_deletes_event(self):
+        self.client.force_login(self.guest)
+        response = self.send('post', reverse('api_events'), {'title': 'Концерт', 'content': 'Живой звук',
+                                                             'category': 'sport', 'city': 'moskva', 'capacity': 2})
+        self.assertEqual(response.status_code, 201, response.content)
+        created = json.loads(response.content)['data']
+        self.assertEqual((created['user'], created['city'], created['capacity'], created['is_published']),
+                         ('guest', 'moskva', 2, True))
+        url = reverse('api_event', args=[created['slug']])
+        errors = json.loads(self.send('patch', url, {'category': 'missing'}).content)
+        self.assertIn('category', errors['details'])
+        updated = json.loads(self.send('patch', url, {'title': 'Концерт в парке'}).content)['data']
+        self.assertEqual((updated['title'], updated['content']), ('Концерт в парке', 'Живой звук'))
+        url = reverse('api_event', args=[updated['slug']])
+        # Events of other users are not found
+        self.assertEqual(self.send('delete', reverse('api_event', args=['event-0'])).status_code, 404)
+        self.assertEqual(self.send('delete', url).status_code, 204)
+        self.assertFalse(Event.objects.filter(slug=updated['slug']).exists())
+
+    def test_memberships_join_list_and_leave(self):
+        self.client.force_login(self.guest)
+        url = reverse('api_memberships')
+        response = self.send('post', url, {'event': 'event-2'})
+        self.assertEqual((response.status_code, json.loads(response.content)['data']['status']), (201, 'joined'))
+        self.assertEqual(json.loads(self.send('post', url, {'event': 'event-2'}).content)['data']['status'], 'already')
+        self.assertEqual(self.send('post', url, {'event': 'missing'}).status_code, 404)
+        listed = self.get(url, {'include': 'event', 'fields': 'event'})
+        self.assertEqual(listed['data'][0]['event']['attendee_count'], 1)
+        self.assertEqual(self.get(reverse('api_membership', args=['event-2']))['data']['user'], 'guest')
+        self.assertEqual(self.send('delete', reverse('api_membership', args=['event-2'])).status_code, 204)
+        self.assertEqual(self.get(url)['data'], [])
+
+    def test_standard_library_fallback_writes_same_json(self):
+        data = {'title': 'Событие', 'time': timezone.now(), 'latitude': 55.75, 'capacity': None}
+        with mock.patch.object(api, 'orjson', None):
+            fallback = api.dumps(data)
+        self.assertEqual(api.dumps(data), fallback)
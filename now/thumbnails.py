@@ -0,0 +1,77 @@
+import hashlib
+import posixpath
+from io import BytesIO
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from now.caching import bump_version
+from now.tasks import task
+
+# Name: (width, height), cards show photos at 225x225, the 2x size is for high density screens
+THUMBNAIL_SIZES = {
+    'card': (225, 225),
+    'card2x': (450, 450),
+}
+# Format: (Pillow format, file extension, save options)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+THUMBNAIL_ROOT = 'thumbs'
+# Templates read readiness of thumbnails from cache, generate_thumbnails sets it once they are saved
+THUMBNAIL_READY_TIMEOUT = 60 * 60
+
+
+def thumbnail_name(name, size, fmt):
+    """Return storage name of thumbnail for original file name"""
+    root, _ = posixpath.splitext(name)
+    return f'{THUMBNAIL_ROOT}/{size}/{root}.{THUMBNAIL_FORMATS[fmt][1]}'
+
+
+def thumbnails_exist(name, storage=default_storage):
+    return all(storage.exists(thumbnail_name(name, size, fmt))
+               for size in THUMBNAIL_SIZES for fmt in THUMBNAIL_FORMATS)
+
+
+def _ready_key(name):
+    return f'now:thumbs:{hashlib.md5(name.encode()).hexdigest()}'
+
+
+def thumbnails_ready(name):
+    """Return whether thumbnails of name exist, storage is checked only when the cached answer expired"""
+    ready = cache.get(_ready_key(name))
+    if ready is None:
+        ready = thumbnails_exist(name)
+        cache.set(_ready_key(name), ready, THUMBNAIL_READY_TIMEOUT)
+    return ready
+
+
+# Resizing runs in the run_worker command, web workers only insert the job
+@task(unique=True)
+def generate_thumbnails(name, storage=default_storage):
+    """Create every size and format of thumbnail for original file name"""
+    from PIL import Image, ImageOps
+
+    with storage.open(name, 'rb') as file:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    for size, dimensions in THUMBNAIL_SIZES.items():
+        thumbnail = ImageOps.fit(image, dimensions, Image.LANCZOS)
+        for fmt, (pil_format, _, options) in THUMBNAIL_FORMATS.items():
+            buffer = BytesIO()
+            thumbnail.save(buffer, pil_format, **options)
+            target = thumbnail_name(name, size, fmt)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+    cache.set(_ready_key(name), True, THUMBNAIL_READY_TIMEOUT)
+    # Cached cards still point to the original photo, let them pick up the thumbnail
+    bump_version('events')
+
+
+def schedule_thumbnails(name):
+    """Queue thumbnails of photo for the worker, the job is visible once current transaction commits"""
+    if name and not thumbnails_exist(name):
+        generate_thumbnails.enqueue(name)
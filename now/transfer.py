@@ -0,0 +1,330 @@
+import csv
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from now import geo
+from now.caching import bump_version
+from now.models import DEFAULT_EVENT_DURATION, Category, City, CustomUser, Event, UserJoinEvent
+from now.search import index_rows, uses_fts_table
+from now.services import rebuild_attendee_counts, update_city_events
+from now.slugs import allocate_slugs, slug_base
+
+BATCH_SIZE = 1000
+FORMATS = ('ndjson', 'csv')
+
+# Kind: (model, exported columns, values_list lookups), relations are written as natural keys
+KINDS = {
+    'categories': (Category, ('slug', 'category_name'), ('slug', 'category_name')),
+    'events': (Event,
+               ('slug', 'title', 'content', 'category', 'user', 'city', 'latitude', 'longitude', 'is_published',
+                'photo', 'time_create', 'time_update', 'starts_at', 'ends_at', 'capacity'),
+               ('slug', 'title', 'content', 'category__slug', 'user__username', 'city__slug', 'latitude',
+                'longitude', 'is_published', 'photo', 'time_create', 'time_update', 'starts_at', 'ends_at',
+                'capacity')),
+    'joins': (UserJoinEvent, ('event', 'user'), ('event__slug', 'user__username')),
+}
+
+
+@contextmanager
+def explicit_timestamps(model):
+    """Let bulk_create keep generated auto_now/auto_now_add values"""
+    fields = [field for field in model._meta.fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def batches(iterable, size):
+    """Yield lists of at most size items, only one batch is held in memory"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def export_records(kind, batch_size=BATCH_SIZE):
+    """Yield dicts of every row of kind, rows are fetched chunk by chunk"""
+    model, columns, lookups = KINDS[kind]
+    rows = model.objects.order_by('pk').values_list(*lookups)
+    for row in rows.iterator(chunk_size=batch_size):
+        yield dict(zip(columns, row))
+
+
+def _value(value):
+    # isoformat keeps microseconds which DjangoJSONEncoder would drop
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def write_records(file, fmt, kind, records):
+    """Write records to text file as NDJSON or CSV with header, return number of records"""
+    written = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fieldnames=KINDS[kind][1])
+        writer.writeheader()
+        for written, record in enumerate(records, 1):
+            writer.writerow({key: _value(value) for key, value in record.items()})
+    else:
+        for written, record in enumerate(records, 1):
+            file.write(json.dumps(record, ensure_ascii=False, default=_value) + '\n')
+    return written
+
+
+def read_records(file, fmt):
+    """Yield (line number, dict) from NDJSON or CSV text file line by line, unparsable lines give None"""
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for number, line in enumerate(file, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError:
+                    yield number, None
+
+
+def _boolean(value, default=True):
+    if value in (None, ''):
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 't')
+    return bool(value)
+
+
+def _float(value):
+    if value in (None, ''):
+        return None
+    return float(value)
+
+
+def _integer(value):
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def _datetime(value, default):
+    if not value:
+        return default
+    if isinstance(value, str):
+        value = parse_datetime(value) or value
+    if not isinstance(value, datetime):
+        raise ValueError(f'invalid datetime {value!r}')
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def _check_keys(record, keys):
+    """Natural keys are looked up in sets and IN queries, only strings are accepted"""
+    for key in keys:
+        if record.get(key) is not None and not isinstance(record[key], str):
+            raise ValueError(f'{key} must be a string')
+
+
+class _KeyCache:
+    """class _KeyCache resolve natural keys to ids with one IN query per batch of unknown keys.
+
+    Only keys of the current batch are kept, memory does not grow with the size of the file.
+    """
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self.ids = {}
+
+    def load(self, keys):
+        keys = {key for key in keys if key}
+        self.ids = {key: pk for key, pk in self.ids.items() if key in keys}
+        missing = keys - self.ids.keys()
+        if missing:
+            self.ids.update(self.model.objects.filter(**{f'{self.field}__in': missing})
+                            .order_by().values_list(self.field, 'pk'))
+
+    def get(self, key):
+        return self.ids.get(key)
+
+
+class Importer:
+    """class Importer load records of one kind in batches with bulk_create.
+
+    Events are matched by slug: a record whose slug exists already is skipped, so a file
+    can be imported twice. Explicit slugs are kept as given, records without slug get one from title,
+    made unique with now.slugs.allocate_slugs.
+    Related category, user, city and event are looked up by slug or username.
+    Invalid records are skipped, their line numbers and reasons are collected in errors.
+    """
+
+    def __init__(self, kind, batch_size=BATCH_SIZE):
+        self.kind = kind
+        self.batch_size = batch_size
+        self.categories = _KeyCache(Category, 'slug')
+        self.users = _KeyCache(CustomUser, 'username')
+        self.events = _KeyCache(Event, 'slug')
+        self.cities = _KeyCache(City, 'slug')
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        # Events of imported memberships, only their attendee counts are recounted
+        self.joined_event_ids = set()
+
+    def run(self, records):
+        """Import (line number, record) pairs and return (created, skipped)"""
+        load = getattr(self, f'_load_{self.kind}')
+        clean = getattr(self, f'_clean_{self.kind}')
+        for batch in batches(records, self.batch_size):
+            valid = []
+            for line, record in batch:
+                try:
+                    if not isinstance(record, dict):
+                        raise ValueError('not an object')
+                    valid.append(clean(record))
+                except (TypeError, ValueError) as error:
+                    self.errors.append((line, str(error)))
+                    self.skipped += 1
+            with transaction.atomic():
+                load(valid)
+        self._finish()
+        return self.created, self.skipped
+
+    def _create(self, model, objects, total):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.created += len(objects)
+        self.skipped += total - len(objects)
+
+    def _clean_categories(self, record):
+        if not isinstance(record.get('category_name'), str) or not record['category_name'].strip():
+            raise ValueError('category_name is missing')
+        _check_keys(record, ('slug',))
+        return record
+
+    def _clean_events(self, record):
+        """Return record with parsed values, ValueError names the first invalid one"""
+        if not isinstance(record.get('title'), str) or not record['title'].strip():
+            raise ValueError('title is missing')
+        _check_keys(record, ('slug', 'category', 'user', 'city'))
+        cleaned = dict(record)
+        for key in ('time_create', 'time_update', 'starts_at', 'ends_at'):
+            cleaned[key] = _datetime(record.get(key), None)
+        for key in ('latitude', 'longitude'):
+            cleaned[key] = _float(record.get(key))
+        cleaned['capacity'] = _integer(record.get('capacity'))
+        return cleaned
+
+    def _clean_joins(self, record):
+        if not record.get('event') or not record.get('user'):
+            raise ValueError('event or user is missing')
+        _check_keys(record, ('event', 'user'))
+        return record
+
+    def _load_categories(self, batch):
+        slugs = [record.get('slug') or slug_base(record['category_name'], default='category') for record in batch]
+        existing = set(Category.objects.filter(slug__in=slugs).values_list('slug', flat=True))
+        objects = {}
+        for record, slug in zip(batch, slugs):
+            if slug not in existing:
+                objects.setdefault(slug, Category(category_name=record['category_name'], slug=slug))
+        self._create(Category, list(objects.values()), len(batch))
+
+    def _load_events(self, batch):
+        self.categories.load(record.get('category') for record in batch)
+        self.users.load(record.get('user') for record in batch)
+        self.cities.load(record.get('city') for record in batch)
+        existing = set(Event.objects.filter(slug__in=[record['slug'] for record in batch if record.get('slug')])
+                       .order_by().values_list('slug', flat=True))
+        now = timezone.now()
+        records = []
+        for record in batch:
+            category_id = self.categories.get(record.get('category'))
+            user_id = self.users.get(record.get('user'))
+            slug = record.get('slug')
+            if category_id is None or user_id is None or (slug and slug in existing):
+                continue
+            if slug:
+                existing.add(slug)
+            records.append((record, category_id, user_id))
+        # Explicit slugs are kept as they are, so re-importing a file finds its events again. They are
+        # inserted first, then slugs made from titles are allocated around them with one range query
+        generated = [row for row in records if not row[0].get('slug')]
+        objects = [self._event(record, category_id, user_id, record['slug'], now)
+                   for record, category_id, user_id in records if record.get('slug')]
+        with explicit_timestamps(Event):
+            self._create(Event, objects, len(batch) - len(generated))
+        # Same-title records get consecutive suffixes
+        slugs = allocate_slugs(Event, [slug_base(record['title'], default='event') for record, _, _ in generated])
+        generated = [self._event(record, category_id, user_id, slug, now)
+                     for (record, category_id, user_id), slug in zip(generated, slugs)]
+        with explicit_timestamps(Event):
+            self._create(Event, generated, len(generated))
+        objects += generated
+        slugs = [event.slug for event in objects]
+        if objects and objects[0].pk is None:
+            # Databases without RETURNING for bulk inserts do not set primary keys
+            objects = list(Event.objects.filter(slug__in=slugs).order_by())
+        if uses_fts_table() and objects:
+            # bulk_create does not send post_save, index the new rows of this batch
+            with connection.cursor() as cursor:
+                index_rows(cursor, [(event.pk, event.title, event.content) for event in objects])
+        # Nearby feeds of cities around the new events
+        update_city_events([event for event in objects if event.geohash])
+
+    def _event(self, record, category_id, user_id, slug, now):
+        """Return unsaved Event of import record"""
+        time_create = _datetime(record.get('time_create'), now)
+        latitude, longitude = _float(record.get('latitude')), _float(record.get('longitude'))
+        # bulk_create skips Event.save, the geohash of the nearby feed is computed here
+        has_point = latitude is not None and longitude is not None
+        # Finished events are imported into the listing, the next archive_events run moves them out
+        starts_at = _datetime(record.get('starts_at'), None)
+        ends_at = _datetime(record.get('ends_at'), starts_at and starts_at + DEFAULT_EVENT_DURATION)
+        return Event(title=record['title'], slug=slug, content=record.get('content') or '',
+                     photo=record.get('photo') or Event._meta.get_field('photo').default,
+                     is_published=_boolean(record.get('is_published')),
+                     time_create=time_create,
+                     time_update=_datetime(record.get('time_update'), time_create),
+                     category_id=category_id, user_id=user_id,
+                     city_id=self.cities.get(record.get('city')), latitude=latitude, longitude=longitude,
+                     geohash=geo.encode(latitude, longitude) if has_point else '',
+                     starts_at=starts_at, ends_at=ends_at, capacity=_integer(record.get('capacity')))
+
+    def _load_joins(self, batch):
+        self.events.load(record.get('event') for record in batch)
+        self.users.load(record.get('user') for record in batch)
+        pairs = {(self.events.get(record.get('event')), self.users.get(record.get('user'))) for record in batch}
+        pairs = {(event_id, user_id) for event_id, user_id in pairs if event_id is not None and user_id is not None}
+        # One query finds memberships of the batch which exist already
+        existing = set(UserJoinEvent.objects.filter(event_id__in={event_id for event_id, _ in pairs},
+                                                    user_id__in={user_id for _, user_id in pairs})
+                       .values_list('event_id', 'user_id'))
+        objects = [UserJoinEvent(event_id=event_id, user_id=user_id) for event_id, user_id in sorted(pairs - existing)]
+        self._create(UserJoinEvent, objects, len(batch))
+        self.joined_event_ids.update(join.event_id for join in objects)
+
+    def _finish(self):
+        if not self.created:
+            return
+        for event_ids in batches(sorted(self.joined_event_ids), self.batch_size):
+            rebuild_attendee_counts(batch_size=self.batch_size, event_ids=event_ids)
+        # bulk_create does not send post_save, invalidate cached pages and category rows once
+        bump_version('events')
+        bump_version('categories')
+
+
+def import_records(kind, records, batch_size=BATCH_SIZE):
+    """Import iterable of record dicts of kind numbered from 1, return (created, skipped)"""
+    return Importer(kind, batch_size).run(enumerate(records, 1))
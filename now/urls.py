@@ -2,10 +2,12 @@
 from django.urls import path
 from ratelimit.decorators import ratelimit
 
+from now.api import CategoriesApi, CategoryApi, EventApi, EventsApi, MembershipApi, MembershipsApi, UserApi, UsersApi
 from now.views import Index, About, LoginUser, RegisterUser, UpdateUser, \
                       Profile, LogoutUser, Events, ShowEvent, UpdateEvent, \
                       Categories, CategoryEvents, AddEvent, DeleteEvent, \
-                      UserGoEvent, UserOutEvent
+                      UserGoEvent, UserOutEvent, SearchEvents, EventAttendees, Metrics, \
+                      NearbyEvents, RecommendedEvents
 
 urlpatterns = [
     path('', Index.as_view(), name='home'),
@@ -20,8 +22,21 @@ urlpatterns = [
     path('update_event/<slug:slug>/', UpdateEvent.as_view(), name='update_event'),
     path('categories/', Categories.as_view(), name='categories'),
     path('category/<slug:category_slug>/', CategoryEvents.as_view(), name='category'),
+    path('search/', SearchEvents.as_view(), name='search'),
+    path('nearby/', NearbyEvents.as_view(), name='nearby'),
+    path('recommended/', RecommendedEvents.as_view(), name='recommended'),
     path('add_event/', ratelimit(key='user', method='POST', rate='1/1m')(AddEvent.as_view()), name='add_event'),
     path('delete_event/<slug:event_slug>/', DeleteEvent.as_view(), name='delete_event'),
+    path('event/<slug:event_slug>/attendees/', EventAttendees.as_view(), name='event_attendees'),
     path('user_join/<slug:event_slug>/', UserGoEvent.as_view(), name='user_join'),
-    path('user_out/<slug:event_slug>/', UserOutEvent.as_view(), name='user_out')
+    path('user_out/<slug:event_slug>/', UserOutEvent.as_view(), name='user_out'),
+    path('metrics/', Metrics.as_view(), name='metrics'),
+    path('api/events/', ratelimit(key='user', method='POST', rate='1/1m')(EventsApi.as_view()), name='api_events'),
+    path('api/events/<slug:slug>/', EventApi.as_view(), name='api_event'),
+    path('api/categories/', CategoriesApi.as_view(), name='api_categories'),
+    path('api/categories/<slug:slug>/', CategoryApi.as_view(), name='api_category'),
+    path('api/users/', UsersApi.as_view(), name='api_users'),
+    path('api/users/<slug:slug>/', UserApi.as_view(), name='api_user'),
+    path('api/memberships/', MembershipsApi.as_view(), name='api_memberships'),
+    path('api/memberships/<slug:slug>/', MembershipApi.as_view(), name='api_membership')
 ]
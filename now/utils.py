@@ -1,4 +1,17 @@
-from now.models import Event, UserJoinEvent
+import csv
+import hashlib
+import json
+import time
+
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from now.caching import PAGE_TIMEOUT, get_or_build_page, get_version
+from now.models import Event
+from now.routers import read_from_replica
+from now.services import EVENT_WINDOWS, in_window, joined_event_ids
+from now.transfer import batches
 
 
 class DataMixin:
@@ -9,15 +22,154 @@ class DataMixin:
         """Get event QuerySet"""
         return Event.objects.filter(slug=self.kwargs['event_slug'])
 
-    def check_user_joined_event(self):
-        """Check user joined event for delete"""
-        event_detail_id = self.get_event()[0].id
-        # Get QuerySet all() in model UserJoinEvent for check None or not None database
-        user_join_event = UserJoinEvent.objects.all()
-        if user_join_event:
-            # Get event id from QuerySet for delete database entry
-            user_join_event = UserJoinEvent.objects.get(event_id=event_detail_id)
-            user_join_event.delete()
+    def get_event_id(self):
+        """Get event id by slug with one query on the unique slug index"""
+        event_id = self.get_event().values_list('pk', flat=True).first()
+        if event_id is None:
+            raise Http404('Событие не найдено')
+        return event_id
+
+
+class MembershipMixin:
+    """class MembershipMixin add ids of listed events joined by current user to context."""
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # One IN query for the whole page, templates check {% if e.pk in joined_event_ids %}
+        events = context['page_obj'] or context['object_list']
+        context['joined_event_ids'] = joined_event_ids(self.request.user, [event.pk for event in events])
+        return context
+
+
+class ReplicaReadMixin:
+    """class ReplicaReadMixin read objects of GET requests from a replica, must be the first base of the view."""
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            read_from_replica(request)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class TimeWindowMixin:
+    """class TimeWindowMixin filter event listing by ?when= window of EVENT_WINDOWS and order it by the window index."""
+
+    window_query_param = 'when'
+
+    def get_window(self):
+        when = self.request.GET.get(self.window_query_param, '')
+        if when and when not in EVENT_WINDOWS:
+            raise Http404('Неизвестный период')
+        return when
+
+    def filter_window(self, queryset):
+        return in_window(queryset, self.get_window())
+
+    def get_cursor_ordering(self):
+        when = self.get_window()
+        return EVENT_WINDOWS[when][1] if when else super().get_cursor_ordering()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['when'] = self.get_window()
+        context['windows'] = [(when, label) for when, (label, _) in EVENT_WINDOWS.items()]
+        return context
+
+
+class PageCacheMixin:
+    """class PageCacheMixin serve cached pages to anonymous users and pass content version to templates."""
+
+    # Namespace from now.caching whose version is part of page and fragment keys
+    page_cache_namespace = 'events'
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+
+        def build():
+            response = super(PageCacheMixin, self).dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            self.add_validator_headers(response)
+            return response
+
+        return get_or_build_page(self.page_cache_namespace, request, build)
+
+    def add_validator_headers(self, response):
+        """Set by ConditionalGetMixin, headers added here are cached with the page"""
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Used by {% cache %} fragments, a version bump purges all cards at once
+        context['content_version'] = get_version(self.page_cache_namespace)
+        return context
+
+
+class ConditionalGetMixin:
+    """class ConditionalGetMixin answer 304 Not Modified before the view loads objects and renders template."""
+
+    # Namespace from now.caching bumped when events are saved or deleted
+    validator_namespace = 'events'
+
+    def get_validator_parts(self):
+        """Return (last_modified, parts) for ETag, by default the ETag only
+
+        Newest time_update of a listing goes back when its newest event is deleted or unpublished,
+        the version of validator_namespace moves forward with every save and delete instead.
+        """
+        # Attendee counts change without time_update, the time bucket bounds their staleness like page cache
+        return None, [int(time.time() // PAGE_TIMEOUT)]
+
+    def get_validators(self):
+        """Return (etag, last_modified) for current request"""
+        last_modified, parts = self.get_validator_parts()
+        user = self.request.user
+        if user.is_authenticated:
+            parts += [user.pk, get_version(f'memberships:{user.pk}')]
+        parts += [get_version(self.validator_namespace), last_modified, self.request.get_full_path()]
+        digest = hashlib.md5(repr(parts).encode()).hexdigest()
+        return f'W/"{digest}"', last_modified
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return super().dispatch(request, *args, **kwargs)
+        etag, last_modified = self.get_validators()
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        self._validators = etag, timestamp
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+            self.add_validator_headers(response)
+        return response
+
+    def add_validator_headers(self, response):
+        """Set ETag and Last-Modified of 200 response, also before PageCacheMixin caches the page"""
+        etag, timestamp = self._validators
+        if response.status_code == 200:
+            response.headers['ETag'] = etag
+            if timestamp is not None:
+                response.headers['Last-Modified'] = http_date(timestamp)
+
+
+class _Echo:
+    """class _Echo is file-like object for csv.writer which returns written line instead of storing it."""
+
+    def write(self, value):
+        return value
+
 
+def stream_csv(header, rows, chunk_size):
+    """Yield CSV text of header and rows, one string per chunk of rows"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for chunk in batches(rows, chunk_size):
+        yield ''.join(writer.writerow(row) for row in chunk)
 
 
+def stream_json(fields, rows, chunk_size):
+    """Yield JSON array of objects built from fields and rows, one string per chunk of rows"""
+    yield '['
+    separator = ''
+    for chunk in batches(rows, chunk_size):
+        yield separator + ','.join(json.dumps(dict(zip(fields, row)), ensure_ascii=False) for row in chunk)
+        separator = ','
+    yield ']'
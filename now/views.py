@@ -1,16 +1,24 @@
 from django.contrib.auth import login, logout
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LoginView
-from django.core.cache import cache
-from django.http import HttpResponseNotFound, HttpResponseServerError
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseNotFound, HttpResponseServerError, StreamingHttpResponse
 from django.shortcuts import redirect, render
-from django.db.models import Count
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import CreateView, DeleteView, DetailView, ListView, UpdateView
 
+from now.caching import get_category_rows, get_city_rows
 from now.forms import AddEventForm, LoginUserForm, RegisterUserForm, UpdateEventForm, UpdateUserForm
-from now.models import Category, CustomUser, Event, UserJoinEvent
-from now.utils import DataMixin
+from now.metrics import registry
+from now.models import Category, CustomUser, Event
+from now.pagination import CursorPaginationMixin
+from now.recommendations import recommended_events
+from now.search import search_events
+from now.services import ATTENDEE_CHUNK_SIZE, ATTENDEE_FIELDS, delete_event, iter_attendees, membership_state, \
+    leave_event, request_spot, city_feed
+from now.utils import ConditionalGetMixin, DataMixin, MembershipMixin, PageCacheMixin, ReplicaReadMixin, \
+    TimeWindowMixin, stream_csv, stream_json
 
 
 class Index(View):
@@ -123,63 +131,75 @@ class UpdateEvent(UpdateView):
         return redirect('event_detail')
 
 
-class Events(ListView):
+class Events(ReplicaReadMixin, ConditionalGetMixin, PageCacheMixin, MembershipMixin, TimeWindowMixin,
+             CursorPaginationMixin, ListView):
     """class Events using for view events."""
 
     # Parameter paginate_by using for control count events on events page
     paginate_by = 3
+    # Parameter cursor_ordering must match Event indexes now_event_feed_idx and now_event_category_feed_idx,
+    # windows of ?when= are ordered by their own indexes
+    cursor_ordering = ('-time_update', '-id')
+    # Parameter count_mode using for show estimated count events without COUNT(*) on every page
+    count_mode = 'approximate'
     model = Event
     template_name = 'now/events.html'
     context_object_name = 'events'
 
     def get_queryset(self):
         """QuerySet filtered events of related category in Event model"""
-        return Event.objects.filter(is_published=True).select_related('category')
+        return self.filter_window(Event.objects.filter(is_published=True)).select_related('category', 'user')
 
 
-class ShowEvent(DataMixin, DetailView):
+class ShowEvent(ReplicaReadMixin, ConditionalGetMixin, PageCacheMixin, DetailView):
     """class ShowEvent using for view detail event`s info."""
 
     model = Event
     template_name = 'now/event_detail.html'
     slug_url_kwarg = 'event_slug'
 
+    def get_queryset(self):
+        """QuerySet get event with category and author in one query"""
+        return Event.objects.select_related('category', 'user')
+
+    def get_validator_parts(self):
+        """Validators from time_update and attendee_count of the event, read from one indexed row"""
+        state = (Event.objects.filter(slug=self.kwargs['event_slug'])
+                 .values_list('time_update', 'attendee_count').first())
+        if state is None:
+            return None, []
+        return state[0], [state[1]]
+
     def get_context_data(self, **kwargs):
         """Method get_context_data create context information for check parameters view template"""
         # Call the base implementation first to get a context
         context = super(ShowEvent, self).get_context_data(**kwargs)
-        event = self.get_event()
-        event_detail_id = event[0].id
-        # Get QuerySet in model UserJoinEvent for check None or not None database
-        user_join_event = UserJoinEvent.objects.filter(event_id=event_detail_id)
-        if user_join_event:
-            # Create context['event_id'] from QuerySet all() for check event_detail_id and event_id in template
-            context['event_id'] = UserJoinEvent.objects.get(event_id=event_detail_id)
+        # Check with one query whether current user has joined this event or waits for a spot
+        context['user_joined'], context['user_waiting'] = membership_state(self.request.user, self.object.pk)
         return context
 
 
-class Categories(ListView):
+class Categories(ReplicaReadMixin, PageCacheMixin, ListView):
     """class Categories using for view event`s categories."""
 
+    page_cache_namespace = 'categories'
     model = Category
     template_name = 'now/categories.html'
     context_object_name = 'categories'
 
     def get_queryset(self):
-        """QuerySet get or create cache and view categories of related events"""
-        cats = cache.get('cats')
-        if not cats:
-            # If not cache get QuerySet and create cache
-            cats = Category.objects.annotate(Count('event'))
-            cache.set('cats', cats, 60)
-        return cats
+        """List of cached category rows with count of published events"""
+        return get_category_rows()
 
 
-class CategoryEvents(ListView):
+class CategoryEvents(ReplicaReadMixin, ConditionalGetMixin, PageCacheMixin, MembershipMixin, TimeWindowMixin,
+                     CursorPaginationMixin, ListView):
     """class CategoryEvents using for view category`s events."""
 
     # Parameter paginate_by using for control count events on category page
     paginate_by = 3
+    cursor_ordering = ('-time_update', '-id')
+    count_mode = 'approximate'
     model = Event
     template_name = 'now/category_events.html'
     context_object_name = 'category_events'
@@ -188,8 +208,88 @@ class CategoryEvents(ListView):
 
     def get_queryset(self):
         """QuerySet filtered events of related category in Event model"""
-        return Event.objects.filter(category__slug=self.kwargs['category_slug'],
-                                    is_published=True).select_related('category')
+        return self.filter_window(Event.objects.filter(category__slug=self.kwargs['category_slug'],
+                                                       is_published=True)).select_related('category', 'user')
+
+    def get_allow_empty(self):
+        # Window of existing category may be empty
+        return self.allow_empty or bool(self.get_window())
+
+
+class NearbyEvents(ReplicaReadMixin, MembershipMixin, CursorPaginationMixin, ListView):
+    """class NearbyEvents using for view events around city of user or city from query string."""
+
+    # Parameter paginate_by using for control count events on nearby page
+    paginate_by = 3
+    # Closest distance ring first, newest first inside a ring, order of now_cityevent_feed_idx
+    cursor_ordering = ('ring', '-feed_time', '-feed_event')
+    model = Event
+    template_name = 'now/nearby.html'
+    context_object_name = 'nearby_events'
+
+    def get(self, request, *args, **kwargs):
+        cities = get_city_rows()
+        slug = request.GET.get('city')
+        if slug:
+            self.city = next((city for city in cities if city.slug == slug), None)
+            if self.city is None:
+                raise Http404('Город не найден')
+        else:
+            city_id = request.user.city_id if request.user.is_authenticated else None
+            self.city = next((city for city in cities if city.id == city_id), None)
+        self.cities = cities
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        """Events of precomputed feed of city, only the current page is read from its index"""
+        if self.city is None:
+            return Event.objects.none()
+        return city_feed(self.city.id).select_related('category', 'user')
+
+    def get_paginate_by(self, queryset):
+        # Without city there is no ring to paginate by
+        return self.paginate_by if self.city is not None else None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['city'] = self.city
+        context['cities'] = self.cities
+        return context
+
+
+class RecommendedEvents(ReplicaReadMixin, LoginRequiredMixin, MembershipMixin, CursorPaginationMixin, ListView):
+    """class RecommendedEvents using for view events recommended to user by joins of the user and of co-attendees."""
+
+    login_url = reverse_lazy('login')
+    # Parameter paginate_by using for control count events on recommended page
+    paginate_by = 3
+    # Best score first, order of now_usereventscore_feed_idx
+    cursor_ordering = ('-rec_score', '-rec_event')
+    model = Event
+    template_name = 'now/recommended.html'
+    context_object_name = 'recommended_events'
+
+    def get_queryset(self):
+        """Events of precomputed feed of user, only the current page is read from its index"""
+        return recommended_events(self.request.user.pk).select_related('category', 'user')
+
+
+class SearchEvents(ReplicaReadMixin, MembershipMixin, ListView):
+    """class SearchEvents using for full-text search of events."""
+
+    # Parameter paginate_by using for control count events on search page
+    paginate_by = 10
+    template_name = 'now/search.html'
+    context_object_name = 'events'
+
+    def get_queryset(self):
+        """Ranked search results, only the current page is read from the full-text index"""
+        return search_events(self.request.GET.get('q', ''))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.request.GET.get('q', '')
+        return context
 
 
 class DeleteEvent(DataMixin, DeleteView):
@@ -200,50 +300,80 @@ class DeleteEvent(DataMixin, DeleteView):
     template_name = 'now/event_confirm_delete.html'
     slug_url_kwarg = 'event_slug'
 
-    def delete(self, request, *args, **kwargs):
-        """Method delete using for delete event"""
-        # Get event get_event() from DataMixin QuerySet
-        event = self.get_event()
-        # Check user joined event for delete
-        self.check_user_joined_event()
-
-        event.delete()
+    def form_valid(self, form):
+        """Method form_valid using for delete event with users joined it"""
+        delete_event(self.object)
+        return redirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse_lazy('home')
 
 
-class UserOutEvent(DataMixin, View):
+class UserOutEvent(LoginRequiredMixin, DataMixin, View):
     """class UserOutEvent using for user exit of event."""
 
+    login_url = reverse_lazy('login')
+
     def get(self, request, *args, **kwargs):
-        """Method get_out_users using for user exit of event"""
-        self.check_user_joined_event()
+        """Method get_out_users using for user exit of event or its waitlist"""
+        leave_event(self.get_event_id(), request.user.id)
 
         return redirect('home')
 
 
-class UserGoEvent(DataMixin, View):
+class UserGoEvent(LoginRequiredMixin, DataMixin, View):
     """class UserGoEvent using for user join of event."""
 
+    login_url = reverse_lazy('login')
+
     def get(self, request, *args, **kwargs):
         """Method get_join_users using for user join of event"""
-        # Get event id (event_detail_id) from QuerySet
-        event = self.get_event()
-        event_detail_id = event[0].id
-        # Method get_or_create from QuerySet model UserJoinEvent using for check repeat database entry
-        user_join_event, created = UserJoinEvent.objects.get_or_create(event_id=event_detail_id,
-                                                                       user_id=request.user.id)
-        user_join_event.pk
-        if created:
-            # Delete user_join_event from model UserJoinEvent if repeat database entry
-            user_join_event.delete()
-        # Save user_join_event from model UserJoinEvent if not repeat database entry
-        user_join_event.save()
+        # Repeat join is rejected by unique constraint (event, user) and does not change counter,
+        # join of full event puts user on its waitlist
+        request_spot(self.get_event_id(), request.user.id)
 
         return redirect('home')
 
 
+class EventAttendees(LoginRequiredMixin, DataMixin, View):
+    """class EventAttendees using for export attendees of event to its organizer."""
+
+    login_url = reverse_lazy('login')
+    # Format: (content type, file extension, stream function)
+    formats = {
+        'csv': ('text/csv; charset=utf-8', 'csv', stream_csv),
+        'json': ('application/json', 'json', stream_json),
+    }
+
+    def get(self, request, *args, **kwargs):
+        """Method get stream attendees of event without loading the whole list in memory"""
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in self.formats:
+            raise Http404('Неизвестный формат')
+        # Only the organizer may export, other users get 404 as for a missing event
+        event_id = self.get_event().filter(user_id=request.user.id).values_list('pk', flat=True).first()
+        if event_id is None:
+            raise Http404('Событие не найдено')
+        content_type, extension, stream = self.formats[fmt]
+        rows = iter_attendees(event_id, chunk_size=ATTENDEE_CHUNK_SIZE)
+        response = StreamingHttpResponse(stream(ATTENDEE_FIELDS, rows, ATTENDEE_CHUNK_SIZE),
+                                         content_type=content_type)
+        response.headers['Content-Disposition'] = (f'attachment; filename="{self.kwargs["event_slug"]}'
+                                                   f'-attendees.{extension}"')
+        return response
+
+
+class Metrics(View):
+    """class Metrics using for export request metrics of now views in Prometheus format."""
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        allowed = request.META.get('REMOTE_ADDR') in settings.NOW_METRICS_ALLOWED_IPS or request.user.is_staff
+        if not allowed:
+            raise Http404
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def page_not_found(request, exception):
     return HttpResponseNotFound(f'<h1> Страница не найдена </h1>')
 
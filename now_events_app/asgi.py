@@ -2,6 +2,7 @@
 ASGI config for now_events_app project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with e.g. ``gunicorn -k uvicorn.workers.UvicornWorker now_events_app.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
@@ -12,5 +13,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'now_events_app.settings')
+# Same urls as WSGI, read-heavy views are replaced with their async variants from now.async_views
+os.environ.setdefault('ROOT_URLCONF', 'now_events_app.asgi_urls')
 
 application = get_asgi_application()
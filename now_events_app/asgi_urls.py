@@ -0,0 +1,12 @@
+from django.urls import include, path
+
+from now import urls as now_urls
+from now_events_app import urls as wsgi_urls
+
+# Root urls of the ASGI deployment, now/urls.py is replaced with now/async_urls.py
+urlpatterns = [
+    path('', include('now.async_urls')) if getattr(pattern, 'urlconf_name', None) is now_urls else pattern
+    for pattern in wsgi_urls.urlpatterns
+]
+# Django reads error handlers from the root urlconf
+handler404 = wsgi_urls.handler404
@@ -41,13 +41,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'captcha',
     'now.apps.NowConfig',
     'bootstrap4',
 ]
 
 MIDDLEWARE = [
+    # First, so queries of session and auth middleware are counted too
+    'now.middleware.MetricsMiddleware',
+    # Outside session middleware, so session saves count as writes which pin the client to the primary
+    'now.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,10 +58,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
+if DEBUG:
+    # The toolbar middleware is sync only, under ASGI it would run every view in a thread
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
 
-ROOT_URLCONF = 'now_events_app.urls'
+# asgi.py switches to now_events_app.asgi_urls with async variants of the read-heavy views
+ROOT_URLCONF = os.environ.get("ROOT_URLCONF", 'now_events_app.urls')
 
 TEMPLATES = [
              {
@@ -93,6 +100,17 @@ DATABASES = {
              }
 }
 
+# Read replicas as comma separated hosts, or database files with SQLite: SQL_REPLICAS=replica.sqlite3
+NOW_REPLICA_DATABASES = []
+for number, replica in enumerate(filter(None, os.environ.get("SQL_REPLICAS", "").split(",")), 1):
+    alias = f'replica{number}'
+    location = "NAME" if DATABASES['default']['ENGINE'].endswith('sqlite3') else "HOST"
+    DATABASES[alias] = {**DATABASES['default'], location: replica.strip(), 'TEST': {'MIRROR': 'default'}}
+    NOW_REPLICA_DATABASES.append(alias)
+DATABASE_ROUTERS = ['now.routers.ReplicaRouter']
+# Seconds reads of a client stay on the primary after it wrote, should exceed the replication lag
+NOW_REPLICA_STICKY_SECONDS = int(os.environ.get("SQL_REPLICA_STICKY_SECONDS", 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -147,12 +165,79 @@ INTERNAL_IPS = [
 ]
 
 
-CACHES = {
-    'default': {
+# Cache backend: 'file', 'locmem', 'redis' or 'tiered' (in-process LRU in front of redis)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "file")
+CACHE_LOCATION = os.environ.get("CACHE_LOCATION", "redis://127.0.0.1:6379/0")
+CACHE_LOCAL_TIMEOUT = int(os.environ.get("CACHE_LOCAL_TIMEOUT", default=5))
+
+CACHE_BACKENDS = {
+    'file': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': os.path.join(BASE_DIR, 'now_cache'),
+    },
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'now',
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': CACHE_LOCATION,
+    },
+}
+
+if CACHE_BACKEND == 'tiered':
+    CACHES = {
+        'default': {
+            'BACKEND': 'now.cache_backends.TieredCache',
+            'LOCATION': 'shared',
+            'OPTIONS': {
+                'LOCAL_TIMEOUT': CACHE_LOCAL_TIMEOUT,
+            },
+        },
+        'shared': CACHE_BACKENDS['redis'],
     }
+else:
+    CACHES = {
+        'default': CACHE_BACKENDS[CACHE_BACKEND],
+    }
+
+# Request metrics of now views are exported at /metrics/ to these addresses and to staff users
+NOW_METRICS_ALLOWED_IPS = INTERNAL_IPS
+# SQL queries allowed per GET request of now views by url name, requests over budget are logged as warnings
+NOW_QUERY_BUDGETS = {
+    'home': 2,
+    # Listings include the COUNT(*) of the paginator, run when the cached estimate_count has expired
+    'events': 5,
+    'category': 6,
+    'event': 5,
+    'categories': 3,
+    'search': 6,
+    'nearby': 5,
+    'recommended': 5,
+    'event_attendees': 3,
+    # Measured on the waitlist paths: join of a full event (failed claim, waitlist insert) and leave
+    # which promotes the head of the queue (membership, capacity check, queue head, two recommendation jobs),
+    # savepoints of nested transactions included
+    'user_join': 11,
+    'user_out': 14,
+    # JSON API: session, user and one page query whatever ?fields= and ?include= ask for
+    'api_events': 3,
+    'api_event': 3,
+    'api_categories': 3,
+    'api_users': 3,
+    'api_memberships': 3,
+    'api_membership': 3,
+    # Writes by (url name, method): form validation of category and city, slug allocation, insert, nearby
+    # feed rows, recommendation job and search index of the event; joins and leaves as user_join and user_out
+    ('api_events', 'POST'): 16,
+    ('api_event', 'PATCH'): 16,
+    ('api_event', 'DELETE'): 12,
+    ('api_memberships', 'POST'): 11,
+    ('api_membership', 'DELETE'): 14,
 }
+# Budget of now views missing from NOW_QUERY_BUDGETS, None disables the check
+NOW_DEFAULT_QUERY_BUDGET = 10
+
 # Is simple captcha
 CAPTCHA_OUTPUT_FORMAT = u'%(text_field)s %(hidden_field)s %(image)s'
 CAPTCHA_NOISE_FUNCTIONS = ('captcha.helpers.noise_null',)
@@ -160,7 +245,3 @@ CAPTCHA_IMAGE_SIZE = (120, 50)
 CAPTCHA_BACKGROUND_COLOR = '#ffffff'
 CAPTCHA_LENGTH = 4
 CAPTCHA_TIMEOUT = 1
-
-
-
-